@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Per-line overhead of ``run_once()`` as a function of the number of children.
+
+All children share the same shutdown future (as they did before each instance
+got its own) and only one of them produces output.  Children are simulated
+in-process so that the measurement only includes the supervisor's own work.
+The per-line overhead should not depend on the number of children.
+
+Usage::
+
+   python benchmarks/bench_children.py [--lines N] [--children N ...]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from helpers import CountingOutput  # noqa: E402
+from strawboss import run_once  # noqa: E402
+
+
+class FakeProcess(object):
+    """In-process stand-in for an asyncio ``Process`` object."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.stdout = asyncio.StreamReader()
+        self.stderr = asyncio.StreamReader()
+        self._future = asyncio.Future()
+
+    def wait(self):
+        return self._future
+
+    def send_signal(self, signum):
+        if self._future.done():
+            raise ProcessLookupError
+        self.stdout.feed_eof()
+        self.stderr.feed_eof()
+        self._future.set_result(-signum)
+
+    def kill(self):
+        self.send_signal(9)
+
+
+@asyncio.coroutine
+def measure(children, lines, loop):
+    processes = []
+
+    @asyncio.coroutine
+    def spawn(*args, **kwds):
+        processes.append(FakeProcess(len(processes) + 1))
+        return processes[-1]
+
+    shutdown = asyncio.Future()
+    output = CountingOutput()
+    with mock.patch('asyncio.create_subprocess_exec', side_effect=spawn):
+        tasks = [
+            loop.create_task(run_once(
+                'worker.%d' % i, 'work', None, shutdown,
+                loop=loop, output=output,
+            ))
+            for i in range(children)
+        ]
+        while len(processes) < children:
+            yield from asyncio.sleep(0.0)
+    # Wait until the "spawned" messages are out of the way.
+    while output.lines < children:
+        yield from asyncio.sleep(0.0)
+    # Send one line at a time from the first child and wait until it's
+    # forwarded, so that each line costs a full trip through the supervisor.
+    stream = processes[0].stdout
+    started = time.perf_counter()
+    for _ in range(lines):
+        output.event.clear()
+        stream.feed_data(b'Hello, world!\n')
+        yield from output.event.wait()
+    elapsed = time.perf_counter() - started
+    shutdown.set_result(None)
+    yield from asyncio.wait(tasks)
+    return elapsed
+
+
+def main(arguments=None):
+    cli = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    cli.add_argument('--lines', type=int, default=20000)
+    cli.add_argument('--children', type=int, nargs='+',
+                     default=[1, 10, 100, 1000])
+    arguments = cli.parse_args(arguments)
+    loop = asyncio.get_event_loop()
+    results = []
+    for children in arguments.children:
+        elapsed = loop.run_until_complete(
+            measure(children, arguments.lines, loop)
+        )
+        results.append({
+            'children': children,
+            'lines': arguments.lines,
+            'seconds': elapsed,
+            'usec_per_line': elapsed / arguments.lines * 1e6,
+        })
+    loop.close()
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
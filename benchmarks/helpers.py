@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers shared by the benchmark scripts."""
+
+import asyncio
+import time
+
+
+class CountingOutput(object):
+    """Output writer that counts lines instead of writing them.
+
+    :param loop: Event loop of the events.  When ``None``, the default event
+       loop is used.
+    """
+
+    def __init__(self, loop=None):
+        self.lines = 0
+        """Number of lines written (including the supervisor's messages)."""
+        self.spawns = 0
+        """Number of processes reported as spawned."""
+        self.first_line = None
+        """Time (from ``time.perf_counter()``) of the first "ready" line."""
+        self.first_line_event = asyncio.Event(loop=loop)
+        """Event set once the first "ready" line is written."""
+        self.event = asyncio.Event(loop=loop)
+        """Event set on each write (clear it to wait for the next one)."""
+
+    @asyncio.coroutine
+    def write(self, text, count=1):
+        self.lines += count
+        if ' spawned.' in text:
+            self.spawns += 1
+        elif self.first_line is None and 'ready' in text:
+            self.first_line = time.perf_counter()
+            self.first_line_event.set()
+        self.event.set()
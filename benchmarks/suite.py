@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""Throughput and latency benchmark suite for the supervisor.
+
+Runs locally (no network needed) and prints results as JSON so that they can
+be compared between releases.  The suite covers:
+
+``throughput``
+   Lines per second forwarded by ``run_once()`` for various line sizes and
+   numbers of children (from the first spawn to the last exit).
+``first_line``
+   Latency between the call to ``run_once()`` and the first line of output
+   from the child.
+``respawn``
+   Number of processes re-spawned per second by ``run_and_respawn()`` for a
+   child that exits right away.
+``shutdown``
+   Time it takes a supervisor (started with ``strawboss``'s ``main()`` in a
+   separate process) to exit after SIGINT, along with its peak RSS.
+``rss``
+   Peak RSS of this process after the in-process benchmarks, which run the
+   same code as the supervisor.
+
+All in-process benchmarks format output as text unless ``--format json`` is
+given, which allows comparing the cost of both output formats, and run on
+the default asyncio event loop unless ``--loop uvloop`` is given.
+
+Usage::
+
+   python benchmarks/suite.py [--quick] [--only name ...] [--format json]
+                              [--loop uvloop]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from helpers import CountingOutput  # noqa: E402
+from strawboss import RespawnPolicy, run_and_respawn, run_once  # noqa: E402
+from strawboss.output import JSONFormat, TextFormat, Timestamps  # noqa: E402
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+CHILD = 'import sys; sys.stdout.write(%r * %d)'
+
+SUPERVISOR = 'import sys; from strawboss import main; sys.exit(main())'
+
+
+def python_child(line_size, lines):
+    line = 'x' * (line_size - 1) + '\n'
+    return [sys.executable, '-c', CHILD % (line, lines)]
+
+
+@asyncio.coroutine
+def throughput(loop, formatter, line_size, children, lines):
+    output = CountingOutput(loop)
+    shutdown = asyncio.Future(loop=loop)
+    started = time.perf_counter()
+    yield from asyncio.wait([
+        run_once(
+            'worker.%d' % i, python_child(line_size, lines // children),
+            None, shutdown, loop=loop, output=output, formatter=formatter,
+        )
+        for i in range(children)
+    ], loop=loop)
+    elapsed = time.perf_counter() - started
+    return {
+        'line_size': line_size,
+        'children': children,
+        'lines': lines,
+        'seconds': elapsed,
+        'lines_per_sec': lines / elapsed,
+        'mib_per_sec': lines * line_size / elapsed / 2**20,
+    }
+
+
+@asyncio.coroutine
+def first_line(loop, formatter, samples):
+    latency = []
+    for _ in range(samples):
+        output = CountingOutput(loop)
+        shutdown = asyncio.Future(loop=loop)
+        started = time.perf_counter()
+        task = loop.create_task(run_once(
+            'worker.0', [sys.executable, '-c', 'print("ready")'],
+            None, shutdown, loop=loop, output=output, formatter=formatter,
+        ))
+        yield from output.first_line_event.wait()
+        latency.append(output.first_line - started)
+        yield from task
+    latency.sort()
+    return {
+        'samples': samples,
+        'msec_mean': sum(latency) / samples * 1e3,
+        'msec_median': latency[samples // 2] * 1e3,
+        'msec_max': latency[-1] * 1e3,
+    }
+
+
+@asyncio.coroutine
+def respawn(loop, formatter, duration):
+    output = CountingOutput(loop)
+    shutdown = asyncio.Future(loop=loop)
+    policy = RespawnPolicy(delay=0.0, min_uptime=0.0, crash_limit=0)
+    loop.call_later(duration, shutdown.set_result, None)
+    started = time.perf_counter()
+    yield from run_and_respawn(
+        shutdown, loop=loop, respawn=policy, output=output,
+        formatter=formatter,
+        name='worker.0', cmd=[shutil.which('true') or 'true'], env=None,
+    )
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': elapsed,
+        'spawns': output.spawns,
+        'spawns_per_sec': output.spawns / elapsed,
+    }
+
+
+def shutdown(children):
+    """Measure shutdown latency of a real supervisor process."""
+    with tempfile.TemporaryDirectory() as folder:
+        with open(os.path.join(folder, 'Procfile'), 'w') as stream:
+            stream.write('sleeper: sleep 600\n')
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        process = subprocess.Popen(
+            [sys.executable, '-c', SUPERVISOR,
+             '--no-env', '--scale', '*:%d' % children],
+            cwd=folder, env=env, stdout=subprocess.PIPE,
+        )
+        spawned = 0
+        while spawned < children:
+            line = process.stdout.readline()
+            if not line:
+                raise RuntimeError('Supervisor exited early.')
+            spawned += line.endswith(b' spawned.\n')
+        started = time.perf_counter()
+        process.send_signal(signal.SIGINT)
+        process.stdout.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - started
+        process.returncode = status
+        process.stdout.close()
+    return {
+        'children': children,
+        'msec': elapsed * 1e3,
+        # NOTE: the supervisor's children are ``sleep`` processes, which are
+        #       much smaller than the supervisor itself.
+        'peak_rss_kib': usage.ru_maxrss,
+    }
+
+
+def peak_rss():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {'peak_rss_kib': usage.ru_maxrss}
+
+
+def make_loop(kind):
+    """Returns a new event loop of the given kind, set as the current one.
+
+    :raise ImportError: ``kind`` is ``'uvloop'``, but uvloop is not installed.
+    """
+    if kind == 'uvloop':
+        import uvloop
+        loop = uvloop.new_event_loop()
+    else:
+        loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    if kind != 'uvloop':
+        asyncio.get_child_watcher().attach_loop(loop)
+    return loop
+
+
+def main(arguments=None):
+    cli = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    cli.add_argument('--quick', action='store_true', default=False,
+                     help="Smaller workloads, for a quick sanity check.")
+    cli.add_argument('--only', nargs='+', default=None, choices=[
+        'throughput', 'first_line', 'respawn', 'shutdown', 'rss',
+    ])
+    cli.add_argument('--format', choices=['text', 'json'], default='text')
+    cli.add_argument('--loop', choices=['asyncio', 'uvloop'],
+                     default='asyncio')
+    arguments = cli.parse_args(arguments)
+    selected = set(arguments.only or [
+        'throughput', 'first_line', 'respawn', 'shutdown', 'rss',
+    ])
+    scale = 10 if arguments.quick else 1
+
+    try:
+        loop = make_loop(arguments.loop)
+    except ImportError:
+        cli.error('uvloop is not installed.')
+
+    if arguments.format == 'json':
+        formatter = JSONFormat(Timestamps())
+    else:
+        formatter = TextFormat(Timestamps())
+
+    results = {
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'format': arguments.format,
+        'loop': arguments.loop,
+    }
+    if 'throughput' in selected:
+        results['throughput'] = [
+            loop.run_until_complete(throughput(
+                loop, formatter, line_size, children, lines // scale,
+            ))
+            for line_size, lines in [(16, 2000000), (128, 1000000),
+                                     (1024, 200000), (16384, 20000)]
+            for children in (1, 10, 100)
+        ]
+    if 'first_line' in selected:
+        results['first_line'] = loop.run_until_complete(
+            first_line(loop, formatter, 100 // scale)
+        )
+    if 'respawn' in selected:
+        results['respawn'] = loop.run_until_complete(
+            respawn(loop, formatter, 5.0 / scale)
+        )
+    if 'shutdown' in selected:
+        results['shutdown'] = [
+            shutdown(children) for children in sorted({1, 10, 100 // scale})
+        ]
+    if 'rss' in selected:
+        results['rss'] = peak_rss()
+    loop.close()
+
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -48,4 +48,9 @@ setup(
         'procfile',
         'python-dateutil',
     ],
+    extras_require={
+        'uvloop': [
+            'uvloop',
+        ],
+    },
 )
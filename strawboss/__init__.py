@@ -2,43 +2,65 @@
 
 import argparse
 import asyncio
-import datetime
-import dotenvfile
+import collections
+import copy
+import functools
+import importlib
 import itertools
 import os
-import pkg_resources
-import procfile
+import random
 import re
 import shlex
 import signal
+import subprocess
 import sys
-import dateutil.tz
+
+from strawboss.output import (
+    DECODE_ERRORS,
+    MAX_LINE_LENGTH,
+    MIN_LINE_LENGTH,
+    OUTPUT_FORMATS,
+    OUTPUT_POLICIES,
+    READ_SIZE,
+    TIMESTAMP_FORMATS,
+    TIMESTAMP_PRECISIONS,
+    JSONFormat,
+    LineSplitter,
+    OutputWriter,
+    TextFormat,
+    Timestamps,
+    write_output,
+)
+from strawboss.protocol import TRANSPORTS, create_protocol_subprocess
 
 
 # TODO: move shlex.split into procfile parser.
 # TOOD: make command environment a dict in procfile parser.
 
 
-def now(utc=False):
-    """Returns the current time.
-
-    :param utc: If ``True``, returns a timezone-aware ``datetime`` object in
-       UTC.  When ``False`` (the default), returns a naive ``datetime`` object
-       in local time.
-    :return: A ``datetime`` object representing the current time at the time of
-       the call.
-    """
-    if utc:
-        return datetime.datetime.utcnow().replace(tzinfo=dateutil.tz.tzutc())
-    else:
-        return datetime.datetime.now()
+def _read_version():
+    """Reads the package version from ``version.txt``."""
+    # NOTE: ``pkg_resources`` scans all installed distributions when imported,
+    #       which makes startup much slower, so read the file directly.
+    path = os.path.join(os.path.dirname(__file__), 'version.txt')
+    with open(path, 'rb') as stream:
+        return stream.read().decode('utf-8').strip()
 
 
-version = pkg_resources.resource_string('strawboss', 'version.txt')
-version = version.decode('utf-8').strip()
+version = _read_version()
 """Package version (as a dotted string)."""
 
 
+EOF_TIMEOUT = 1.0
+"""Time (in seconds) to wait for a child's output after it completes.
+
+The output pipes are usually closed as soon as the child completes, unless it
+left processes behind that inherited them.  Output is read for as long as it
+is being written (e.g. slowly, when the output applies back-pressure): this
+only applies once no output has been written for that long.
+"""
+
+
 class ListOverride(argparse.Action):
     """Similar to ``append`` action, but replaces default."""
 
@@ -63,6 +85,240 @@ def parse_scale(x):
     return match.group(1), int(match.group(2))
 
 
+def parse_crash_loop(x):
+    """Splits a "%d:%f" string and returns the number and duration.
+
+    :return: An ``(int, float)`` pair extracted from ``x``.
+
+    :raise ValueError: the string ``x`` does not respect the input format.
+    """
+    match = re.match(r'^(\d+):(\d+(?:\.\d*)?)$', x)
+    if not match:
+        raise ValueError('Invalid crash loop threshold "%s".' % x)
+    return int(match.group(1)), float(match.group(2))
+
+
+def parse_signal(x):
+    """Converts a signal name (e.g. "SIGTERM" or "TERM") or number to a signal.
+
+    :raise ValueError: the string ``x`` is not a valid signal.
+    """
+    try:
+        if x.isdigit():
+            return signal.Signals(int(x))
+        name = x.upper()
+        if not name.startswith('SIG'):
+            name = 'SIG' + name
+        return signal.Signals[name]
+    except (KeyError, ValueError):
+        raise ValueError('Invalid signal "%s".' % x)
+
+
+def parse_grace_period(x):
+    """Converts a duration in seconds to a float, rejecting negative values.
+
+    :raise ValueError: the string ``x`` is not a valid duration.
+    """
+    seconds = float(x)
+    if seconds < 0.0:
+        raise ValueError('Invalid grace period "%s".' % x)
+    return seconds
+
+
+def parse_interval(x):
+    """Converts a duration in seconds to a float, rejecting values <= 0.
+
+    This is meant for delays between repeated actions, which would otherwise
+    keep the event loop busy.
+
+    :raise ValueError: the string ``x`` is not a valid interval.
+    """
+    seconds = float(x)
+    if not seconds > 0.0:
+        raise ValueError('Invalid interval "%s".' % x)
+    return seconds
+
+
+def parse_line_length(x):
+    """Converts a maximum line length (a size, see :py:func:`parse_size`).
+
+    :raise ValueError: the string ``x`` is not a valid size or is less than
+       :py:data:`~strawboss.output.MIN_LINE_LENGTH`.
+    """
+    length = parse_size(x)
+    if length < MIN_LINE_LENGTH:
+        raise ValueError('Invalid maximum line length "%s".' % x)
+    return length
+
+
+def parse_sink(x):
+    """Parses the destination of one of the output streams of children.
+
+    :return: ``'terminal'``, ``'discard'`` or the path to a file.
+    """
+    if not x.strip():
+        raise ValueError('Invalid output destination "%s".' % x)
+    return x
+
+
+def parse_size(x):
+    """Converts a size in bytes, with an optional K, M or G suffix, to an int.
+
+    :raise ValueError: the string ``x`` is not a valid size.
+    """
+    match = re.match(r'^(\d+)([KMG]?)$', x.strip().upper())
+    if not match:
+        raise ValueError('Invalid size "%s".' % x)
+    return int(match.group(1)) * 1024 ** ' KMG'.index(match.group(2) or ' ')
+
+
+def parse_rate_limit(x):
+    """Splits a "%f[:%d]" string into a rate (lines per second) and a burst.
+
+    :return: A ``(float, int)`` pair extracted from ``x``.  The burst is
+       ``None`` when it is omitted.
+
+    :raise ValueError: the string ``x`` does not respect the input format.
+    """
+    match = re.match(r'^(\d+(?:\.\d*)?)(?::(\d+))?$', x)
+    if not match:
+        raise ValueError('Invalid rate limit "%s".' % x)
+    burst = match.group(2)
+    return float(match.group(1)), int(burst) if burst else None
+
+
+def parse_sample(x):
+    """Converts a sampling rate ("keep one line in N") to a positive int.
+
+    :raise ValueError: the string ``x`` is not a valid sampling rate.
+    """
+    if not x.isdigit() or int(x) < 1:
+        raise ValueError('Invalid sampling rate "%s".' % x)
+    return int(x)
+
+
+def parse_percent(x):
+    """Converts a positive percentage (e.g. "150" or "50.5") to a float.
+
+    :raise ValueError: the string ``x`` is not a valid percentage.
+    """
+    if not re.match(r'^\d+(?:\.\d*)?$', x) or float(x) <= 0.0:
+        raise ValueError('Invalid percentage "%s".' % x)
+    return float(x)
+
+
+def parse_watchdog_action(x):
+    """Checks that ``x`` is one of the watchdog's actions.
+
+    :raise ValueError: ``x`` is not in
+       :py:data:`~strawboss.watchdog.ACTIONS`.
+    """
+    # NOTE: only import this when needed to keep startup fast.
+    from strawboss.watchdog import ACTIONS
+    if x not in ACTIONS:
+        raise ValueError('Invalid watchdog action "%s".' % x)
+    return x
+
+
+def _lazy_parser(module, name):
+    """Builds a parser that imports its module on first use.
+
+    Options of features that are seldom used are parsed by their own module,
+    which is only imported when the option is given.
+
+    :param module: Name of the module that defines the parser.
+    :param name: Name of the parser in ``module``.
+    """
+    def parse(x):
+        # NOTE: only import this when needed to keep startup fast.
+        return getattr(importlib.import_module(module), name)(x)
+    parse.__name__ = name
+    return parse
+
+
+parse_address = _lazy_parser('strawboss.sockets', 'parse_address')
+parse_cpus = _lazy_parser('strawboss.resources', 'parse_cpus')
+parse_dependencies = _lazy_parser('strawboss.readiness', 'parse_dependencies')
+parse_ionice = _lazy_parser('strawboss.resources', 'parse_ionice')
+parse_nice = _lazy_parser('strawboss.resources', 'parse_nice')
+parse_probe = _lazy_parser('strawboss.readiness', 'parse_probe')
+parse_rlimit = _lazy_parser('strawboss.resources', 'parse_rlimit')
+
+
+def per_process_type(convert):
+    """Builds a parser for "%s:%s" (process type and value) strings.
+
+    :param convert: Function that parses the value.
+    :return: A function that returns a ``(string, value)`` pair.
+    """
+    def parse(x):
+        match = re.match(r'^(.+?):(.+)$', x)
+        if not match:
+            raise ValueError('Invalid value "%s".' % x)
+        return match.group(1), convert(match.group(2))
+    parse.__name__ = convert.__name__
+    return parse
+
+
+def lookup_process_type(values, label):
+    """Finds the value of a per-process type option.
+
+    :param values: Sequence of ``(string, value)`` pairs, as parsed by the
+       function returned by :py:func:`per_process_type`.  The special ``'*'``
+       process type is used as a fallback for process types that are not
+       listed.
+    :param label: Name of the process type.
+    :return: The value for the process type.
+    """
+    values = dict(values)
+    return values.get(label, values.get('*'))
+
+
+def lookup_instance(values, name):
+    """Finds the value of a per-process type option for an instance.
+
+    :param values: Sequence of ``(string, value)`` pairs, as parsed by the
+       function returned by :py:func:`per_process_type`.  Values can be given
+       for an instance (e.g. ``'web.1'``), for its process type (e.g.
+       ``'web'``) or for all process types (``'*'``), in decreasing order of
+       precedence.
+    :param name: Name of the instance.
+    :return: A ``(string, value)`` pair with the key that matched and its
+       value, or ``(None, None)`` if there is no value for the instance.
+    """
+    values = dict(values)
+    for key in (name, name.rsplit('.', 1)[0], '*'):
+        if key in values:
+            return key, values[key]
+    return None, None
+
+
+LOOPS = ('auto', 'asyncio', 'uvloop')
+"""Supported event loop implementations."""
+
+
+def make_event_loop(kind='auto'):
+    """Returns the event loop to run the supervisor on.
+
+    :param kind: One of ``'asyncio'`` (the default event loop), ``'uvloop'``
+       (a new event loop from the ``uvloop`` package) or ``'auto'`` (uvloop
+       when it is installed, asyncio otherwise).
+    :return: An event loop, which is also set as the current event loop.
+    :raise ImportError: ``kind`` is ``'uvloop'``, but uvloop is not installed.
+    """
+    if kind == 'asyncio':
+        return asyncio.get_event_loop()
+    try:
+        import uvloop
+    except ImportError:
+        if kind == 'uvloop':
+            raise
+        return asyncio.get_event_loop()
+    loop = uvloop.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
 def merge_envs(*args):
     """Union of one or more dictionaries.
 
@@ -82,14 +338,235 @@ def merge_envs(*args):
 
 
 @asyncio.coroutine
-def run_once(name, cmd, env, shutdown, loop=None, utc=False):
+def _write_output(text, count=1):
+    """Coroutine wrapper for :py:func:`~strawboss.output.write_output`."""
+    write_output(text)
+
+
+def _writer(output):
+    """Returns the coroutine function used to write to ``output``."""
+    if output is None:
+        return _write_output
+    return output.write
+
+
+def signal_name(signum):
+    """Returns the name of a signal (e.g. ``'SIGTERM'``)."""
+    try:
+        return signal.Signals(signum).name
+    except ValueError:
+        return 'signal %d' % signum
+
+
+@asyncio.coroutine
+def _forward_output(stream, format, write, limiter=None,
+                    splitter=LineSplitter, count=None):
+    """Forwards one output stream of a child process.
+
+    Output is read in large chunks and forwarded in batches: all lines
+    completed by a chunk share the same timestamp and are written to the
+    stream's sink in a single call.  When a ``limiter`` is given, lines it
+    rejects are dropped before they are formatted.  Lines are split using a
+    new object returned by ``splitter``.  When given, ``count`` is called with
+    the number of lines forwarded and bytes read for each chunk.
+    """
+    splitter = splitter()
+    while True:
+        data = yield from stream.read(READ_SIZE)
+        if not data:
+            break
+        lines = splitter.feed(data)
+        if lines and limiter is not None:
+            lines = limiter.filter(lines)
+        if count is not None:
+            count(len(lines), len(data))
+        if lines:
+            yield from write(format(lines), len(lines))
+    lines = splitter.flush()
+    if lines and limiter is not None:
+        lines = limiter.filter(lines)
+    if lines and count is not None:
+        count(len(lines), 0)
+    if lines:
+        yield from write(format(lines), len(lines))
+
+
+@asyncio.coroutine
+def _discard_output(stream):
+    """Reads one output stream of a child process until EOF, discarding it."""
+    while (yield from stream.read(READ_SIZE)):
+        pass
+
+
+class _OutputActivity(object):
+    """Tracks writes of a child's output, to tell when reading it stalls."""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._pending = 0
+        self._last = loop.time()
+
+    def wrap(self, write):
+        """Wraps a coroutine function that writes output."""
+        @asyncio.coroutine
+        def wrapper(*args):
+            self._pending += 1
+            try:
+                return (yield from write(*args))
+            finally:
+                self._pending -= 1
+                self._last = self._loop.time()
+        return wrapper
+
+    @asyncio.coroutine
+    def wait(self, reader, timeout):
+        """Wait for ``reader`` while output is being written.
+
+        .. note:: This function is a coroutine.
+
+        :return: ``True`` if ``reader`` completed, ``False`` if no output was
+           written for ``timeout`` seconds.
+        """
+        while True:
+            yield from asyncio.wait([reader], timeout=timeout, loop=self._loop)
+            if reader.done():
+                return True
+            idle = self._loop.time() - self._last
+            if not self._pending and idle >= timeout:
+                return False
+
+
+@asyncio.coroutine
+def _forward_streams(process, name, write, sinks, formatter, loop=None,
+                     limiter=None, splitter=LineSplitter, metrics=None,
+                     timers=None):
+    """Forwards output of a child process started by :py:func:`run_once`.
+
+    Both stdout and stderr are drained at the same time so that a child
+    blocked on one of them never stalls the other.  Once both streams are
+    exhausted, the EOF is reported to ``write``.
+    """
+    readers = []
+    for key in ('stdout', 'stderr'):
+        stream = getattr(process, key)
+        if sinks[key] is None:
+            readers.append(_discard_output(stream))
+        else:
+            count = None
+            if metrics is not None:
+                count = functools.partial(metrics.forwarded, name, key)
+            if timers is not None:
+                stream = timers.wrap(stream, read='read')
+            readers.append(_forward_output(
+                stream, formatter.stream(name, process.pid, key), sinks[key],
+                limiter, splitter, count,
+            ))
+    yield from asyncio.gather(*readers, loop=loop)
+    yield from write(formatter.status(
+        'EOF from %s(%d).' % (name, process.pid), name, process.pid,
+    ))
+
+
+@asyncio.coroutine
+def _report_suppressed(limiter, process, name, write, formatter, interval,
+                       loop=None, metrics=None):
+    """Periodically reports lines suppressed by :py:func:`run_once`."""
+    while True:
+        yield from asyncio.sleep(interval, loop=loop)
+        yield from _write_suppressed(
+            limiter, process, name, write, formatter, metrics,
+        )
+
+
+@asyncio.coroutine
+def _write_suppressed(limiter, process, name, write, formatter,
+                      metrics=None):
+    """Reports lines suppressed since the last report, if any."""
+    suppressed = limiter.report()
+    if suppressed and metrics is not None:
+        metrics.suppressed[name] += suppressed
+    if suppressed:
+        yield from write(formatter.status(
+            '%s: %d lines suppressed.' % (name, suppressed),
+            name, process.pid,
+        ))
+
+
+def _sink(output, default):
+    """Returns the coroutine function used to write one stream's output."""
+    if output is None:
+        return default
+    if output is False:
+        return None
+    return output.write
+
+
+@asyncio.coroutine
+def _stop(process, name, write, formatter, stop_signal, grace_period,
+          loop=None):
+    """Stops a child process started by :py:func:`run_once`.
+
+    The process is sent ``stop_signal`` and, if it is still running after
+    ``grace_period`` seconds, SIGKILL.
+
+    NOTE: shutdown is asynchronous unless the process completion notification
+          is "in flight".  We forward the request to shutdown and let the
+          caller wait until the child process completes.
+    """
+    if grace_period <= 0:
+        yield from _kill(process, name, write, formatter)
+        return
+    try:
+        process.send_signal(stop_signal)
+    except ProcessLookupError:
+        return
+    yield from write(formatter.status('%s(%d) sent %s.' % (
+        name, process.pid, signal_name(stop_signal),
+    ), name, process.pid))
+    yield from asyncio.sleep(grace_period, loop=loop)
+    yield from _kill(process, name, write, formatter)
+
+
+@asyncio.coroutine
+def _kill(process, name, write, formatter):
+    """Sends SIGKILL to a child process started by :py:func:`run_once`."""
+    try:
+        process.kill()
+    except ProcessLookupError:
+        return
+    yield from write(formatter.status(
+        '%s(%d) killed.' % (name, process.pid), name, process.pid,
+    ))
+
+
+@asyncio.coroutine
+def _wait_ready(probe, process, name, write, formatter, ready, loop=None):
+    """Report when a process passes its readiness probe."""
+    yield from probe.wait(loop)
+    yield from write(formatter.status(
+        '%s(%d) is ready.' % (name, process.pid), name, process.pid,
+    ))
+    if ready is not None:
+        ready(name, process.pid)
+
+
+@asyncio.coroutine
+def run_once(name, cmd, env, shutdown, loop=None, utc=False, output=None,
+             timestamps=None, stop_signal=signal.SIGTERM, grace_period=10.0,
+             transport='stream', formatter=None, stdout=None, stderr=None,
+             limits=None, decode_errors='replace',
+             max_line_length=MAX_LINE_LENGTH, metrics=None, timers=None,
+             preexec_fn=None, watchdog=None, probe=None, ready=None,
+             listen_fds=None):
     """Starts a child process and waits for its completion.
 
     .. note:: This function is a coroutine.
 
-    Standard output and error streams are captured and forwarded to the parent
-    process' standard output.  Each line is prefixed with the current time (as
-    measured by the parent process) and the child process ``name``.
+    Standard output and error streams are captured separately and forwarded to
+    the parent process' standard output (or to the sinks given by ``stdout``
+    and ``stderr``).  Each line is prefixed with the current time (as measured
+    by the parent process) and the child process ``name``.  Lines from the
+    standard error stream are tagged with ``stderr``.
 
     :param name: Label for the child process.  Will be used as a prefix to all
        lines captured by this child process.
@@ -102,14 +579,64 @@ def run_once(name, cmd, env, shutdown, loop=None, utc=False):
        process.  If ``None``, the parent's environment will be inherited as it.
        If a ``dict`` is provided, this will overwrite the entire environment;
        it is the caller's responsibility to merge this with the parent's
-       environment if they see fit.
+       environment if they see fit.  An
+       :py:class:`~strawboss.environment.Environment` can be passed instead
+       of a ``dict`` to reuse the same encoded environment for each spawn.
     :param shutdown: Future that the caller will fulfill to indicate that the
-       process should be killed early.  When this is set, the process is sent
-       SIGINT and then is let complete naturally.
+       process should be stopped early.  When this is set, the process is sent
+       ``stop_signal`` and is let complete naturally.  If it is still running
+       after ``grace_period`` seconds, it is killed.
     :param loop: Event loop to use.  When ``None``, the default event loop is
        used.
     :param utc: When ``True``, the timestamps are logged using the current time
        in UTC.
+    :param output: :py:class:`~strawboss.output.OutputWriter` shared by all
+       child processes.  When ``None``, output is written directly to the
+       standard output.
+    :param timestamps: :py:class:`~strawboss.output.Timestamps` used to
+       format the timestamps.  When ``None``, timestamps are formatted in ISO
+       8601 format (in UTC if ``utc`` is ``True``).
+    :param stop_signal: Signal sent to the process to ask it to stop.
+    :param grace_period: Time (in seconds) the process is given to complete
+       after it is sent ``stop_signal``.  When it expires, the process is sent
+       SIGKILL.  When zero, the process is killed right away.
+    :param transport: How to read the process' output.  With ``'stream'``,
+       output is read using asyncio streams.  With ``'protocol'``, output is
+       forwarded by a :py:class:`~strawboss.protocol.OutputProtocol`, which
+       avoids copying the output in and out of a stream's buffer.
+    :param formatter: :py:class:`~strawboss.output.TextFormat` or
+       :py:class:`~strawboss.output.JSONFormat` used to format the output.
+       When ``None``, output is formatted as text using ``timestamps``.
+    :param stdout: :py:class:`~strawboss.output.OutputWriter` for lines from
+       the process' standard output stream.  When ``None``, ``output`` is
+       used.  When ``False``, the stream is discarded.
+    :param stderr: Same as ``stdout``, for the standard error stream.
+    :param limits: :py:class:`~strawboss.limits.OutputLimits` used to rate
+       limit and sample the process' output.  The number of lines suppressed
+       by rate limiting is reported periodically.  When ``None``, all lines
+       are forwarded.
+    :param decode_errors: How to handle output that isn't valid UTF-8 (see
+       :py:data:`~strawboss.output.DECODE_ERRORS`).
+    :param max_line_length: Lines longer than this are forwarded as several
+       consecutive fragments.  This also bounds the memory used to hold a
+       partial line, no matter what the process writes.
+    :param metrics: :py:class:`~strawboss.metrics.Metrics` that records the
+       process' spawn, exit and output.
+    :param timers: :py:class:`~strawboss.profiling.StageTimers` that measure
+       the time spent in each stage of the output pipeline.
+    :param preexec_fn: Function called in the child process just before the
+       command is executed (e.g.
+       :py:meth:`~strawboss.resources.ResourceLimits.apply`).
+    :param watchdog: :py:class:`~strawboss.watchdog.Watchdog` that watches
+       the process' resource usage.
+    :param probe: :py:class:`~strawboss.readiness.Probe` that tells when the
+       process is ready.  Readiness is reported in the output.
+    :param ready: Function called with ``name`` and the process ID when the
+       process is ready (requires ``probe``).
+    :param listen_fds: File descriptors of listening sockets passed to the
+       process as file descriptors 3, 4, etc., along with the ``LISTEN_FDS``
+       and ``LISTEN_PID`` environment variables (like systemd's socket
+       activation).
     :return: A future that will be completed when the process has completed.
        Upon completion, the future's result will contain the process' exit
        status.
@@ -119,90 +646,269 @@ def run_once(name, cmd, env, shutdown, loop=None, utc=False):
     # Get the default event loop if necessary.
     loop = loop or asyncio.get_event_loop()
 
+    # Use a private timestamp cache if none is shared with us.
+    formatter = formatter or TextFormat(timestamps or Timestamps(utc=utc))
+
+    # Send output to the shared writer, if any.
+    write = _writer(output)
+    sinks = {
+        'stdout': _sink(stdout, write),
+        'stderr': _sink(stderr, write),
+    }
+
+    # Keep reading output after the process completes while it's written.
+    activity = _OutputActivity(loop)
+    sinks = {
+        key: sink and activity.wrap(sink) for key, sink in sinks.items()
+    }
+
+    # Share a single limiter between both output streams.
+    limiter = None
+    if limits is not None:
+        limiter = limits.limiter()
+
+    # Each output stream gets its own splitter.
+    splitter = functools.partial(
+        LineSplitter, errors=decode_errors, max_length=max_line_length,
+    )
+
+    # Watch the output for the readiness probe (before rate limiting).
+    if probe is not None:
+        probe = probe.instance()
+        splitter = probe.splitter(splitter)
+
+    # Measure the time spent in each stage of the output pipeline.
+    pipeline = formatter
+    if timers is not None:
+        pipeline = timers.formatter(formatter)
+        splitter = timers.splitter(splitter)
+        if limiter is not None:
+            limiter = timers.wrap(limiter, filter='filter', report=None)
+        sinks = {
+            key: sink and timers.coroutine('write', sink)
+            for key, sink in sinks.items()
+        }
+
     # Launch the command into a child process.
     if isinstance(cmd, str):
         cmd = shlex.split(cmd)
-    process = yield from asyncio.create_subprocess_exec(
-        *cmd,
-        env=env,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.STDOUT,
-    )
-    print('%s [strawboss] %s(%d) spawned.' % (
-        now(utc).isoformat(), name, process.pid
+    close_fds = True
+    if listen_fds:
+        from strawboss.sockets import LISTEN_COMMAND, inherit_fds, listen_env
+        cmd = LISTEN_COMMAND + list(cmd)
+        env = listen_env(env, listen_fds)
+        preexec_fn = functools.partial(inherit_fds, listen_fds, preexec_fn)
+        # NOTE: ``preexec_fn`` runs before ``close_fds`` takes effect, which
+        #       would close the sockets once moved to 3, 4, etc.  Leave that
+        #       to close-on-exec flags: all file descriptors the supervisor
+        #       opens are non-inheritable (see PEP 446), so the child only
+        #       gets its sockets and standard streams.  The sockets can't be
+        #       moved by the ``/bin/sh`` wrapper since POSIX shells only
+        #       support file descriptors 0 to 9.
+        close_fds = False
+    # An :py:class:`~strawboss.environment.Environment` is already encoded.
+    env = getattr(env, 'envp', env)
+    if transport == 'protocol':
+        process = yield from create_protocol_subprocess(
+            name, write, pipeline, *cmd, env=env, loop=loop,
+            preexec_fn=preexec_fn, close_fds=close_fds,
+            sinks={1: sinks['stdout'], 2: sinks['stderr']}, limiter=limiter,
+            splitter=splitter, metrics=metrics,
+        )
+    else:
+        process = yield from asyncio.create_subprocess_exec(
+            *cmd,
+            env=env,
+            preexec_fn=preexec_fn,
+            close_fds=close_fds,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    if metrics is not None:
+        metrics.spawned(name, process.pid)
+    if watchdog is not None:
+        watchdog.spawned(name, process.pid)
+    yield from write(formatter.status(
+        '%s(%d) spawned.' % (name, process.pid), name, process.pid,
     ))
 
-    # Exhaust the child's standard output stream.
+    # Exhaust the child's output streams in a background task (or let the
+    # protocol do it as data arrives).
     #
     # TODO: close stdin for new process.
-    # TODO: terminate the process after the grace period.
-    ready = asyncio.ensure_future(process.wait())
-    pending = {
-        shutdown,
-        ready,
-        asyncio.ensure_future(process.stdout.readline()),
-    }
-    while not ready.done():
-        done, pending = yield from asyncio.wait(
-            pending,
-            return_when=asyncio.FIRST_COMPLETED,
+    if transport == 'protocol':
+        reader = process.protocol.eof
+        process.protocol.start()
+    else:
+        reader = loop.create_task(_forward_streams(
+            process, name, write, sinks, pipeline, loop=loop,
+            limiter=limiter, splitter=splitter, metrics=metrics,
+            timers=timers,
+        ))
+    reporter = None
+    if limiter is not None:
+        reporter = loop.create_task(_report_suppressed(
+            limiter, process, name, write, formatter, limits.report_interval,
+            loop=loop, metrics=metrics,
+        ))
+    prober = None
+    if probe is not None:
+        prober = loop.create_task(_wait_ready(
+            probe, process, name, write, formatter, ready, loop=loop,
+        ))
+
+    # React to a request to shutdown the process.
+    #
+    # NOTE: the callback is installed once and for all (rather than waiting on
+    #       the shutdown future along with the output) so that the cost of
+    #       forwarding output doesn't depend on the number of children sharing
+    #       the same shutdown future.
+    stopper = []
+    def stop(_):
+        stopper.append(loop.create_task(_stop(
+            process, name, write, formatter, stop_signal, grace_period,
+            loop=loop,
+        )))
+    shutdown.add_done_callback(stop)
+
+    # React to process death (natural, killed or terminated).
+    try:
+        exit_code = yield from process.wait()
+        # Don't lose output that is still in the pipes.  Only give up once
+        # the output is idle, i.e. the pipes are empty but still open.
+        yield from activity.wait(reader, EOF_TIMEOUT)
+    finally:
+        shutdown.remove_done_callback(stop)
+        # Cancel any remaining tasks (e.g. read, grace period).
+        reader.cancel()
+        for task in stopper:
+            task.cancel()
+        if reporter is not None:
+            reporter.cancel()
+        if prober is not None:
+            prober.cancel()
+    if transport == 'protocol':
+        yield from process.protocol.close()
+    if limiter is not None:
+        yield from _write_suppressed(
+            limiter, process, name, write, formatter, metrics,
         )
-        for future in done:
-            # React to a request to shutdown the process.
-            #
-            # NOTE: shutdown is asynchronous unless the process completion
-            #       notification is "in flight".  We forward the request to
-            #       shutdown and then wait until the child process completes.
-            if future is shutdown:
-                try:
-                    process.kill()
-                except ProcessLookupError:
-                    pass
-                else:
-                    print('%s [strawboss] %s(%d) killed.' % (
-                        now(utc).isoformat(), name, process.pid
-                    ))
-                continue
-            # React to process death (natural, killed or terminated).
-            if future is ready:
-                exit_code = yield from future
-                print('%s [strawboss] %s(%d) completed with exit status %d.' % (
-                    now(utc).isoformat(), name, process.pid, exit_code
-                ))
-                continue
-            # React to stdout having a full line of text.
-            data = yield from future
-            if not data:
-                print('%s [strawboss] EOF from %s(%d).' % (
-                    now(utc).isoformat(), name, process.pid,
-                ))
-                continue
-            data = data.decode('utf-8').strip()
-            print('%s [%s] %s' % (
-                now(utc).isoformat(), name, data
-            ))
-            pending.add(asyncio.ensure_future(process.stdout.readline()))
-    # Cancel any remaining tasks (e.g. readline).
-    for future in pending:
-        if future is shutdown:
-            continue
-        future.cancel()
+    if metrics is not None:
+        metrics.exited(name, process.pid, exit_code)
+    if watchdog is not None:
+        watchdog.exited(name, process.pid, exit_code)
+    yield from write(formatter.status(
+        '%s(%d) completed with exit status %d.' % (
+            name, process.pid, exit_code,
+        ),
+        name, process.pid,
+    ))
+
     # Pass the exit code back to the caller.
     return exit_code
 
 
+class RespawnPolicy(object):
+    """Decides when (and whether) to re-spawn processes of one type.
+
+    Processes that run for at least ``min_uptime`` seconds are considered
+    healthy and are re-spawned right away.  Processes that exit before that are
+    re-spawned after an exponential backoff delay: ``delay`` seconds after the
+    first failure, multiplied by ``factor`` after each consecutive failure (up
+    to ``max_delay`` seconds).  A random jitter of up to ``jitter`` times the
+    delay is added or removed to avoid re-spawning many processes in lockstep.
+
+    The policy is shared by all instances of a process type.  When the
+    instances exit prematurely (before ``min_uptime``) ``crash_limit`` times
+    within ``crash_period`` seconds, the process type is considered to be
+    crash-looping: it is marked as failed and none of its instances are
+    re-spawned anymore (until :py:meth:`reset` is called).  Healthy exits
+    never count, so instances that are recycled normally never fail.
+
+    :param delay: Backoff delay after the first failure, in seconds.
+    :param max_delay: Maximum backoff delay, in seconds.
+    :param factor: Growth factor of the backoff delay.
+    :param jitter: Fraction of the delay used as a random jitter.
+    :param min_uptime: Minimum run time of a healthy process, in seconds.
+    :param crash_limit: Number of premature exits that constitutes a crash
+       loop.  Use ``0`` to disable crash loop detection.
+    :param crash_period: Duration (in seconds) of the window in which
+       premature exits are counted for crash loop detection.
+    """
+
+    def __init__(self, delay=0.1, max_delay=30.0, factor=2.0, jitter=0.1,
+                 min_uptime=1.0, crash_limit=10, crash_period=60.0):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.min_uptime = min_uptime
+        self.crash_limit = crash_limit
+        self.crash_period = crash_period
+        self.failed = False
+        """``True`` once the process type has been found to crash-loop."""
+        self._exits = collections.deque()
+
+    def backoff(self, failures):
+        """Computes the delay before re-spawning a process.
+
+        :param failures: Number of consecutive times the process exited before
+           reaching the minimum uptime.
+        :return: The delay, in seconds.
+        """
+        if failures <= 0:
+            return 0.0
+        delay = min(
+            self.delay * self.factor ** min(failures - 1, 64),
+            self.max_delay,
+        )
+        if self.jitter:
+            delay *= 1.0 + random.uniform(-self.jitter, self.jitter)
+        return delay
+
+    def reset(self):
+        """Forget past exits and allow re-spawning processes again."""
+        self.failed = False
+        self._exits.clear()
+
+    def record_exit(self, when):
+        """Records the premature exit of a process.
+
+        :param when: Time at which the process exited, as measured by the event
+           loop's clock.
+        :return: ``True`` if this exit makes the process type crash-loop.
+        """
+        if self.failed or not self.crash_limit:
+            return False
+        self._exits.append(when)
+        while self._exits[0] < when - self.crash_period:
+            self._exits.popleft()
+        if len(self._exits) >= self.crash_limit:
+            self.failed = True
+            return True
+        return False
+
+
 @asyncio.coroutine
-def run_and_respawn(shutdown, loop=None, **kwds):
+def run_and_respawn(shutdown, loop=None, respawn=None, restart=None, **kwds):
     """Starts a child process and re-spawns it every time it completes.
 
     .. note:: This function is a coroutine.
 
     :param shutdown: Future that the caller will fulfill to indicate that the
-       process should not be re-spawned.  It is also passed to ``run_once()``
-       to indicate that the currently running process should be killed early.
+       process should not be re-spawned.  The currently running process is
+       also stopped early (see ``shutdown`` in :py:func:`run_once`).
     :param loop: Event loop to use.  Defaults to the
        ``asyncio.get_event_loop()``.
+    :param respawn: :py:class:`RespawnPolicy` that decides when to re-spawn
+       the process.  Share a single policy between all instances of a process
+       type to detect crash loops for the process type as a whole.  When
+       ``None``, a default policy is used for this process only.
+    :param restart: ``asyncio.Event`` that the caller will set to restart the
+       process.  The currently running process is stopped the same way as for
+       ``shutdown`` and re-spawned right away, after which the event is
+       cleared.  Restarts don't count as crashes.
     :param kwds: Arguments to forward to :py:func:`run_once`.
     :return: A future that will be completed when the process has stopped
        re-spawning and has completed.  The future has no result.
@@ -212,9 +918,534 @@ def run_and_respawn(shutdown, loop=None, **kwds):
     # Get the default event loop if necessary.
     loop = loop or asyncio.get_event_loop()
 
-    while not shutdown.done():
-        t = loop.create_task(run_once(shutdown=shutdown, loop=loop, **kwds))
-        yield from t
+    respawn = respawn or RespawnPolicy()
+    formatter = kwds.get('formatter') or TextFormat(
+        kwds.get('timestamps') or Timestamps(utc=kwds.get('utc'))
+    )
+    kwds['formatter'] = formatter
+    write = _writer(kwds.get('output'))
+    name = kwds['name']
+    metrics = kwds.get('metrics')
+
+    failures = 0
+    while not (shutdown.done() or respawn.failed):
+        started = loop.time()
+        stop = shutdown
+        if restart is not None:
+            # The process is about to start afresh anyways.
+            restart.clear()
+            stop, restarting = _stop_on_restart(shutdown, restart, loop)
+        try:
+            t = loop.create_task(run_once(shutdown=stop, loop=loop, **kwds))
+            yield from t
+        except (OSError, subprocess.SubprocessError) as error:
+            # Failing to spawn the process (e.g. missing executable) counts
+            # as a premature exit.
+            yield from write(formatter.status(
+                '%s could not be spawned: %s.' % (
+                    name, getattr(error, 'strerror', None) or error,
+                ),
+                name,
+            ))
+        finally:
+            if restart is not None:
+                restarting.cancel()
+        stopped = loop.time()
+        if shutdown.done():
+            break
+        if restart is not None and restart.is_set():
+            restart.clear()
+            failures = 0
+            continue
+        if stopped - started >= respawn.min_uptime:
+            failures = 0
+            continue
+        # Stop re-spawning processes that keep crashing.
+        if respawn.record_exit(stopped):
+            yield from write(formatter.status(
+                '%s is crash-looping (%d exits in %g seconds), '
+                'not re-spawning.' % (
+                    name, respawn.crash_limit, respawn.crash_period,
+                ),
+                name,
+            ))
+            break
+        # Another instance found the process type to be crash-looping.
+        if respawn.failed:
+            break
+        # Back off when the process exits prematurely.
+        failures += 1
+        delay = respawn.backoff(failures)
+        if metrics is not None:
+            metrics.respawn_delay(name, delay)
+        yield from write(formatter.status(
+            '%s exited after %.3f seconds, re-spawning in %.3f seconds.' % (
+                name, stopped - started, delay,
+            ),
+            name,
+        ))
+        yield from asyncio.wait([shutdown], timeout=delay, loop=loop)
+
+
+def _stop_on_restart(shutdown, restart, loop):
+    """Returns a future that completes on shutdown or on restart.
+
+    :return: The future and the task that waits for the restart (which the
+       caller must cancel).
+    """
+    stop = asyncio.Future(loop=loop)
+    def done(_):
+        if not stop.done():
+            stop.set_result(None)
+    waiter = loop.create_task(restart.wait())
+    waiter.add_done_callback(done)
+    # NOTE: the shutdown future may be shared by many processes, so don't
+    #       leave callbacks behind.
+    shutdown.add_done_callback(done)
+    waiter.add_done_callback(lambda _: shutdown.remove_done_callback(done))
+    return stop, waiter
+
+
+_Instance = collections.namedtuple(
+    '_Instance', ['shutdown', 'restart', 'ready', 'task'],
+)
+
+
+class Supervisor(object):
+    """Runs and re-spawns all instances of all process types.
+
+    The number of instances of each process type can be changed at any time
+    using :py:meth:`scale`.  Each instance has its own shutdown future, so
+    instances can be stopped (or restarted, see :py:meth:`restart`)
+    individually without disturbing the others.
+
+    Process types can depend on other process types (see
+    :py:meth:`add_process_type`), in which case their instances are only
+    started once the process types they depend on are ready.
+
+    All instances of a process type can be replaced without interrupting
+    service using :py:meth:`rolling_restart`.
+
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    :param logs: :py:class:`~strawboss.logs.LogDirectory` where the output of
+       each instance is written to its own file.  Streams that are routed
+       elsewhere (see ``stdout`` and ``stderr`` in :py:func:`run_once`) are
+       not affected.  When ``None``, output is written to ``output``.
+    :param ready_timeout: Time (in seconds) after which instances of a
+       process type are started even though the process types it depends on
+       are not ready.  Use ``0`` to wait forever.
+    :param kwds: Arguments to forward to :py:func:`run_and_respawn` for all
+       instances (e.g. ``output`` or ``timestamps``).
+    """
+
+    def __init__(self, loop=None, logs=None, ready_timeout=60.0, **kwds):
+        self._loop = loop or asyncio.get_event_loop()
+        self._logs = logs
+        self._ready_timeout = ready_timeout
+        self._kwds = kwds
+        self._write = _writer(kwds.get('output'))
+        self._formatter = kwds.get('formatter') or TextFormat(
+            kwds.get('timestamps') or Timestamps(utc=kwds.get('utc'))
+        )
+        self._types = {}
+        self._instances = {}
+        self._ready = {}
+        self._ready_names = {}
+        self._pending = {}
+        self._rollouts = {}
+        self._retiring = set()
+        self._waiters = set()
+        self._tasks = set()
+        self._stopping = False
+        self._done = asyncio.Future(loop=self._loop)
+
+    @property
+    def process_types(self):
+        """Labels of all known process types."""
+        return set(self._types)
+
+    def add_process_type(self, label, cmd, env, respawn=None, resources=None,
+                         probe=None, depends_on=(), listeners=None, **kwds):
+        """Register a process type.
+
+        No instances are started until :py:meth:`scale` is called.
+
+        :param label: Name of the process type.
+        :param cmd: Command-line used to start instances.
+        :param env: Environment variables for the instances.  A ``dict`` is
+           converted to an :py:class:`~strawboss.environment.Environment`
+           once, here, and shared by all instances.
+        :param respawn: :py:class:`RespawnPolicy` shared by all instances.
+        :param resources: Function called with the index of each new instance,
+           which returns the :py:class:`~strawboss.resources.ResourceLimits`
+           applied to it (or ``None``).
+        :param probe: :py:class:`~strawboss.readiness.Probe` that tells when
+           each instance is ready.  The process type is ready once all of its
+           instances have passed the probe.  Without a probe, the process
+           type is ready as soon as its instances are started.
+        :param depends_on: Labels of the process types that must be ready
+           before instances of this process type are started.
+        :param listeners: :py:class:`~strawboss.sockets.Listeners` whose
+           sockets are passed to instances (see ``listen_fds`` in
+           :py:func:`run_once`).  They are not closed when instances are
+           re-spawned.
+        :param kwds: Arguments to forward to :py:func:`run_once` for instances
+           of this process type only (e.g. ``stop_signal``).
+        :raise ValueError: An environment variable name is invalid.
+        """
+        from strawboss.environment import Environment
+        if env is not None and not isinstance(env, Environment):
+            env = Environment(env)
+        self._types[label] = {
+            'cmd': cmd,
+            'env': env,
+            'respawn': respawn or RespawnPolicy(),
+            'resources': resources,
+            'probe': probe,
+            'depends_on': list(depends_on),
+            'listeners': listeners,
+            'kwds': kwds,
+        }
+        self._instances.setdefault(label, [])
+        self._ready.setdefault(label, asyncio.Future(loop=self._loop))
+        self._ready_names.setdefault(label, set())
+
+    def scale(self, label, count):
+        """Change the number of instances of a process type.
+
+        When scaling up, new instances are started right away (or as soon as
+        the process types it depends on are ready).  When scaling down, the
+        instances with the highest indices are shut down.  Other instances
+        are not affected in any way.  When the process type is crash-looping
+        (see :py:class:`RespawnPolicy`), it is given a new chance: instances
+        that stopped re-spawning are started again.
+
+        :param label: Name of the process type.
+        :param count: Number of instances that should be running.
+        :raise KeyError: There is no process type named ``label`` (or one of
+           the process types it depends on).
+        :raise OSError: Sockets for new instances can't be bound.
+        """
+        process_type = self._types[label]
+        if self._stopping:
+            return
+        if label in self._pending:
+            self._pending[label] = count
+            return
+        waiting = [
+            other for other in process_type['depends_on']
+            if not self._ready[other].done()
+        ]
+        if waiting:
+            self._pending[label] = count
+            self._wait_for(self._scale_when_ready(label, waiting))
+            return
+        self._scale(label, count)
+
+    def _wait_for(self, coro):
+        """Run a task that is cancelled when the supervisor stops."""
+        task = self._loop.create_task(coro)
+        task.add_done_callback(self._waiters.discard)
+        task.add_done_callback(self._task_done)
+        self._waiters.add(task)
+        self._tasks.add(task)
+        return task
+
+    def _scale(self, label, count):
+        process_type = self._types[label]
+        instances = self._instances[label]
+        # Scaling a process type that was crash-looping gives it a new
+        # chance, including the instances that stopped re-spawning.
+        if self._reset(label):
+            for index, instance in enumerate(instances[:count]):
+                if instance.task.done():
+                    instances[index] = self._spawn(label, index)
+        while len(instances) > count:
+            self._retire(instances.pop())
+            if process_type['listeners'] is not None:
+                process_type['listeners'].release(len(instances))
+        while len(instances) < count:
+            instances.append(self._spawn(label, len(instances)))
+        self._check_ready(label)
+
+    def _spawn(self, label, index):
+        """Start an instance, see :py:func:`run_and_respawn`."""
+        process_type = self._types[label]
+        name = '%s.%i' % (label, index)
+        kwds = dict(self._kwds, **process_type['kwds'])
+        if self._logs is not None:
+            for stream in ('stdout', 'stderr'):
+                if kwds.get(stream) is None:
+                    kwds[stream] = self._logs.writer(name)
+        if process_type['resources'] is not None:
+            resources = process_type['resources'](index)
+            if resources is not None:
+                kwds['preexec_fn'] = resources.apply
+        if process_type['listeners'] is not None:
+            kwds['listen_fds'] = process_type['listeners'].fds(index)
+        ready = asyncio.Future(loop=self._loop)
+        if process_type['probe'] is not None:
+            kwds['probe'] = process_type['probe']
+            kwds['ready'] = functools.partial(
+                self._instance_ready, label, ready,
+            )
+        shutdown = asyncio.Future(loop=self._loop)
+        restart = asyncio.Event(loop=self._loop)
+        task = self._loop.create_task(run_and_respawn(
+            name=name,
+            cmd=process_type['cmd'],
+            env=process_type['env'],
+            loop=self._loop,
+            shutdown=shutdown,
+            restart=restart,
+            respawn=process_type['respawn'],
+            **kwds
+        ))
+        task.add_done_callback(self._task_done)
+        self._tasks.add(task)
+        return _Instance(shutdown, restart, ready, task)
+
+    def _reset(self, label):
+        """Reset the respawn policy of a crash-looping process type.
+
+        :return: ``True`` if the process type was crash-looping.
+        """
+        respawn = self._types[label]['respawn']
+        if not respawn.failed:
+            return False
+        respawn.reset()
+        self._loop.create_task(self._write(self._formatter.status(
+            '%s was crash-looping, re-spawning.' % label, label,
+        )))
+        return True
+
+    def _retire(self, instance):
+        """Shut down an instance that was replaced or scaled down."""
+        if not instance.shutdown.done():
+            instance.shutdown.set_result(None)
+
+    @asyncio.coroutine
+    def _scale_when_ready(self, label, waiting):
+        yield from self._write(self._formatter.status(
+            '%s waiting for %s to be ready.' % (label, ', '.join(waiting)),
+            label,
+        ))
+        yield from asyncio.wait(
+            [self._ready[other] for other in waiting],
+            timeout=self._ready_timeout or None, loop=self._loop,
+        )
+        late = [other for other in waiting if not self._ready[other].done()]
+        if late:
+            yield from self._write(self._formatter.status(
+                '%s not ready after %g seconds, starting %s anyway.' % (
+                    ', '.join(late), self._ready_timeout, label,
+                ),
+                label,
+            ))
+        count = self._pending.pop(label)
+        if not self._stopping:
+            self._scale(label, count)
+
+    def _instance_ready(self, label, ready, name, pid):
+        if not ready.done():
+            ready.set_result(None)
+        self._ready_names[label].add(name)
+        self._check_ready(label)
+
+    def _check_ready(self, label):
+        ready = self._ready[label]
+        if ready.done():
+            return
+        names = {
+            '%s.%d' % (label, index)
+            for index in range(len(self._instances[label]))
+        }
+        if self._types[label]['probe'] is None or (
+                names <= self._ready_names[label]):
+            ready.set_result(None)
+
+    @asyncio.coroutine
+    def ready(self, label):
+        """Wait until a process type is ready.
+
+        .. note:: This function is a coroutine.
+
+        A process type is ready once all of its instances have passed its
+        readiness probe (once), or as soon as it is scaled when it has no
+        probe.  It then stays ready, even if its instances are re-spawned.
+
+        :param label: Name of the process type.
+        :raise KeyError: There is no process type named ``label``.
+        """
+        yield from asyncio.shield(self._ready[label], loop=self._loop)
+
+    def count(self, label):
+        """Returns the number of instances of a process type."""
+        return len(self._instances[label])
+
+    def restart(self, name):
+        """Gracefully restart one instance.
+
+        The instance is stopped the same way as when it is shut down (see
+        ``stop_signal`` and ``grace_period`` in :py:func:`run_once`) and is
+        re-spawned as soon as it completes.
+
+        :param name: Name of the instance (e.g. ``'web.0'``).
+        :return: ``True`` if the instance is being restarted, ``False`` if
+           there is no such instance or it is not running anymore.
+        """
+        label, _, index = name.rpartition('.')
+        instances = self._instances.get(label, [])
+        if self._stopping or not index.isdigit():
+            return False
+        if int(index) >= len(instances):
+            return False
+        instance = instances[int(index)]
+        if instance.shutdown.done() or instance.task.done():
+            return False
+        instance.restart.set()
+        return True
+
+    def rolling_restart(self, label, surge=1, max_unavailable=0, delay=0.0):
+        """Replace all instances of a process type, a batch at a time.
+
+        Instances are replaced in batches of ``surge + max_unavailable``
+        instances.  For each batch, the new instances are started first.  The
+        old instances are stopped once the new ones are ready (see ``probe``
+        in :py:meth:`add_process_type`) and have been running for ``delay``
+        seconds, except for ``max_unavailable`` of them, which are stopped
+        right away.  So at most ``surge`` extra instances run at any time
+        and at most ``max_unavailable`` instances are unavailable.
+
+        When new instances don't get ready within the ready timeout, the old
+        instances they replace are kept and the rolling restart is aborted.
+        A crash-looping process type is given a new chance, like in
+        :py:meth:`scale`.
+
+        :param label: Name of the process type.
+        :param surge: Number of instances started on top of the current
+           ones.
+        :param max_unavailable: Number of instances that may be stopped
+           before their replacement is ready.
+        :param delay: Time (in seconds) new instances must run (after they
+           are ready) before old ones are stopped.
+        :return: The task that performs the rolling restart, or ``None``
+           if a rolling restart of this process type is already in progress
+           or the supervisor is stopping.
+        :raise KeyError: There is no process type named ``label``.
+        """
+        if label not in self._types:
+            raise KeyError(label)
+        if self._stopping or label in self._rollouts:
+            return None
+        self._reset(label)
+        task = self._wait_for(self._roll(
+            label, max(surge + max_unavailable, 1), max_unavailable, delay,
+        ))
+        self._rollouts[label] = task
+        task.add_done_callback(lambda _: self._rollouts.pop(label))
+        return task
+
+    @asyncio.coroutine
+    def _roll(self, label, batch, max_unavailable, delay):
+        instances = self._instances[label]
+        probe = self._types[label]['probe']
+        yield from self._write(self._formatter.status(
+            'Rolling restart of %s started.' % label, label,
+        ))
+        index = 0
+        while index < len(instances):
+            indices = range(index, min(index + batch, len(instances)))
+            old = [instances[i] for i in indices]
+            for i in indices:
+                instances[i] = self._spawn(label, i)
+            new = [instances[i] for i in indices]
+            for instance in old:
+                self._retiring.add(instance)
+                instance.task.add_done_callback(
+                    functools.partial(self._retired, instance),
+                )
+            for instance in old[:max_unavailable]:
+                self._retire(instance)
+            # Wait for the new instances before stopping the other ones.
+            late = []
+            if probe is not None:
+                yield from asyncio.wait(
+                    [instance.ready for instance in new],
+                    timeout=self._ready_timeout or None, loop=self._loop,
+                )
+                late = [
+                    position for position, instance in enumerate(new)
+                    if not instance.ready.done()
+                ]
+            if not late:
+                yield from asyncio.sleep(delay, loop=self._loop)
+            for position, i in enumerate(indices):
+                # Keep old instances whose replacement isn't ready (unless it
+                # was scaled down in the meantime).
+                if position in late and position >= max_unavailable:
+                    if i < len(instances) and instances[i] is new[position]:
+                        instances[i] = old[position]
+                        self._retiring.discard(old[position])
+                        self._retire(new[position])
+                        continue
+                self._retire(old[position])
+            if late:
+                yield from self._write(self._formatter.status(
+                    '%s not ready after %g seconds, rolling restart of %s '
+                    'aborted.' % (
+                        ', '.join('%s.%d' % (label, indices[position])
+                                  for position in late),
+                        self._ready_timeout, label,
+                    ),
+                    label,
+                ))
+                return
+            index += batch
+        yield from self._write(self._formatter.status(
+            'Rolling restart of %s completed.' % label, label,
+        ))
+
+    def _retired(self, instance, _):
+        self._retiring.discard(instance)
+
+    def stop(self):
+        """Shut down all instances and stop re-spawning them.
+
+        Instances of all process types are shut down in parallel.
+        """
+        self._stopping = True
+        # Don't start process types that are still waiting.
+        for task in self._waiters:
+            task.cancel()
+        for instances in self._instances.values():
+            for instance in instances:
+                self._retire(instance)
+        for instance in self._retiring:
+            self._retire(instance)
+        self._check_done()
+
+    @asyncio.coroutine
+    def wait(self):
+        """Wait until all instances have completed.
+
+        .. note:: This function is a coroutine.
+
+        This completes as soon as no instances are left running: after
+        :py:meth:`stop` is called, when all process types are scaled down to
+        zero instances or when all instances stop re-spawning on their own
+        (e.g. because all process types are crash-looping).
+        """
+        yield from asyncio.shield(self._done, loop=self._loop)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        self._check_done()
+
+    def _check_done(self):
+        if not (self._tasks or self._done.done()):
+            self._done.set_result(None)
 
 
 cli = argparse.ArgumentParser(description="Run programs.")
@@ -227,8 +1458,177 @@ cli.add_argument('--no-env', dest='use_env',
                  action='store_false', default=True)
 cli.add_argument('--utc', dest='use_utc',
                  action='store_true', default=False)
+cli.add_argument('--timestamps', dest='timestamp_format',
+                 choices=TIMESTAMP_FORMATS, default='iso',
+                 help="Format of timestamps in the output.")
+cli.add_argument('--timestamp-precision', dest='timestamp_precision',
+                 choices=TIMESTAMP_PRECISIONS, default='us',
+                 help="Precision of timestamps in ISO 8601 format.")
 cli.add_argument('--scale', dest='scale', action='append', type=parse_scale,
                  default=[('*', 1)], help="Override number of instances.")
+cli.add_argument('--respawn-delay', dest='respawn_delay', type=float,
+                 default=0.1,
+                 help="Delay before re-spawning a process that crashed.")
+cli.add_argument('--respawn-delay-max', dest='respawn_delay_max',
+                 type=float, default=30.0,
+                 help="Maximum delay before re-spawning a process.")
+cli.add_argument('--respawn-backoff', dest='respawn_backoff', type=float,
+                 default=2.0, help="Growth factor of the re-spawn delay.")
+cli.add_argument('--respawn-jitter', dest='respawn_jitter', type=float,
+                 default=0.1, help="Random jitter on the re-spawn delay.")
+cli.add_argument('--min-uptime', dest='min_uptime', type=float, default=1.0,
+                 help="Run time after which a process is considered healthy.")
+cli.add_argument('--crash-loop', dest='crash_loop', type=parse_crash_loop,
+                 default=(10, 60.0),
+                 help="Stop re-spawning after N exits in T seconds (N:T).")
+cli.add_argument('--stop-signal', dest='stop_signal', action='append',
+                 type=per_process_type(parse_signal),
+                 default=[('*', signal.SIGTERM)],
+                 help="Signal sent to processes to stop them (type:signal).")
+cli.add_argument('--grace-period', dest='grace_period', action='append',
+                 type=per_process_type(parse_grace_period),
+                 default=[('*', 10.0)],
+                 help="Delay before killing stopped processes (type:seconds).")
+cli.add_argument('--stdout', dest='stdout', action='append',
+                 type=per_process_type(parse_sink),
+                 default=[('*', 'terminal')],
+                 help="Where to send stdout of processes (type:destination).")
+cli.add_argument('--stderr', dest='stderr', action='append',
+                 type=per_process_type(parse_sink),
+                 default=[('*', 'terminal')],
+                 help="Where to send stderr of processes (type:destination).")
+cli.add_argument('--log-dir', dest='log_dir', type=str, default=None,
+                 help="Write the output of each instance to its own file.")
+cli.add_argument('--log-max-size', dest='log_max_size', type=parse_size,
+                 default=0, help="Rotate log files larger than this.")
+cli.add_argument('--log-rotate-interval', dest='log_rotate_interval',
+                 type=parse_grace_period, default=0.0,
+                 help="Rotate log files older than this (in seconds).")
+cli.add_argument('--log-keep', dest='log_keep', type=int, default=10,
+                 help="Number of rotated log files to keep.")
+cli.add_argument('--log-compress', dest='log_compress', action='store_true',
+                 default=False, help="Compress rotated log files.")
+cli.add_argument('--rate-limit', dest='rate_limit', action='append',
+                 type=per_process_type(parse_rate_limit), default=[],
+                 help="Lines per second per instance (type:rate[:burst]).")
+cli.add_argument('--type-rate-limit', dest='type_rate_limit', action='append',
+                 type=per_process_type(parse_rate_limit), default=[],
+                 help="Lines per second per process type (type:rate[:burst]).")
+cli.add_argument('--sample', dest='sample', action='append',
+                 type=per_process_type(parse_sample), default=[],
+                 help="Keep one line in N (type:N).")
+cli.add_argument('--rate-limit-report', dest='rate_limit_report',
+                 type=parse_interval, default=10.0,
+                 help="Delay between reports of suppressed lines (seconds).")
+cli.add_argument('--max-line-length', dest='max_line_length',
+                 type=parse_line_length, default=MAX_LINE_LENGTH,
+                 help="Split longer lines of output into fragments.")
+cli.add_argument('--decode-errors', dest='decode_errors',
+                 choices=DECODE_ERRORS, default='replace',
+                 help="What to do with output that isn't valid UTF-8.")
+cli.add_argument('--rlimit', dest='rlimit', action='append',
+                 type=per_process_type(parse_rlimit), default=[],
+                 help="Resource limit of processes (type:resource=limit).")
+cli.add_argument('--nice', dest='nice', action='append',
+                 type=per_process_type(parse_nice), default=[],
+                 help="Niceness increment of processes (type:increment).")
+cli.add_argument('--ionice', dest='ionice', action='append',
+                 type=per_process_type(parse_ionice), default=[],
+                 help="I/O scheduling class (type:class[:level]).")
+cli.add_argument('--cpu-affinity', dest='cpu_affinity', action='append',
+                 type=per_process_type(parse_cpus), default=[],
+                 help="CPUs to spread processes over (type:cpus).")
+cli.add_argument('--max-rss', dest='max_rss', action='append',
+                 type=per_process_type(parse_size), default=[],
+                 help="Resident memory limit for the watchdog (type:size).")
+cli.add_argument('--max-cpu', dest='max_cpu', action='append',
+                 type=per_process_type(parse_percent), default=[],
+                 help="CPU usage limit for the watchdog (type:percent).")
+cli.add_argument('--watchdog-action', dest='watchdog_action',
+                 action='append', type=per_process_type(parse_watchdog_action),
+                 default=[('*', 'restart')],
+                 help="What to do when a limit is exceeded (type:action).")
+cli.add_argument('--watchdog-interval', dest='watchdog_interval',
+                 type=parse_interval, default=10.0,
+                 help="Delay between samples of resource usage (seconds).")
+cli.add_argument('--watchdog-stagger', dest='watchdog_stagger',
+                 type=parse_grace_period, default=30.0,
+                 help="Delay between restarts of the same type (seconds).")
+cli.add_argument('--watchdog-alert', dest='watchdog_alert', type=str,
+                 default=None, help="Command run by the alert action.")
+cli.add_argument('--ready', dest='ready', action='append',
+                 type=per_process_type(parse_probe), default=[],
+                 help="Readiness probe of processes (type:probe).")
+cli.add_argument('--ready-interval', dest='ready_interval', action='append',
+                 type=per_process_type(parse_interval), default=[],
+                 help="Delay between readiness checks (type:seconds).")
+cli.add_argument('--depends-on', dest='depends_on', action='append',
+                 type=per_process_type(parse_dependencies), default=[],
+                 help="Start processes once others are ready (type:types).")
+cli.add_argument('--ready-timeout', dest='ready_timeout',
+                 type=parse_grace_period, default=60.0,
+                 help="Maximum wait for dependencies to be ready (seconds).")
+cli.add_argument('--listen', dest='listen', action='append',
+                 type=per_process_type(parse_address), default=[],
+                 help="Pass a listening socket to processes (type:address).")
+cli.add_argument('--reuseport', dest='reuseport', action='store_true',
+                 default=False,
+                 help="Give each process its own socket (SO_REUSEPORT).")
+cli.add_argument('--format', dest='output_format',
+                 choices=OUTPUT_FORMATS, default='text',
+                 help="Format of lines in the output.")
+cli.add_argument('--output-queue', dest='output_queue', type=int,
+                 default=1024, help="Maximum number of pending output blocks.")
+cli.add_argument('--output-policy', dest='output_policy',
+                 choices=OUTPUT_POLICIES, default='block',
+                 help="What to do with output when the output queue is full.")
+cli.add_argument('--transport', dest='transport',
+                 choices=TRANSPORTS, default='stream',
+                 help="How to read output from children.")
+cli.add_argument('--loop', dest='loop', choices=LOOPS, default='auto',
+                 help="Event loop implementation.")
+cli.add_argument('--metrics', dest='metrics_address', type=str, default=None,
+                 help="Serve metrics on host:port or a UNIX domain socket.")
+cli.add_argument('--metrics-interval', dest='metrics_interval',
+                 type=parse_interval, default=5.0,
+                 help="Delay between samples of resource usage (seconds).")
+cli.add_argument('--lag-warning', dest='lag_warning', type=parse_grace_period,
+                 default=0.0,
+                 help="Warn when the event loop lags by more (seconds).")
+cli.add_argument('--stage-timers', dest='stage_timers', action='store_true',
+                 default=False,
+                 help="Time each stage of output forwarding.")
+cli.add_argument('--profile', dest='profile', type=str, default=None,
+                 help="Write cProfile statistics to this file on exit.")
+cli.add_argument('--rolling-surge', dest='rolling_surge', type=int,
+                 default=1,
+                 help="Extra instances started by rolling restarts.")
+cli.add_argument('--rolling-max-unavailable', dest='rolling_max_unavailable',
+                 type=int, default=0,
+                 help="Instances stopped early by rolling restarts.")
+cli.add_argument('--rolling-delay', dest='rolling_delay',
+                 type=parse_grace_period, default=1.0,
+                 help="Run time of new instances before stopping old ones.")
+cli.add_argument('--reload', dest='reload', action='store_true',
+                 default=False,
+                 help="Reload the Procfile and env files when they change.")
+cli.add_argument('--reload-delay', dest='reload_delay',
+                 type=parse_grace_period, default=1.0,
+                 help="Time files must not change before they are reloaded.")
+cli.add_argument('--reload-poll', dest='reload_poll', action='store_true',
+                 default=False,
+                 help="Poll files for changes instead of using inotify.")
+cli.add_argument('--control-socket', dest='control_socket', type=str,
+                 default=None, help="UNIX domain socket for commands.")
+commands = cli.add_subparsers(dest='command', metavar='command')
+cli_scale = commands.add_parser(
+    'scale', help="Change the number of instances of a running supervisor.",
+)
+cli_scale.add_argument('requested_scale', nargs='+', metavar='type=count')
+cli_restart = commands.add_parser(
+    'restart', help="Rolling restart of a running supervisor's processes.",
+)
+cli_restart.add_argument('restart_types', nargs='*', metavar='type')
 
 
 def main(arguments=None):
@@ -246,6 +1646,27 @@ def main(arguments=None):
         arguments = sys.argv[1:]
     arguments = cli.parse_args(arguments)
 
+    # Forward sub-commands to the running supervisor.
+    if arguments.command == 'scale':
+        _send_command(arguments, 'scale', *arguments.requested_scale)
+        return
+    if arguments.command == 'restart':
+        _send_command(arguments, 'restart', *arguments.restart_types)
+        return
+
+    # Rolling restarts must be able to make progress.
+    if arguments.rolling_surge < 0 or arguments.rolling_max_unavailable < 0:
+        sys.stderr.write('Invalid rolling restart settings.\n')
+        sys.exit(2)
+    if not (arguments.rolling_surge or arguments.rolling_max_unavailable):
+        sys.stderr.write('Rolling restarts need a surge or unavailable '
+                         'instances.\n')
+        sys.exit(2)
+
+    # NOTE: this is only needed to start a supervisor, so don't slow down
+    #       imports of this module (and sub-commands) with it.
+    import procfile
+
     # Read the procfile.
     try:
         process_types = procfile.loadfile(arguments.procfile)
@@ -254,63 +1675,600 @@ def main(arguments=None):
         sys.exit(2)
 
     # Read the env file(s).
-    env = {}
-    if arguments.use_env:
-        for path in arguments.envfiles:
-            try:
-                env.update(dotenvfile.loadfile(path))
-            except FileNotFoundError:
-                sys.stderr.write(
-                    'Warning: environment file "%s" not found.\n' % path
-                )
+    env, missing = _read_env(arguments)
+    for path in missing:
+        sys.stderr.write('Warning: environment file "%s" not found.\n' % path)
 
     # Determine how many processes of each type we need.
-    effective_scale = {}
     requested_scale = dict(arguments.scale)
-    for label in process_types:
-        effective_scale[label] = requested_scale.get(
-            label,
-            requested_scale['*'],
-        )
+    def scale_of(label):
+        return requested_scale.get(label, requested_scale['*'])
+    effective_scale = {label: scale_of(label) for label in process_types}
+    if not any(effective_scale.values()):
+        sys.stderr.write('Nothing to run.\n')
+        sys.exit(2)
+
+    # Bind listening sockets once and for all.
+    listeners = {}
+    for label, _ in arguments.listen:
+        if label not in process_types:
+            sys.stderr.write('Unknown process type "%s".\n' % label)
+            sys.exit(2)
+        if label in listeners:
+            continue
+        try:
+            from strawboss.sockets import Listeners
+            listeners[label] = Listeners(
+                [value for key, value in arguments.listen if key == label],
+                reuseport=arguments.reuseport,
+            )
+            # Report errors for sockets bound by each instance right away.
+            listeners[label].fds(0)
+        except OSError as error:
+            sys.stderr.write('Could not listen for "%s": %s.\n' % (
+                label, error.strerror,
+            ))
+            sys.exit(2)
 
     # Start the event loop.
-    loop = asyncio.get_event_loop()
+    try:
+        loop = make_event_loop(arguments.loop)
+    except ImportError:
+        sys.stderr.write('uvloop is not installed.\n')
+        sys.exit(2)
+
+    # Funnel output from all children through a single writer.
+    timestamps = Timestamps(
+        utc=arguments.use_utc,
+        format=arguments.timestamp_format,
+        precision=arguments.timestamp_precision,
+    )
+    if arguments.output_format == 'json':
+        formatter = JSONFormat(timestamps)
+    else:
+        formatter = TextFormat(timestamps)
+    output = OutputWriter(
+        maxsize=arguments.output_queue,
+        policy=arguments.output_policy,
+        loop=loop,
+        formatter=formatter,
+    )
+
+    # Collect and serve metrics.
+    metrics = server = None
+    if arguments.metrics_address:
+        from strawboss.metrics import Metrics, MetricsServer
+        metrics = Metrics(interval=arguments.metrics_interval, loop=loop)
+        metrics.add_writer('terminal', output)
+        server = MetricsServer(arguments.metrics_address, metrics, loop=loop)
+        try:
+            loop.run_until_complete(server.start())
+        except OSError as error:
+            sys.stderr.write('Could not listen on "%s": %s.\n' % (
+                arguments.metrics_address, error.strerror,
+            ))
+            sys.exit(2)
+        metrics.start()
+
+    # Instrument the supervisor.
+    timers = monitor = profile = None
+    if arguments.stage_timers or arguments.profile or arguments.lag_warning:
+        from strawboss.profiling import LagMonitor, StageTimers
+        def warn(lag):
+            loop.create_task(output.write(formatter.status(
+                'Event loop lagged by %.3f seconds.' % lag,
+            )))
+        monitor = LagMonitor(threshold=arguments.lag_warning, warn=warn,
+                             loop=loop)
+        monitor.start()
+        if arguments.stage_timers:
+            timers = StageTimers()
+    if arguments.profile:
+        import cProfile
+        profile = cProfile.Profile()
+
+    # Restart (or report) children that use too many resources.
+    watchdog = None
+    if arguments.max_rss or arguments.max_cpu:
+        from strawboss.watchdog import Watchdog
+        watchdog = Watchdog(
+            restart=lambda name: supervisor.restart(name),
+            write=output.write,
+            formatter=formatter,
+            interval=arguments.watchdog_interval,
+            stagger=arguments.watchdog_stagger,
+            alert=arguments.watchdog_alert,
+            loop=loop,
+        )
+
+    # Write the output of each instance to its own file.
+    logs = None
+    if arguments.log_dir:
+        from strawboss.logs import LogDirectory
+        try:
+            logs = LogDirectory(
+                arguments.log_dir,
+                max_size=arguments.log_max_size,
+                interval=arguments.log_rotate_interval,
+                keep=arguments.log_keep,
+                compress=arguments.log_compress,
+                loop=loop,
+                maxsize=arguments.output_queue,
+                policy=arguments.output_policy,
+                formatter=formatter,
+            )
+        except OSError as error:
+            sys.stderr.write('Could not create "%s": %s.\n' % (
+                arguments.log_dir, error.strerror,
+            ))
+            sys.exit(2)
+
+    # Prepare all process types.
+    dependencies = {
+        label: [
+            other for key, value in arguments.depends_on if key == label
+            for other in value
+        ]
+        for label in process_types
+    }
+    try:
+        for label, _ in arguments.depends_on:
+            if label not in process_types:
+                raise ValueError('Unknown process type "%s".' % label)
+        if arguments.depends_on:
+            from strawboss.readiness import check_dependencies
+            check_dependencies(dependencies)
+    except ValueError as error:
+        sys.stderr.write('%s\n' % error)
+        sys.exit(2)
+    supervisor = Supervisor(
+        loop=loop,
+        logs=logs,
+        ready_timeout=arguments.ready_timeout,
+        utc=arguments.use_utc,
+        output=output,
+        formatter=formatter,
+        decode_errors=arguments.decode_errors,
+        max_line_length=arguments.max_line_length,
+        metrics=metrics,
+        timers=timers,
+        watchdog=watchdog,
+    )
+    # Route output streams of each process type (files are shared by all
+    # process types that write to them).
+    files = {}
+    def sink(path):
+        if path == 'terminal':
+            return None
+        if path == 'discard':
+            return False
+        if path not in files:
+            try:
+                stream = open(path, 'a', encoding='utf-8')
+            except OSError as error:
+                raise ValueError('Could not open "%s": %s.' % (
+                    path, error.strerror,
+                ))
+            files[path] = stream, OutputWriter(
+                stream=stream,
+                maxsize=arguments.output_queue,
+                policy=arguments.output_policy,
+                loop=loop,
+                formatter=formatter,
+            )
+            if metrics is not None:
+                metrics.add_writer(path, files[path][1])
+        return files[path][1]
+    # Settings of each process type are checked before any of them is
+    # applied, so that a reload is either applied in full or not at all.
+    from strawboss.environment import Environment
+    def define(label, process_type, env):
+        limits = _output_limits(
+            arguments, label, merge_envs(env, process_type['env']),
+        )
+        resources = functools.partial(_resource_limits, arguments, label)
+        # Report unsupported settings right away.
+        resources(0)
+        policy = None
+        if watchdog is not None:
+            policy = _watchdog_policy(arguments, label)
+        probe = lookup_process_type(arguments.ready, label)
+        # The kernel accepts connections on sockets passed with --listen
+        # before instances run (and old instances accept them as well), so
+        # probes that connect to them would pass right away.
+        ports = {
+            address[1] for key, (_, address) in arguments.listen
+            if key == label and not isinstance(address, str)
+        }
+        if getattr(probe, 'port', None) in ports:
+            raise ValueError(
+                'Readiness probe of "%s" connects to its listening socket, '
+                'use a log: or exec: probe instead.' % label
+            )
+        interval = lookup_process_type(arguments.ready_interval, label)
+        if probe is not None and interval is not None:
+            probe = copy.copy(probe)
+            probe.interval = interval
+        return policy, dict(
+            cmd=shlex.split(process_type['cmd']),
+            env=Environment(os.environ, env, process_type['env']),
+            respawn=RespawnPolicy(
+                delay=arguments.respawn_delay,
+                max_delay=arguments.respawn_delay_max,
+                factor=arguments.respawn_backoff,
+                jitter=arguments.respawn_jitter,
+                min_uptime=arguments.min_uptime,
+                crash_limit=arguments.crash_loop[0],
+                crash_period=arguments.crash_loop[1],
+            ),
+            resources=resources,
+            probe=probe,
+            depends_on=dependencies.get(label, []),
+            listeners=listeners.get(label),
+            transport=arguments.transport,
+            stop_signal=lookup_process_type(arguments.stop_signal, label),
+            grace_period=lookup_process_type(arguments.grace_period, label),
+            stdout=sink(lookup_process_type(arguments.stdout, label)),
+            stderr=sink(lookup_process_type(arguments.stderr, label)),
+            limits=limits,
+        )
+    def register(label, definition):
+        policy, kwds = definition
+        if policy is not None:
+            watchdog.add_process_type(label, policy)
+        supervisor.add_process_type(label, **kwds)
+    try:
+        definitions = {
+            label: define(label, process_type, env)
+            for label, process_type in process_types.items()
+        }
+    except ValueError as error:
+        sys.stderr.write('%s\n' % error)
+        sys.exit(2)
+    for label, definition in definitions.items():
+        register(label, definition)
 
     # Register for shutdown events (idempotent, trap once only).
-    shutdown = asyncio.Future()
+    #
+    # NOTE: some versions of uvloop don't support removing a signal handler
+    #       from within that same handler, so defer it to the next iteration.
     def stop_respawning():
-        if shutdown.done():
-            return
-        shutdown.set_result(None)
-        loop.remove_signal_handler(signal.SIGINT)
+        supervisor.stop()
+        loop.call_soon(loop.remove_signal_handler, signal.SIGINT)
     loop.add_signal_handler(signal.SIGINT, stop_respawning)
 
-    # Spawn tasks.
-    tasks = []
-    for label, count in effective_scale.items():
-        process_type = process_types[label]
-        the_cmd = shlex.split(process_type['cmd'])
-        the_env = merge_envs(os.environ, env, process_type['env'])
-        for i in range(count):
-            task = loop.create_task(run_and_respawn(
-                name='%s.%i' % (label, i),
-                cmd=the_cmd,
-                env=the_env,
-                loop=loop,
-                shutdown=shutdown,
-                utc=arguments.use_utc,
+    # Replace all processes without interrupting service on SIGHUP.
+    rolling = {
+        'surge': arguments.rolling_surge,
+        'max_unavailable': arguments.rolling_max_unavailable,
+        'delay': arguments.rolling_delay,
+    }
+    def rolling_restart():
+        for label in sorted(supervisor.process_types):
+            supervisor.rolling_restart(label, **rolling)
+    loop.add_signal_handler(signal.SIGHUP, rolling_restart)
+
+    # Accept commands from other processes.
+    control = None
+    if arguments.control_socket:
+        from strawboss.control import ControlServer
+        control = ControlServer(arguments.control_socket, {
+            'scale': functools.partial(_control_scale, supervisor),
+            'restart': functools.partial(
+                _control_restart, supervisor, rolling,
+            ),
+        }, loop=loop)
+        try:
+            loop.run_until_complete(control.start())
+        except OSError as error:
+            sys.stderr.write('Could not listen on "%s": %s.\n' % (
+                arguments.control_socket, error.strerror,
             ))
-            tasks.append(task)
+            sys.exit(2)
 
-    if not tasks:
-        sys.stderr.write('Nothing to run.\n')
-        sys.exit(2)
+    # Apply changes to the Procfile and env files while running.
+    config = {
+        label: (process_type['cmd'], merge_envs(env, process_type['env']))
+        for label, process_type in process_types.items()
+    }
+    @asyncio.coroutine
+    def status(text):
+        yield from output.write(formatter.status(text))
+    @asyncio.coroutine
+    def reload():
+        try:
+            new_types = procfile.loadfile(arguments.procfile)
+            new_env, missing = _read_env(arguments)
+        except OSError as error:
+            yield from status('Could not reload "%s": %s.' % (
+                error.filename, error.strerror,
+            ))
+            return
+        except ValueError as error:
+            # NOTE: the parsers report all invalid lines at once.
+            errors = error.args[0] if error.args else error
+            if isinstance(errors, list):
+                errors = ' '.join(str(e) for e in errors)
+            yield from status('Could not reload: %s' % errors)
+            return
+        for path in missing:
+            yield from status(
+                'Warning: environment file "%s" not found.' % path
+            )
+        new_config = {
+            label: (process_type['cmd'], merge_envs(
+                new_env, process_type['env'],
+            ))
+            for label, process_type in new_types.items()
+        }
+        from strawboss.reload import diff_process_types
+        added, removed, changed = diff_process_types(config, new_config)
+        if not (added or removed or changed):
+            return
+        if not any(scale_of(label) for label in new_types):
+            yield from status('Could not reload: nothing to run.')
+            return
+        try:
+            definitions = {
+                label: define(label, new_types[label], new_env)
+                for label in added + changed
+            }
+        except ValueError as error:
+            yield from status('Could not reload: %s' % error)
+            return
+        for label in removed:
+            supervisor.scale(label, 0)
+        for label in added + changed:
+            register(label, definitions[label])
+        for label in added:
+            supervisor.scale(label, scale_of(label))
+        late = [
+            label for label in changed
+            if supervisor.rolling_restart(label, **rolling) is None
+        ]
+        config.clear()
+        config.update(new_config)
+        summary = '; '.join(
+            '%s %s' % (what, ', '.join(labels) or 'none')
+            for what, labels in (
+                ('added', added), ('removed', removed), ('changed', changed),
+            )
+        )
+        yield from status('Reloaded "%s": %s.' % (arguments.procfile, summary))
+        for label in late:
+            yield from status(
+                'Rolling restart of %s already in progress, some instances '
+                'may keep the previous configuration.' % label
+            )
+    watcher = None
+    if arguments.reload:
+        from strawboss.reload import FileWatcher
+        watcher = FileWatcher(
+            [arguments.procfile] + (
+                arguments.envfiles if arguments.use_env else []
+            ),
+            reload,
+            delay=arguments.reload_delay,
+            use_inotify=not arguments.reload_poll,
+            loop=loop,
+        )
+
+    # Spawn tasks.
+    if profile:
+        profile.enable()
+    for label, count in effective_scale.items():
+        supervisor.scale(label, count)
+    if watchdog:
+        watchdog.start()
+    if watcher:
+        watcher.start()
 
     # Wait for all tasks to complete.
-    loop.run_until_complete(asyncio.wait(tasks))
+    loop.run_until_complete(supervisor.wait())
+    if profile:
+        profile.disable()
+        try:
+            profile.dump_stats(arguments.profile)
+        except OSError as error:
+            sys.stderr.write('Could not write "%s": %s.\n' % (
+                arguments.profile, error.strerror,
+            ))
+    if monitor:
+        monitor.stop()
+        report = timers.report() if timers else []
+        if arguments.stage_timers or arguments.profile:
+            report.append(monitor.report())
+        for line in report:
+            loop.run_until_complete(output.write(formatter.status(line)))
+    if watcher:
+        loop.run_until_complete(watcher.close())
+    if control:
+        loop.run_until_complete(control.close())
+    if watchdog:
+        loop.run_until_complete(watchdog.close())
+    if server:
+        loop.run_until_complete(server.close())
+        loop.run_until_complete(metrics.close())
+    loop.run_until_complete(output.close())
+    for stream, writer in files.values():
+        loop.run_until_complete(writer.close())
+        stream.close()
+    if logs:
+        loop.run_until_complete(logs.close())
+    for sockets in listeners.values():
+        sockets.close()
     loop.close()
 
 
+def _read_env(arguments):
+    """Reads the env file(s).
+
+    Variables in later files override those in earlier files.
+
+    :return: A ``(env, missing)`` pair with the environment variables and the
+       paths of the files that were not found.
+    """
+    # NOTE: this is only needed to start a supervisor, so don't slow down
+    #       imports of this module (and sub-commands) with it.
+    import dotenvfile
+    env = {}
+    missing = []
+    if arguments.use_env:
+        for path in arguments.envfiles:
+            try:
+                env.update(dotenvfile.loadfile(path))
+            except FileNotFoundError:
+                missing.append(path)
+    return env, missing
+
+
+def _output_limits(arguments, label, env):
+    """Builds the output limits for a process type.
+
+    Settings given on the command-line take precedence over the
+    ``STRAWBOSS_RATE_LIMIT``, ``STRAWBOSS_TYPE_RATE_LIMIT`` and
+    ``STRAWBOSS_SAMPLE`` environment variables of the process type.
+
+    :return: An :py:class:`~strawboss.limits.OutputLimits` object, or
+       ``None`` if the process type's output is not limited.
+    :raise ValueError: An environment variable has an invalid value.
+    """
+    def setting(values, key, convert):
+        value = lookup_process_type(values, label)
+        if value is None and env.get(key):
+            value = convert(env[key])
+        return value
+    rate = setting(arguments.rate_limit, 'STRAWBOSS_RATE_LIMIT',
+                   parse_rate_limit)
+    type_rate = setting(arguments.type_rate_limit,
+                        'STRAWBOSS_TYPE_RATE_LIMIT', parse_rate_limit)
+    sample = setting(arguments.sample, 'STRAWBOSS_SAMPLE', parse_sample)
+    rate, burst = rate or (0.0, None)
+    type_rate, type_burst = type_rate or (0.0, None)
+    sample = sample or 1
+    if not (rate or type_rate or sample > 1):
+        return None
+    # NOTE: only import this when needed to keep startup fast.
+    from strawboss.limits import OutputLimits
+    return OutputLimits(
+        rate=rate,
+        burst=burst,
+        type_rate=type_rate,
+        type_burst=type_burst,
+        sample=sample,
+        report_interval=arguments.rate_limit_report,
+    )
+
+
+def _resource_limits(arguments, label, index):
+    """Builds the resource limits for an instance.
+
+    CPUs given for a process type are spread over its instances (instance
+    ``i`` runs on the ``i``-th CPU, round-robin), whereas CPUs given for an
+    instance (e.g. ``web.1:4-5``) are all assigned to that instance.
+
+    :return: A :py:class:`~strawboss.resources.ResourceLimits` object, or
+       ``None`` if the instance has no limits.
+    :raise ValueError: Some of the settings are not supported.
+    """
+    name = '%s.%d' % (label, index)
+    rlimits = {}
+    for key in ('*', label, name):
+        rlimits.update(
+            value for k, value in arguments.rlimit if k == key
+        )
+    _, nice = lookup_instance(arguments.nice, name)
+    _, ionice = lookup_instance(arguments.ionice, name)
+    key, cpus = lookup_instance(arguments.cpu_affinity, name)
+    if cpus == 'auto':
+        from strawboss.resources import spread_cpus
+        cpus = spread_cpus()
+    if cpus is not None and key != name:
+        cpus = [cpus[index % len(cpus)]]
+    if not (rlimits or nice or ionice or cpus):
+        return None
+    from strawboss.resources import ResourceLimits
+    return ResourceLimits(
+        rlimits=sorted(rlimits.items()),
+        nice=nice,
+        ionice=ionice,
+        cpus=set(cpus) if cpus else None,
+    )
+
+
+def _watchdog_policy(arguments, label):
+    """Builds the watchdog policy for a process type.
+
+    :return: A :py:class:`~strawboss.watchdog.WatchdogPolicy` object, or
+       ``None`` if the process type has no limits.
+    :raise ValueError: The settings are inconsistent.
+    """
+    max_rss = lookup_process_type(arguments.max_rss, label) or 0
+    max_cpu = lookup_process_type(arguments.max_cpu, label) or 0.0
+    if not (max_rss or max_cpu):
+        return None
+    action = lookup_process_type(arguments.watchdog_action, label)
+    if action == 'alert' and not arguments.watchdog_alert:
+        raise ValueError(
+            'The alert action requires the --watchdog-alert option.'
+        )
+    from strawboss.watchdog import WatchdogPolicy
+    return WatchdogPolicy(
+        max_rss=max_rss,
+        max_cpu=max_cpu,
+        action=action,
+    )
+
+
+def _control_scale(supervisor, *args):
+    """Handler for the ``scale`` command on the control socket."""
+    from strawboss.control import ControlError
+    if not args:
+        raise ControlError('Expecting at least one "process-type=count".')
+    try:
+        requested_scale = [parse_scale(arg.replace('=', ':')) for arg in args]
+    except ValueError as error:
+        raise ControlError(str(error))
+    for label, _ in requested_scale:
+        if label not in supervisor.process_types:
+            raise ControlError('Unknown process type "%s".' % label)
+    for label, count in requested_scale:
+        supervisor.scale(label, count)
+
+
+def _control_restart(supervisor, rolling, *args):
+    """Handler for the ``restart`` command on the control socket."""
+    from strawboss.control import ControlError
+    labels = args or sorted(supervisor.process_types)
+    for label in labels:
+        if label not in supervisor.process_types:
+            raise ControlError('Unknown process type "%s".' % label)
+    started = [
+        label for label in labels
+        if supervisor.rolling_restart(label, **rolling) is not None
+    ]
+    if not started:
+        raise ControlError('Rolling restart already in progress.')
+
+
+def _send_command(arguments, *args):
+    """Sends a command to a running supervisor (used by sub-commands)."""
+    if not arguments.control_socket:
+        sys.stderr.write('No control socket, use "--control-socket".\n')
+        sys.exit(2)
+    from strawboss.control import ControlError, send_command
+    try:
+        response = send_command(arguments.control_socket, *args)
+    except OSError as error:
+        sys.stderr.write('Could not reach the supervisor: %s.\n' % error)
+        sys.exit(1)
+    except ControlError as error:
+        sys.stderr.write('%s\n' % error)
+        sys.exit(1)
+    if response:
+        print(response)
+
+
 if __name__ == '__main__':  # pragma: no cover
     # Initialize logging for asyncio.
     import logging
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""Control socket for a running supervisor.
+
+The supervisor listens on a UNIX domain socket for commands sent by other
+programs (usually ``strawboss`` itself, invoked with a sub-command).  The
+protocol is line-based: each request is a single line of text made of a command
+name followed by its arguments, separated by whitespace.  Each request gets a
+single line in response, which starts with ``OK`` on success or ``ERROR`` on
+failure (followed by a description of the error).
+"""
+
+import asyncio
+import errno
+import os
+import shlex
+import socket
+import stat
+
+
+class ControlError(Exception):
+    """Raised by command handlers to report an error to the client."""
+
+
+class ControlServer(object):
+    """Accepts commands on a UNIX domain socket.
+
+    :param path: Path to the UNIX domain socket.
+    :param commands: ``dict`` mapping command names to handlers.  Each handler
+       is called with the command's arguments (as strings) and may return a
+       message to include in the response.  Handlers can be coroutines.
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    """
+
+    def __init__(self, path, commands, loop=None):
+        self._path = path
+        self._commands = commands
+        self._loop = loop or asyncio.get_event_loop()
+        self._server = None
+
+    @asyncio.coroutine
+    def start(self):
+        """Start listening for connections.
+
+        .. note:: This function is a coroutine.
+
+        :raise OSError: The socket can't be created (e.g. because a file that
+           is not a socket already exists at ``path``).
+        """
+        # Clean up after a previous instance that didn't exit cleanly, but
+        # never remove anything else.
+        try:
+            mode = os.stat(self._path).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError(
+                    errno.EEXIST, os.strerror(errno.EEXIST), self._path,
+                )
+            os.unlink(self._path)
+        self._server = yield from asyncio.start_unix_server(
+            self._serve, self._path, loop=self._loop,
+        )
+
+    @asyncio.coroutine
+    def close(self):
+        """Stop listening for connections and remove the socket.
+
+        .. note:: This function is a coroutine.
+        """
+        if self._server is None:
+            return
+        self._server.close()
+        yield from self._server.wait_closed()
+        self._server = None
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+    @asyncio.coroutine
+    def _serve(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = yield from reader.readline()
+                except ValueError:
+                    # The line is longer than the reader's buffer.
+                    writer.write(b'ERROR Request is too long.\n')
+                    break
+                if not line:
+                    break
+                try:
+                    request = line.decode('utf-8')
+                except UnicodeDecodeError:
+                    response = 'ERROR Request is not valid UTF-8.'
+                else:
+                    response = yield from self.dispatch(request)
+                writer.write(response.encode('utf-8') + b'\n')
+                yield from writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @asyncio.coroutine
+    def dispatch(self, request):
+        """Execute a single request.
+
+        .. note:: This function is a coroutine.
+
+        :param request: Line of text containing the command and its arguments.
+        :return: The response, as a single line of text.
+        """
+        try:
+            args = shlex.split(request)
+        except ValueError as error:
+            return 'ERROR %s' % error
+        if not args:
+            return 'ERROR Empty command.'
+        try:
+            handler = self._commands[args[0]]
+        except KeyError:
+            return 'ERROR Unknown command "%s".' % args[0]
+        try:
+            result = handler(*args[1:])
+            if asyncio.iscoroutine(result):
+                result = yield from result
+        except (ControlError, ValueError) as error:
+            return 'ERROR %s' % error
+        if result:
+            return 'OK %s' % result
+        return 'OK'
+
+
+def send_command(path, *args, timeout=None):
+    """Send a command to a running supervisor and wait for the response.
+
+    :param path: Path to the supervisor's UNIX domain socket.
+    :param args: Command name followed by its arguments.
+    :param timeout: Maximum time to wait for the response, in seconds.
+    :return: The response, as a single line of text.
+    :raise ControlError: The supervisor reported an error.
+    :raise OSError: Could not connect to the supervisor.
+    """
+    request = ' '.join(shlex.quote(arg) for arg in args) + '\n'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall(request.encode('utf-8'))
+        with client.makefile('rb') as stream:
+            response = stream.readline().decode('utf-8').rstrip('\n')
+    if not response:
+        raise ControlError('No response from supervisor.')
+    if response.startswith('ERROR'):
+        raise ControlError(response[6:])
+    return response[3:]
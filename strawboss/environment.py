@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""Environment variables of children, built once per process type.
+
+The environment of a process type (the supervisor's own environment, the
+env files and the Procfile's variables) is merged and encoded to ``bytes``
+once, when the process type is registered.  The encoded form is then handed
+as is to ``subprocess``/``uvloop`` each time an instance is spawned, which
+skips their own encoding of every variable (they leave ``bytes`` alone).
+
+Variables that differ between instances (e.g. ``LISTEN_FDS``) are layered on
+top of the shared environment.  Each layer is computed once and cached, so
+re-spawning an instance reuses the environment it was first spawned with.
+"""
+
+import collections.abc
+import os
+
+
+def _encode(variables):
+    """Encodes variables the same way ``subprocess`` does."""
+    encoded = {}
+    for name, value in variables.items():
+        key = os.fsencode(name)
+        if not key or b'=' in key:
+            raise ValueError('Invalid environment variable name "%s".' % (
+                name,
+            ))
+        encoded[key] = os.fsencode(value)
+    return encoded
+
+
+class Environment(collections.abc.Mapping):
+    """Immutable set of environment variables, encoded once.
+
+    This is a read-only mapping of variable names to values, as strings.
+
+    :param envs: Mappings of variable names to values, merged in order (see
+       :py:func:`~strawboss.merge_envs`).  ``None`` values are skipped.
+    :raise ValueError: A variable name is empty or contains ``=``.
+    """
+
+    def __init__(self, *envs):
+        variables = {}
+        for env in envs:
+            if env:
+                variables.update(env)
+        self._variables = variables
+        self._envp = _encode(variables)
+        self._layers = {}
+
+    def __getitem__(self, name):
+        return self._variables[name]
+
+    def __iter__(self):
+        return iter(self._variables)
+
+    def __len__(self):
+        return len(self._variables)
+
+    def __repr__(self):
+        return 'Environment(%r)' % (self._variables,)
+
+    @property
+    def envp(self):
+        """Variables encoded for a child process.
+
+        This is a ``dict`` with ``bytes`` names and values, meant to be passed
+        as the ``env`` argument of ``subprocess`` functions.  It is shared by
+        all children and must not be modified.
+        """
+        return self._envp
+
+    def layer(self, overrides=None, remove=()):
+        """Returns this environment with a few variables changed.
+
+        Only ``overrides`` are encoded and results are cached, so layering the
+        same variables again (e.g. each time an instance is re-spawned) costs
+        a ``dict`` lookup.
+
+        :param overrides: Mapping of variables to set.
+        :param remove: Names of variables to unset.
+        :return: An :py:class:`Environment` object.
+        :raise ValueError: A variable name is empty or contains ``=``.
+        """
+        overrides = overrides or {}
+        key = (frozenset(overrides.items()), frozenset(remove))
+        layer = self._layers.get(key)
+        if layer is not None:
+            return layer
+        envp = dict(self._envp)
+        variables = dict(self._variables)
+        for name in remove:
+            envp.pop(os.fsencode(name), None)
+            variables.pop(name, None)
+        envp.update(_encode(overrides))
+        variables.update(overrides)
+        layer = Environment.__new__(Environment)
+        layer._variables = variables
+        layer._envp = envp
+        layer._layers = {}
+        self._layers[key] = layer
+        return layer
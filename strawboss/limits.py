@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""Rate limiting and sampling of output lines.
+
+A single child that logs in a tight loop can flood the supervisor's output
+and starve all other children.  Lines are passed through a
+:py:class:`LineLimiter` before they are formatted, so lines that are dropped
+cost next to nothing.  Dropped lines are counted and the count is reported
+periodically by :py:func:`~strawboss.run_once`.
+"""
+
+import time
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter.
+
+    The bucket holds up to ``burst`` tokens and is refilled at ``rate`` tokens
+    per second.  Each line consumes one token.
+
+    :param rate: Number of tokens added to the bucket each second.
+    :param burst: Capacity of the bucket.  When ``None``, the bucket holds one
+       second's worth of tokens.
+    :param clock: Function that returns the current time, in seconds.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def take(self, count):
+        """Consume up to ``count`` tokens.
+
+        :param count: Number of tokens requested.
+        :return: Number of tokens granted (between ``0`` and ``count``).
+        """
+        now = self._clock()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate,
+        )
+        self._updated = now
+        granted = min(count, int(self._tokens))
+        self._tokens -= granted
+        return granted
+
+    def refund(self, count):
+        """Give back tokens that were taken but not used."""
+        self._tokens = min(self.burst, self._tokens + count)
+
+
+class LineLimiter(object):
+    """Filters the lines of output of one child process.
+
+    Lines are first sampled (only one line in ``sample`` is kept) and the
+    remaining lines must then get a token from each of the ``buckets``.
+
+    :param buckets: Sequence of :py:class:`TokenBucket` objects.  Buckets may
+       be shared with other limiters (e.g. by all instances of a process
+       type).
+    :param sample: Keep one line in ``sample``.  Use ``1`` to keep all lines.
+    """
+
+    def __init__(self, buckets=(), sample=1):
+        self._buckets = list(buckets)
+        self._sample = sample
+        self._seen = 0
+        self.suppressed = 0
+        """Number of lines dropped by rate limiting since the last report."""
+
+    def filter(self, lines):
+        """Returns the lines that should be forwarded.
+
+        :param lines: List of lines, in order.
+        :return: List of lines that were neither sampled out nor suppressed.
+        """
+        if self._sample > 1:
+            offset = -self._seen % self._sample
+            self._seen += len(lines)
+            lines = lines[offset::self._sample]
+        granted = len(lines)
+        taken = []
+        for bucket in self._buckets:
+            if not granted:
+                break
+            granted = bucket.take(granted)
+            taken.append((bucket, granted))
+        # Lines rejected by a later bucket (e.g. the process type's) must not
+        # use up the allowance of earlier ones.
+        for bucket, count in taken:
+            if count > granted:
+                bucket.refund(count - granted)
+        if granted < len(lines):
+            self.suppressed += len(lines) - granted
+            lines = lines[:granted]
+        return lines
+
+    def report(self):
+        """Returns and resets the number of suppressed lines."""
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
+
+
+class OutputLimits(object):
+    """Rate limits and sampling for all instances of one process type.
+
+    Each instance gets its own :py:class:`LineLimiter` (see
+    :py:meth:`limiter`), but all of them share the process type's bucket.
+
+    :param rate: Lines per second allowed for each instance.  Use ``0`` to
+       disable the per-instance limit.
+    :param burst: Capacity of each instance's bucket.
+    :param type_rate: Lines per second allowed for all instances combined.
+       Use ``0`` to disable the per-process type limit.
+    :param type_burst: Capacity of the process type's bucket.
+    :param sample: Keep one line in ``sample``.
+    :param report_interval: Time (in seconds) between reports of the number
+       of suppressed lines.
+    :param clock: Function that returns the current time, in seconds.
+    """
+
+    def __init__(self, rate=0.0, burst=None, type_rate=0.0, type_burst=None,
+                 sample=1, report_interval=10.0, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        self.report_interval = report_interval
+        self._clock = clock
+        self._shared = None
+        if type_rate:
+            self._shared = TokenBucket(type_rate, type_burst, clock=clock)
+
+    def limiter(self):
+        """Returns a new :py:class:`LineLimiter` for one instance."""
+        buckets = []
+        if self.rate:
+            buckets.append(TokenBucket(self.rate, self.burst, self._clock))
+        if self._shared is not None:
+            buckets.append(self._shared)
+        return LineLimiter(buckets, sample=self.sample)
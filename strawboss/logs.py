@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""Per-instance log files.
+
+When the supervisor is given a log directory, the output of each instance
+(e.g. ``web.0``) is written to its own file in that directory instead of
+being mixed with the output of all other instances on the terminal.
+
+Files are written by :py:class:`~strawboss.output.OutputWriter` objects, so
+writes are coalesced into large appends performed in a worker thread and disk
+I/O never blocks the event loop.  Files can be rotated by size and by age.
+Rotated segments are renamed with a timestamp suffix so that they sort in
+chronological order and can optionally be compressed using gzip, in a
+separate thread pool.
+"""
+
+import asyncio
+import concurrent.futures
+import datetime
+import glob
+import gzip
+import os
+import shutil
+import threading
+import time
+
+from strawboss.output import OutputWriter
+
+
+def compress_segment(path):
+    """Compress a rotated segment using gzip and remove the original.
+
+    :param path: Path to the rotated segment.
+    :return: The path to the compressed segment.
+    """
+    with open(path, 'rb') as source:
+        with gzip.open(path + '.tmp', 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+    # NOTE: rename last so that a partially compressed segment is never
+    #       mistaken for a complete one.
+    os.rename(path + '.tmp', path + '.gz')
+    os.unlink(path)
+    return path + '.gz'
+
+
+class RotatingFile(object):
+    """File-like object that appends to a file and rotates it.
+
+    All methods perform blocking I/O, so they should only be called from a
+    worker thread (e.g. by an :py:class:`~strawboss.output.OutputWriter`).
+    The file is opened on the first write.
+
+    :param path: Path to the file.
+    :param max_size: Size (in bytes) after which the file is rotated.  Use
+       ``0`` to disable rotation by size.
+    :param interval: Age (in seconds) after which the file is rotated.  Use
+       ``0`` to disable rotation by age.
+    :param keep: Number of rotated segments to keep.  Use ``0`` to keep all
+       segments.
+    :param compress: When ``True``, rotated segments are compressed using
+       gzip.
+    :param executor: ``concurrent.futures.Executor`` used to compress rotated
+       segments.  When ``None``, segments are compressed synchronously.
+       Old segments are pruned in the same job, once compression completes,
+       so a segment is never removed while it is being compressed.
+    """
+
+    def __init__(self, path, max_size=0, interval=0.0, keep=0,
+                 compress=False, executor=None):
+        self._path = path
+        self._max_size = max_size
+        self._interval = interval
+        self._keep = keep
+        self._compress = compress
+        self._executor = executor
+        self._stream = None
+        self._size = 0
+        self._opened = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """Path to the current segment."""
+        return self._path
+
+    def segments(self):
+        """Returns the paths to all rotated segments, oldest first."""
+        paths = glob.glob(glob.escape(self._path) + '.*')
+        return sorted(
+            path for path in paths if not path.endswith('.tmp')
+        )
+
+    def write(self, text):
+        """Append a block of text to the file, rotating it if necessary."""
+        data = text.encode('utf-8')
+        if self._stream is not None and self._should_rotate(len(data)):
+            self.rotate()
+        if self._stream is None:
+            self._open()
+        self._stream.write(data)
+        self._size += len(data)
+
+    def flush(self):
+        """Flush buffered data to the file."""
+        if self._stream is not None:
+            self._stream.flush()
+
+    def close(self):
+        """Close the file (it is re-opened by the next write)."""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def rotate(self):
+        """Close the current segment and rename it with a timestamp suffix."""
+        self.close()
+        if not os.path.exists(self._path):
+            return
+        # NOTE: rotating more than once per second (e.g. with a small maximum
+        #       size) needs a counter to keep segments in order.
+        prefix = '%s.%s-' % (
+            self._path, datetime.datetime.now().strftime('%Y%m%dT%H%M%S'),
+        )
+        index = max((
+            int(path[len(prefix):len(prefix) + 3])
+            for path in glob.glob(glob.escape(prefix) + '*')
+        ), default=-1) + 1
+        target = '%s%03d' % (prefix, index)
+        os.rename(self._path, target)
+        if not self._compress:
+            self._prune()
+        elif self._executor is None:
+            self._compress_and_prune(target)
+        else:
+            self._executor.submit(self._compress_and_prune, target)
+
+    def _should_rotate(self, size):
+        if self._size and self._max_size:
+            if self._size + size > self._max_size:
+                return True
+        if self._interval and time.time() - self._opened >= self._interval:
+            return True
+        return False
+
+    def _open(self):
+        self._stream = open(self._path, 'ab')
+        self._size = self._stream.tell()
+        self._opened = time.time()
+
+    def _compress_and_prune(self, path):
+        # NOTE: compression jobs of the same file may run in parallel (e.g.
+        #       in an executor with several workers), so prune one at a time.
+        with self._lock:
+            try:
+                compress_segment(path)
+            except FileNotFoundError:
+                # Pruned before it was compressed.
+                pass
+            self._prune()
+
+    def _prune(self):
+        if not self._keep:
+            return
+        for path in self.segments()[:-self._keep]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+class LogDirectory(object):
+    """Directory holding one log file per instance.
+
+    :param path: Path to the directory.  It is created if necessary.
+    :param max_size: Size (in bytes) after which files are rotated.
+    :param interval: Age (in seconds) after which files are rotated.
+    :param keep: Number of rotated segments to keep for each instance.
+    :param compress: When ``True``, rotated segments are compressed using
+       gzip.
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    :param kwds: Extra arguments for the
+       :py:class:`~strawboss.output.OutputWriter` objects (e.g.
+       ``formatter``).
+    """
+
+    def __init__(self, path, max_size=0, interval=0.0, keep=0,
+                 compress=False, loop=None, **kwds):
+        self._path = path
+        self._max_size = max_size
+        self._interval = interval
+        self._keep = keep
+        self._compress = compress
+        self._loop = loop or asyncio.get_event_loop()
+        self._kwds = kwds
+        self._files = {}
+        self._executor = None
+        if compress:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1,
+            )
+        os.makedirs(path, exist_ok=True)
+
+    def writer(self, name):
+        """Returns the writer for an instance's log file.
+
+        All instances with the same name (e.g. an instance and the processes
+        that replace it when it is re-spawned) share the same writer.
+
+        :param name: Name of the instance (e.g. ``'web.0'``).
+        :return: An :py:class:`~strawboss.output.OutputWriter`.
+        """
+        if name not in self._files:
+            stream = RotatingFile(
+                os.path.join(self._path, name + '.log'),
+                max_size=self._max_size,
+                interval=self._interval,
+                keep=self._keep,
+                compress=self._compress,
+                executor=self._executor,
+            )
+            self._files[name] = stream, OutputWriter(
+                stream=stream, loop=self._loop, **self._kwds
+            )
+        return self._files[name][1]
+
+    @asyncio.coroutine
+    def close(self):
+        """Flush and close all files and wait for pending compression.
+
+        .. note:: This function is a coroutine.
+        """
+        for stream, writer in self._files.values():
+            yield from writer.close()
+            yield from self._loop.run_in_executor(None, stream.close)
+        if self._executor is not None:
+            yield from self._loop.run_in_executor(
+                None, self._executor.shutdown,
+            )
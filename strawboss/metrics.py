@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+
+"""Metrics about the supervisor and its children.
+
+Metrics are exposed in the Prometheus text format by a tiny HTTP server that
+listens on a TCP port or on a UNIX domain socket.  Counters are updated as
+events happen (each update is a single ``dict`` operation) and everything that
+needs to be measured (event loop lag, CPU and memory usage of the children) is
+sampled by a background task at a fixed interval, so collection costs very
+little even with a lot of output.
+
+CPU and memory usage are read from ``/proc`` and are only available on
+Linux.
+"""
+
+import asyncio
+import bisect
+import collections
+import errno
+import os
+import stat
+
+
+RESPAWN_DELAY_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+"""Upper bounds (in seconds) of the respawn delay histogram buckets."""
+
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+"""Upper bounds (in seconds) of the event loop lag histogram buckets."""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+"""Content type of the Prometheus text format."""
+
+
+class Histogram(object):
+    """Distribution of observed values.
+
+    :param buckets: Increasing upper bounds of the buckets.  A last bucket for
+       values larger than all bounds is implied.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record one value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    """Formats labels (sorted by name) for the Prometheus text format."""
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                                    .replace('"', '\\"')
+                                    .replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+
+
+def _process_labels(name, **labels):
+    """Labels for a child process (e.g. ``web.0`` is of type ``web``)."""
+    return _labels(type=name.rsplit('.', 1)[0], process=name, **labels)
+
+
+def read_usage(pid='self', proc='/proc'):
+    """Reads the CPU time and resident memory of a process from ``/proc``.
+
+    :param pid: Process ID, or ``'self'`` for the current process.
+    :param proc: Mount point of the ``proc`` file system.
+    :return: A ``(cpu_seconds, rss_bytes)`` pair, or ``None`` if the process
+       doesn't exist (anymore) or ``/proc`` is not available.
+    """
+    try:
+        with open(os.path.join(proc, str(pid), 'stat'), 'rb') as stream:
+            stat = stream.read()
+        with open(os.path.join(proc, str(pid), 'statm'), 'rb') as stream:
+            statm = stream.read()
+    except OSError:
+        return None
+    # NOTE: the command name (2nd field) is in parentheses and may contain
+    #       spaces, so split what follows it.
+    fields = stat[stat.rfind(b')') + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    rss = int(statm.split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return cpu, rss
+
+
+class Metrics(object):
+    """Collects metrics about the supervisor and its children.
+
+    :param interval: Time (in seconds) between samples of the event loop lag
+       and of the resource usage of the children.
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    :param proc: Mount point of the ``proc`` file system.
+    """
+
+    def __init__(self, interval=5.0, loop=None, proc='/proc'):
+        self._interval = interval
+        self._loop = loop or asyncio.get_event_loop()
+        self._proc = proc
+        self._task = None
+        self._children = {}
+        self._writers = {}
+        self.spawns = collections.Counter()
+        """Number of processes spawned, by name."""
+        self.exits = collections.Counter()
+        """Number of processes that exited, by name and exit status."""
+        self.respawn_delays = {}
+        """:py:class:`Histogram` of respawn delays, by process type."""
+        self.lines = collections.Counter()
+        """Number of lines forwarded, by name and stream."""
+        self.bytes = collections.Counter()
+        """Number of bytes read, by name and stream."""
+        self.suppressed = collections.Counter()
+        """Number of lines suppressed by rate limits, by name."""
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        """:py:class:`Histogram` of the event loop's lag."""
+        self.usage = {}
+        """Last sampled CPU time and resident memory, by name."""
+        self.supervisor_usage = None
+        """Last sampled CPU time and resident memory of the supervisor."""
+
+    def add_writer(self, sink, writer):
+        """Report the queue depth and dropped lines of an output writer.
+
+        :param sink: Label for the writer (e.g. ``'terminal'`` or a path).
+        :param writer: :py:class:`~strawboss.output.OutputWriter`.
+        """
+        self._writers[sink] = writer
+
+    def spawned(self, name, pid):
+        """Record that a process was spawned."""
+        self.spawns[name] += 1
+        self._children[pid] = name
+
+    def exited(self, name, pid, status):
+        """Record that a process exited."""
+        self.exits[name, status] += 1
+        self._children.pop(pid, None)
+        self.usage.pop(name, None)
+
+    def respawn_delay(self, name, delay):
+        """Record the delay before re-spawning a process."""
+        label = name.rsplit('.', 1)[0]
+        if label not in self.respawn_delays:
+            self.respawn_delays[label] = Histogram(RESPAWN_DELAY_BUCKETS)
+        self.respawn_delays[label].observe(delay)
+
+    def forwarded(self, name, stream, lines, size):
+        """Record a chunk of output read from a process.
+
+        :param name: Name of the process.
+        :param stream: ``'stdout'`` or ``'stderr'``.
+        :param lines: Number of lines forwarded.
+        :param size: Number of bytes read.
+        """
+        self.lines[name, stream] += lines
+        self.bytes[name, stream] += size
+
+    def start(self):
+        """Start sampling in a background task."""
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    @asyncio.coroutine
+    def close(self):
+        """Stop sampling.
+
+        .. note:: This function is a coroutine.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            yield from self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @asyncio.coroutine
+    def sample(self):
+        """Sample the resource usage of the supervisor and its children.
+
+        .. note:: This function is a coroutine.
+
+        ``/proc`` is read in the event loop's default executor.
+        """
+        children = dict(self._children)
+        usage = yield from self._loop.run_in_executor(
+            None, self._read_usage, children,
+        )
+        self.supervisor_usage = usage.pop(None, None)
+        for pid, name in children.items():
+            # Skip processes that exited while we were sampling.
+            if pid in self._children and usage.get(pid):
+                self.usage[name] = usage[pid]
+
+    def _read_usage(self, children):
+        usage = {pid: read_usage(pid, self._proc) for pid in children}
+        usage[None] = read_usage('self', self._proc)
+        return usage
+
+    @asyncio.coroutine
+    def _run(self):
+        while True:
+            started = self._loop.time()
+            yield from asyncio.sleep(self._interval, loop=self._loop)
+            self.loop_lag.observe(max(
+                self._loop.time() - started - self._interval, 0.0,
+            ))
+            yield from self.sample()
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format."""
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, labels, _number(value)))
+        def histogram(name, help, histograms):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s histogram' % name)
+            for labels, h in histograms:
+                total = 0
+                bounds = [_number(b) for b in h.buckets] + ['+Inf']
+                for bound, count in zip(bounds, h.counts):
+                    total += count
+                    lines.append('%s_bucket%s %d' % (
+                        name, _labels(le=bound, **labels), total,
+                    ))
+                lines.append('%s_sum%s %s' % (
+                    name, _labels(**labels), _number(h.sum),
+                ))
+                lines.append('%s_count%s %d' % (
+                    name, _labels(**labels), h.count,
+                ))
+        metric('strawboss_spawns_total', 'counter',
+               'Number of processes spawned.', [
+                   (_process_labels(name), count)
+                   for name, count in sorted(self.spawns.items())
+               ])
+        metric('strawboss_exits_total', 'counter',
+               'Number of processes that exited, by exit status.', [
+                   (_process_labels(name, status=status), count)
+                   for (name, status), count in sorted(self.exits.items())
+               ])
+        histogram('strawboss_respawn_delay_seconds',
+                  'Delay before re-spawning processes that exited early.', [
+                      ({'type': label}, h)
+                      for label, h in sorted(self.respawn_delays.items())
+                  ])
+        metric('strawboss_lines_total', 'counter',
+               'Number of lines of output forwarded.', [
+                   (_process_labels(name, stream=stream), count)
+                   for (name, stream), count in sorted(self.lines.items())
+               ])
+        metric('strawboss_bytes_total', 'counter',
+               'Number of bytes of output read.', [
+                   (_process_labels(name, stream=stream), count)
+                   for (name, stream), count in sorted(self.bytes.items())
+               ])
+        metric('strawboss_suppressed_lines_total', 'counter',
+               'Number of lines of output suppressed by rate limits.', [
+                   (_process_labels(name), count)
+                   for name, count in sorted(self.suppressed.items())
+               ])
+        metric('strawboss_dropped_lines_total', 'counter',
+               'Number of lines of output dropped by output writers.', [
+                   (_labels(sink=sink), writer.dropped)
+                   for sink, writer in sorted(self._writers.items())
+               ])
+        metric('strawboss_output_queue_depth', 'gauge',
+               'Number of blocks of output waiting to be written.', [
+                   (_labels(sink=sink), writer.pending)
+                   for sink, writer in sorted(self._writers.items())
+               ])
+        histogram('strawboss_event_loop_lag_seconds',
+                  'Delay of timers on the event loop.',
+                  [({}, self.loop_lag)])
+        usage = sorted(self.usage.items())
+        metric('strawboss_child_cpu_seconds_total', 'counter',
+               'CPU time used by running processes.', [
+                   (_process_labels(name), cpu)
+                   for name, (cpu, _) in usage
+               ])
+        metric('strawboss_child_resident_memory_bytes', 'gauge',
+               'Resident memory of running processes.', [
+                   (_process_labels(name), rss)
+                   for name, (_, rss) in usage
+               ])
+        if self.supervisor_usage is not None:
+            cpu, rss = self.supervisor_usage
+            metric('strawboss_cpu_seconds_total', 'counter',
+                   'CPU time used by the supervisor.', [('', cpu)])
+            metric('strawboss_resident_memory_bytes', 'gauge',
+                   'Resident memory of the supervisor.', [('', rss)])
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _number(value):
+    """Formats a number for the Prometheus text format."""
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class MetricsServer(object):
+    """Serves metrics over HTTP.
+
+    Only ``GET /metrics`` is supported.  Each connection serves a single
+    request.
+
+    :param address: ``host:port`` to listen on TCP (the host may be omitted
+       to listen on all interfaces, with or without the colon) or the path to
+       a UNIX domain socket.
+    :param metrics: :py:class:`Metrics` to serve.
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    """
+
+    def __init__(self, address, metrics, loop=None):
+        self._address = address
+        self._metrics = metrics
+        self._loop = loop or asyncio.get_event_loop()
+        self._server = None
+
+    @property
+    def is_unix(self):
+        """``True`` if the server listens on a UNIX domain socket."""
+        return '/' in self._address or not (
+            ':' in self._address or self._address.isdigit()
+        )
+
+    @asyncio.coroutine
+    def start(self):
+        """Start listening for connections.
+
+        .. note:: This function is a coroutine.
+
+        :raise OSError: The address is invalid or already in use.
+        """
+        if self.is_unix:
+            # Clean up after a previous instance that didn't exit cleanly, but
+            # never remove anything else.
+            try:
+                mode = os.stat(self._address).st_mode
+            except FileNotFoundError:
+                pass
+            else:
+                if not stat.S_ISSOCK(mode):
+                    raise FileExistsError(
+                        errno.EEXIST, os.strerror(errno.EEXIST),
+                        self._address,
+                    )
+                os.unlink(self._address)
+            self._server = yield from asyncio.start_unix_server(
+                self._serve, self._address, loop=self._loop,
+            )
+            return
+        host, _, port = self._address.rpartition(':')
+        if not port.isdigit():
+            raise OSError(0, 'Invalid port "%s"' % port)
+        self._server = yield from asyncio.start_server(
+            self._serve, host or None, int(port), loop=self._loop,
+        )
+
+    @asyncio.coroutine
+    def close(self):
+        """Stop listening for connections.
+
+        .. note:: This function is a coroutine.
+        """
+        if self._server is None:
+            return
+        self._server.close()
+        yield from self._server.wait_closed()
+        self._server = None
+        if self.is_unix:
+            try:
+                os.unlink(self._address)
+            except FileNotFoundError:
+                pass
+
+    @asyncio.coroutine
+    def _serve(self, reader, writer):
+        try:
+            request = yield from reader.readline()
+            # Skip headers, we don't need any of them.
+            while (yield from reader.readline()).strip():
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] not in ('GET', 'HEAD'):
+                status, body = '405 Method Not Allowed', ''
+            elif parts[1].split('?', 1)[0] != '/metrics':
+                status, body = '404 Not Found', ''
+            else:
+                status, body = '200 OK', self._metrics.render()
+            body = body.encode('utf-8')
+            writer.write((
+                'HTTP/1.0 %s\r\n'
+                'Content-Type: %s\r\n'
+                'Content-Length: %d\r\n'
+                'Connection: close\r\n'
+                '\r\n' % (status, CONTENT_TYPE, len(body))
+            ).encode('latin-1'))
+            if parts and parts[0] != 'HEAD':
+                writer.write(body)
+            yield from writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
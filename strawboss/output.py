@@ -0,0 +1,639 @@
+# -*- coding: utf-8 -*-
+
+"""Forwarding of child process output to the supervisor's output.
+
+Output is processed in batches rather than one line at a time: the child's
+output stream is read in large chunks, the chunks are split into lines in bulk
+and each batch is written to the output stream using a single call to
+``write()``.
+
+Output from all child processes can be funneled through a single
+:py:class:`OutputWriter`, which owns the output stream and writes to it from a
+worker thread so that a slow consumer never blocks the event loop.
+"""
+
+import asyncio
+import codecs
+import datetime
+import re
+import sys
+import time
+
+from json.encoder import encode_basestring
+from time import monotonic
+
+
+READ_SIZE = 64 * 1024
+"""Maximum number of bytes to read from a child process' stream at once."""
+
+MAX_LINE_LENGTH = 64 * 1024
+"""Length after which lines from child processes are split into fragments."""
+
+MIN_LINE_LENGTH = 4
+"""Smallest maximum line length (long enough for any UTF-8 character)."""
+
+DECODE_ERRORS = ('replace', 'backslashreplace', 'ignore')
+"""Supported policies for handling output that can't be decoded."""
+
+
+OUTPUT_POLICIES = ('block', 'drop', 'spill')
+"""Supported policies for handling output when the output queue is full."""
+
+SPILL_READ_SIZE = 1024 * 1024
+"""Maximum number of bytes to read back from the spill file at once."""
+
+TIMESTAMP_FORMATS = ('iso', 'epoch-ms', 'none')
+"""Supported formats for timestamps in the output."""
+
+TIMESTAMP_PRECISIONS = ('s', 'ms', 'us')
+"""Supported precisions for timestamps in ISO 8601 format."""
+
+OUTPUT_FORMATS = ('text', 'json')
+"""Supported formats for lines in the output."""
+
+
+def now(utc=False):
+    """Returns the current time.
+
+    :param utc: If ``True``, returns a timezone-aware ``datetime`` object in
+       UTC.  When ``False`` (the default), returns a naive ``datetime`` object
+       in local time.
+    :return: A ``datetime`` object representing the current time at the time of
+       the call.
+    """
+    if utc:
+        import dateutil.tz
+        return datetime.datetime.utcnow().replace(tzinfo=dateutil.tz.tzutc())
+    else:
+        return datetime.datetime.now()
+
+
+class Timestamps(object):
+    """Fast formatting of the current time as a prefix for output lines.
+
+    Formatting a ``datetime`` object for each line is expensive, so the date
+    and time (up to the second) are formatted once and cached.  Only the
+    fractional part of the second is formatted on each call.
+
+    The current time is measured using a monotonic clock anchored to the wall
+    clock.  The anchor is refreshed once per second to follow adjustments made
+    to the system clock.
+
+    In the default ``iso`` format with ``us`` precision, the output is the same
+    as ``now(utc).isoformat()``.
+
+    :param utc: When ``True``, format the current time in UTC instead of local
+       time.
+    :param format: One of ``'iso'`` (ISO 8601), ``'epoch-ms'`` (milliseconds
+       since the UNIX epoch) or ``'none'`` (omit timestamps).
+    :param precision: Precision of the ISO 8601 format: one of ``'s'``,
+       ``'ms'`` or ``'us'``.
+    """
+
+    def __init__(self, utc=False, format='iso', precision='us'):
+        if format not in TIMESTAMP_FORMATS:
+            raise ValueError('Invalid timestamp format "%s".' % format)
+        if precision not in TIMESTAMP_PRECISIONS:
+            raise ValueError('Invalid timestamp precision "%s".' % precision)
+        self._utc = utc
+        self._format = format
+        self._precision = precision
+        self._anchor = 0.0
+        self._refresh = float('-inf')
+        self._second = None
+        self._head = ''
+        self._tail = '+00:00 ' if utc else ' '
+
+    @property
+    def format(self):
+        """Format of the timestamps (e.g. ``'iso'``)."""
+        return self._format
+
+    def time(self):
+        """Returns the current time, in seconds since the UNIX epoch."""
+        t = monotonic()
+        if t >= self._refresh:
+            self._anchor = time.time() - t
+            self._refresh = t + 1.0
+        return self._anchor + t
+
+    def prefix(self):
+        """Returns the formatted current time, followed by a space.
+
+        :return: A ``str`` object to insert at the start of output lines.  This
+           is an empty string when the format is ``'none'``.
+        """
+        if self._format == 'none':
+            return ''
+        # NOTE: this is on the hot path, so ``self.time()`` is inlined.
+        t = monotonic()
+        if t >= self._refresh:
+            self._anchor = time.time() - t
+            self._refresh = t + 1.0
+        t += self._anchor
+        if self._format == 'epoch-ms':
+            return '%d ' % round(t * 1000)
+        second, microsecond = divmod(round(t * 1000000), 1000000)
+        if second != self._second:
+            self._second = second
+            if self._utc:
+                t = datetime.datetime.utcfromtimestamp(second)
+            else:
+                t = datetime.datetime.fromtimestamp(second)
+            self._head = t.isoformat()
+        if self._precision == 'us':
+            # NOTE: ``datetime.isoformat()`` omits the fraction when it is 0.
+            if microsecond:
+                return '%s.%06d%s' % (self._head, microsecond, self._tail)
+            return self._head + self._tail
+        if self._precision == 'ms':
+            return '%s.%03d%s' % (self._head, microsecond // 1000, self._tail)
+        return self._head + self._tail
+
+
+class LineSplitter(object):
+    """Splits a stream of bytes into lines of text.
+
+    Data is fed in arbitrary chunks (e.g. as returned by ``read(n)``) and all
+    complete lines contained in the chunk are returned at once.  Any trailing
+    partial line is kept until the next chunk completes it (or until
+    :py:meth:`flush` is called at the end of the stream).
+
+    Lines are stripped of surrounding whitespace, including the line
+    terminator.
+
+    The lines are decoded straight from the chunk (through a ``memoryview``),
+    so the only bytes that are ever copied are those of a partial line.
+
+    Lines longer than ``max_length`` are split into consecutive fragments of
+    at most ``max_length`` characters.  A partial line is never held for more
+    than ``max_length`` bytes: once that much is buffered, it is returned as a
+    fragment, so memory use is bounded no matter what the child writes.
+
+    :param encoding: Character encoding used to decode the lines.
+    :param errors: How to handle bytes that can't be decoded (see
+       :py:data:`DECODE_ERRORS`).  Decoding never raises.
+    :param max_length: Maximum length of a line.
+    :raise ValueError: ``max_length`` is less than :py:data:`MIN_LINE_LENGTH`.
+    """
+
+    def __init__(self, encoding='utf-8', errors='replace',
+                 max_length=MAX_LINE_LENGTH):
+        if max_length < MIN_LINE_LENGTH:
+            raise ValueError('Invalid maximum line length %d.' % max_length)
+        self._encoding = encoding
+        self._errors = errors
+        self._max_length = max_length
+        self._partial = b''
+
+    def feed(self, data):
+        """Process a chunk of data.
+
+        :param data: ``bytes`` object containing the next chunk of the stream.
+        :return: A list of ``str`` objects, one for each line completed by
+           ``data``.  The list is empty if ``data`` does not contain any line
+           terminator.
+        """
+        end = data.rfind(b'\n')
+        if end < 0:
+            self._partial += data
+            if len(self._partial) > self._max_length:
+                return self._fragments()
+            return []
+        if self._partial:
+            data = self._partial + data
+            end += len(self._partial)
+        view = memoryview(data)
+        self._partial = bytes(view[end + 1:])
+        text = str(view[:end], self._encoding, self._errors)
+        lines = [line.strip() for line in text.split('\n')]
+        if len(text) > self._max_length:
+            lines = self._split(lines)
+        if len(self._partial) > self._max_length:
+            lines.extend(self._fragments())
+        return lines
+
+    def flush(self):
+        """Process the end of the stream.
+
+        :return: A list of ``str`` objects containing the last line if the
+           stream did not end with a line terminator, or an empty list
+           otherwise.
+        """
+        data, self._partial = self._partial, b''
+        if not data:
+            return []
+        return self._split([data.decode(self._encoding, self._errors).strip()])
+
+    def _split(self, lines):
+        """Splits lines longer than the maximum length into fragments."""
+        size = self._max_length
+        if max(map(len, lines)) <= size:
+            return lines
+        return [
+            line[i:i + size]
+            for line in lines
+            for i in range(0, len(line) or 1, size)
+        ]
+
+    def _fragments(self):
+        """Returns full-size fragments of the partial line."""
+        data, size = self._partial, self._max_length
+        fragments = []
+        start = 0
+        while len(data) - start > size:
+            end = start + size
+            # NOTE: don't cut multi-byte UTF-8 sequences in half (look at no
+            #       more than 4 bytes in case the data is not UTF-8).
+            for _ in range(4):
+                if data[end] & 0xC0 != 0x80:
+                    break
+                end -= 1
+            else:
+                end = start + size
+            # Always make progress, even if that cuts a character.
+            if end <= start:
+                end = start + size
+            fragments.append(
+                data[start:end].decode(self._encoding, self._errors)
+            )
+            start = end
+        self._partial = data[start:]
+        return fragments
+
+
+def format_lines(prefix, lines):
+    """Prefix each line and join them into a single block of text.
+
+    :param prefix: String to insert at the start of each line.
+    :param lines: Sequence of ``str`` objects, without line terminators.
+    :return: A single ``str`` object containing all lines, each of which is
+       terminated by a newline.
+    """
+    if not lines:
+        return ''
+    return prefix + ('\n' + prefix).join(lines) + '\n'
+
+
+class TextFormat(object):
+    """Formats output as plain text.
+
+    Lines from child processes are prefixed with the timestamp and the child
+    process' name (e.g. ``[web.0] ...``).  The name is followed by the stream
+    for lines from streams other than stdout (e.g. ``[web.0:stderr] ...``).
+    Messages issued by the supervisor itself are prefixed with
+    ``[strawboss]``.
+
+    :param timestamps: :py:class:`Timestamps` used to format the timestamps.
+    """
+
+    def __init__(self, timestamps=None):
+        self.timestamps = timestamps or Timestamps()
+
+    def stream(self, name, pid, stream='stdout'):
+        """Returns a function that formats lines from a child process.
+
+        :param name: Label for the child process (e.g. ``'web.0'``).
+        :param pid: The child process' ID.
+        :param stream: Name of the child's output stream.
+        :return: A function that takes a list of lines and returns a single
+           block of text containing all of them.
+        """
+        if stream == 'stdout':
+            prefix = '[%s] ' % name
+        else:
+            prefix = '[%s:%s] ' % (name, stream)
+        timestamps = self.timestamps
+        def format(lines):
+            return format_lines(timestamps.prefix() + prefix, lines)
+        return format
+
+    def status(self, message, name=None, pid=None):
+        """Formats a message issued by the supervisor.
+
+        :param message: The message, without a line terminator.
+        :param name: Label for the child process the message is about, if any.
+        :param pid: ID of the child process the message is about, if any.
+        :return: A single line of text.
+        """
+        return '%s[strawboss] %s\n' % (self.timestamps.prefix(), message)
+
+
+_JSON_SAFE = bytes(
+    0 if (i < 0x20 and i != 0x0a) or i in b'"\\' else 1 for i in range(256)
+)
+"""Translation table mapping bytes that must be escaped in JSON to zero."""
+
+
+class JSONFormat(object):
+    """Formats output as JSON lines, with one JSON object per line.
+
+    Each object has a ``ts`` field (the timestamp, omitted when the timestamp
+    format is ``'none'``), ``type`` and ``index`` fields (the process type and
+    instance index, parsed from the child's name), a ``pid`` field, a
+    ``stream`` field (``'stdout'`` or ``'stderr'`` for output from the child
+    or ``'strawboss'`` for messages issued by the supervisor) and a
+    ``message`` field.
+
+    The fields that are the same for all lines from a child process are
+    encoded once and cached.  Lines are formatted in batches: all lines that
+    share the same timestamp are joined using a single call and messages are
+    only escaped when the batch contains characters that require it.
+
+    :param timestamps: :py:class:`Timestamps` used to format the timestamps.
+    """
+
+    def __init__(self, timestamps=None):
+        self.timestamps = timestamps or Timestamps()
+
+    def _start(self):
+        # NOTE: a single timestamp is shared by all lines in a batch.
+        timestamp = self.timestamps.prefix()
+        if not timestamp:
+            return '{'
+        if self.timestamps.format == 'epoch-ms':
+            return '{"ts":%s,' % timestamp[:-1]
+        return '{"ts":"%s",' % timestamp[:-1]
+
+    def _fields(self, name, pid, stream):
+        fields = []
+        if name is not None:
+            match = re.match(r'^(.*)\.(\d+)$', name)
+            if match:
+                fields.append('"type":%s' % encode_basestring(match.group(1)))
+                fields.append('"index":%s' % match.group(2))
+            else:
+                fields.append('"type":%s' % encode_basestring(name))
+        if pid is not None:
+            fields.append('"pid":%d' % pid)
+        fields.append('"stream":%s' % encode_basestring(stream))
+        fields.append('"message":')
+        return ','.join(fields)
+
+    def stream(self, name, pid, stream='stdout'):
+        """Returns a function that formats lines from a child process.
+
+        :param name: Label for the child process (e.g. ``'web.0'``).
+        :param pid: The child process' ID.
+        :param stream: Name of the child's output stream.
+        :return: A function that takes a list of lines and returns a single
+           block of text containing all of them.
+        """
+        fields = self._fields(name, pid, stream)
+        def format(lines):
+            if not lines:
+                return ''
+            prefix = self._start() + fields
+            # NOTE: most output doesn't need escaping at all and checking for
+            #       that is much faster than escaping, so do it for the whole
+            #       batch first.
+            text = '\n'.join(lines).encode('utf-8')
+            if 0 not in text.translate(_JSON_SAFE):
+                prefix += '"'
+                return prefix + ('"}\n' + prefix).join(lines) + '"}\n'
+            return prefix + ('}\n' + prefix).join(
+                map(encode_basestring, lines)
+            ) + '}\n'
+        return format
+
+    def status(self, message, name=None, pid=None):
+        """Formats a message issued by the supervisor.
+
+        :param message: The message, without a line terminator.
+        :param name: Label for the child process the message is about, if any.
+        :param pid: ID of the child process the message is about, if any.
+        :return: A single line of text.
+        """
+        return '%s%s%s}\n' % (
+            self._start(),
+            self._fields(name, pid, 'strawboss'),
+            encode_basestring(message),
+        )
+
+
+def encodable(text, encoding):
+    """Escapes characters that can't be written with an encoding.
+
+    Child output may contain any character (including U+FFFD, which replaces
+    undecodable bytes), but the supervisor's own output may use a narrower
+    encoding (e.g. ASCII when the locale is not set).  Such characters are
+    written as backslash escapes instead of failing the whole write.
+
+    :param text: Block of text.
+    :param encoding: Name of the stream's encoding, or ``None``.
+    :return: ``text``, with characters that can't be encoded escaped.
+    """
+    if not encoding or codecs.lookup(encoding).name == 'utf-8':
+        return text
+    return text.encode(encoding, 'backslashreplace').decode(encoding)
+
+
+def write_output(text, stream=None):
+    """Write a block of text to a stream and flush it.
+
+    :param text: Block of text (usually containing one or more full lines).
+    :param stream: File-like object to write to.  When ``None``, the current
+       value of ``sys.stdout`` is used.
+    """
+    if stream is None:
+        stream = sys.stdout
+    stream.write(encodable(text, getattr(stream, 'encoding', None)))
+    stream.flush()
+
+
+class OutputWriter(object):
+    """Single writer for output produced by any number of child processes.
+
+    Blocks of text are queued in memory and written to the output stream by a
+    background task.  All blocks that are pending when the task wakes up are
+    coalesced into a single write.  The actual ``write()`` and ``flush()`` calls
+    are performed in the event loop's default executor so that a slow consumer
+    (e.g. a pipe to ``less`` or to a log shipper) never blocks the event loop.
+
+    The queue is bounded.  When it is full, the ``policy`` decides what happens
+    to new output:
+
+    ``block``
+       :py:meth:`write` waits until there is room in the queue.  The child
+       process' reader stops reading, which eventually blocks the child when
+       its output pipe is full.
+    ``drop``
+       The output is discarded.  The number of dropped lines is counted and
+       reported in the output once the queue has room again.
+    ``spill``
+       The output is appended to a temporary file and written back to the
+       output stream, in order, once the queue has drained.
+
+    Output is discarded once the stream's reader goes away (broken pipe).
+    Characters that the stream's encoding doesn't support are escaped (see
+    :py:func:`encodable`).  Output that can't be written because of other
+    errors (e.g. a full disk) is counted as dropped and the first such error
+    is reported on stderr.
+
+    :param stream: File-like object to write to.  When ``None``, the current
+       value of ``sys.stdout`` is used.
+    :param maxsize: Maximum number of blocks held in the queue.
+    :param policy: One of ``'block'``, ``'drop'`` or ``'spill'``.
+    :param timestamps: :py:class:`Timestamps` used for messages issued by the
+       writer itself.
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    :param formatter: :py:class:`TextFormat` or :py:class:`JSONFormat` used
+       for messages issued by the writer itself.  When ``None``, messages are
+       formatted as text using ``timestamps``.
+    """
+
+    def __init__(self, stream=None, maxsize=1024, policy='block',
+                 timestamps=None, loop=None, formatter=None):
+        if policy not in OUTPUT_POLICIES:
+            raise ValueError('Invalid output policy "%s".' % policy)
+        self._loop = loop or asyncio.get_event_loop()
+        self._stream = stream
+        self._policy = policy
+        self._formatter = formatter or TextFormat(timestamps)
+        self._queue = asyncio.Queue(maxsize=maxsize, loop=self._loop)
+        self._task = None
+        self._closed = False
+        self._broken = False
+        self._failed = False
+        self._spill = None
+        self._spill_pos = 0
+        self._spill_end = 0
+        self._dropped = 0
+        self.dropped = 0
+        """Total number of lines dropped since the writer was created."""
+
+    @property
+    def pending(self):
+        """Number of blocks waiting in the queue."""
+        return self._queue.qsize()
+
+    def start(self):
+        """Start the background task that writes to the output stream.
+
+        Calling this is optional: the task is started on the first write.
+        """
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    @asyncio.coroutine
+    def write(self, text, count=1):
+        """Queue a block of text for output.
+
+        .. note:: This function is a coroutine.
+
+        :param text: Block of text, usually containing one or more full lines.
+        :param count: Number of lines in ``text``, used to account for dropped
+           output.
+        """
+        if self._closed or self._broken:
+            self.dropped += count
+            return
+        self.start()
+        if self._policy == 'block':
+            yield from self._queue.put(text)
+            return
+        if self._spill_end > self._spill_pos:
+            # Keep output in order: once we start spilling, everything goes to
+            # the spill file until the writer has caught up.
+            self._spill_write(text)
+            return
+        if self._queue.full():
+            if self._policy == 'spill':
+                self._spill_write(text)
+            else:
+                self._dropped += count
+                self.dropped += count
+            return
+        if self._dropped:
+            self._queue.put_nowait(self._dropped_notice())
+            if self._queue.full():
+                self._dropped += count
+                self.dropped += count
+                return
+        self._queue.put_nowait(text)
+
+    @asyncio.coroutine
+    def close(self):
+        """Flush all pending output and stop the background task.
+
+        .. note:: This function is a coroutine.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._task is None:
+            return
+        if self._dropped:
+            yield from self._queue.put(self._dropped_notice())
+        yield from self._queue.put(None)
+        yield from self._task
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def _dropped_notice(self):
+        notice = self._formatter.status('%d lines dropped.' % self._dropped)
+        self._dropped = 0
+        return notice
+
+    def _spill_write(self, text):
+        if self._spill is None:
+            import tempfile
+            self._spill = tempfile.TemporaryFile(mode='w+b')
+        self._spill.seek(self._spill_end)
+        self._spill.write(text.encode('utf-8'))
+        self._spill_end = self._spill.tell()
+
+    def _spill_read(self):
+        self._spill.seek(self._spill_pos)
+        data = self._spill.read(SPILL_READ_SIZE)
+        # Don't split multi-byte characters, flush complete lines only.
+        end = data.rfind(b'\n') + 1 or len(data)
+        self._spill_pos += end
+        if self._spill_pos >= self._spill_end:
+            self._spill.seek(0)
+            self._spill.truncate()
+            self._spill_pos = self._spill_end = 0
+        return data[:end].decode('utf-8', 'replace')
+
+    def _write(self, text):
+        write_output(text, self._stream)
+
+    @asyncio.coroutine
+    def _run(self):
+        done = False
+        while not done:
+            blocks = []
+            if self._queue.empty() and self._spill_end > self._spill_pos:
+                blocks.append(self._spill_read())
+            else:
+                blocks.append((yield from self._queue.get()))
+            while not self._queue.empty():
+                blocks.append(self._queue.get_nowait())
+            if blocks[-1] is None:
+                blocks.pop()
+                done = True
+            # Anything spilled while the queue was draining must follow.
+            while done and self._spill_end > self._spill_pos:
+                blocks.append(self._spill_read())
+            text = ''.join(blocks)
+            if not text or self._broken:
+                continue
+            try:
+                yield from self._loop.run_in_executor(None, self._write, text)
+            except BrokenPipeError:
+                # Nobody is listening anymore, discard all future output
+                # instead of blocking children forever.
+                self._broken = True
+            except (OSError, ValueError) as error:
+                # Keep draining the queue (e.g. the disk may have room again
+                # later) so that children are never blocked, but account for
+                # the lost output.
+                self.dropped += text.count('\n')
+                if not self._failed:
+                    self._failed = True
+                    reason = getattr(error, 'strerror', None) or str(error)
+                    sys.stderr.write('Could not write output: %s.\n' % (
+                        reason.rstrip('.'),
+                    ))
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Instrumentation of the supervisor's hot path.
+
+:py:class:`StageTimers` measure the time spent in each stage of the output
+forwarding pipeline and :py:class:`LagMonitor` measures how late the event
+loop runs timers, which tells whether the supervisor is falling behind.
+
+Instrumentation is added by wrapping the objects that make up the pipeline
+(the output streams, splitters, formatters and sinks) when it is requested,
+so the pipeline itself doesn't check whether it is enabled and disabled
+instrumentation costs nothing.
+"""
+
+import asyncio
+import time
+
+
+STAGES = ('read', 'split', 'filter', 'format', 'write')
+"""Stages of the output forwarding pipeline, in order.
+
+``read``
+   Waiting for and reading a chunk of output from a child process (only
+   measured with the ``stream`` transport).
+``split``
+   Splitting chunks into lines and decoding them.
+``filter``
+   Rate limiting and sampling lines.
+``format``
+   Adding timestamps and names to lines.
+``write``
+   Handing blocks of text over to the output (including waiting for room in
+   the output queue).
+"""
+
+
+class _Proxy(object):
+    """Object holding timed methods, see :py:meth:`StageTimers.wrap`."""
+
+
+class StageTimers(object):
+    """Accumulates time spent in each stage of the forwarding pipeline.
+
+    :param clock: Function that returns the current time, in seconds.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        """Total time spent in each stage, in seconds."""
+        self.calls = dict.fromkeys(STAGES, 0)
+        """Number of times each stage ran."""
+
+    def function(self, stage, function):
+        """Returns a version of ``function`` that is timed as ``stage``."""
+        clock = self._clock
+        def timed(*args, **kwds):
+            started = clock()
+            try:
+                return function(*args, **kwds)
+            finally:
+                self.seconds[stage] += clock() - started
+                self.calls[stage] += 1
+        return timed
+
+    def coroutine(self, stage, function):
+        """Returns a version of coroutine ``function`` timed as ``stage``."""
+        clock = self._clock
+        @asyncio.coroutine
+        def timed(*args, **kwds):
+            started = clock()
+            try:
+                return (yield from function(*args, **kwds))
+            finally:
+                self.seconds[stage] += clock() - started
+                self.calls[stage] += 1
+        return timed
+
+    def wrap(self, obj, **methods):
+        """Returns an object whose methods are timed versions of ``obj``'s.
+
+        :param obj: Object to wrap.
+        :param methods: Stage for each method (e.g. ``feed='split'``), or
+           ``None`` for methods that should not be timed.  Only these methods
+           are available on the returned object.
+        """
+        proxy = _Proxy()
+        for name, stage in methods.items():
+            method = getattr(obj, name)
+            if stage is not None and asyncio.iscoroutinefunction(method):
+                method = self.coroutine(stage, method)
+            elif stage is not None:
+                method = self.function(stage, method)
+            setattr(proxy, name, method)
+        return proxy
+
+    def splitter(self, factory):
+        """Wraps a function that returns line splitters."""
+        def splitter():
+            return self.wrap(factory(), feed='split', flush='split')
+        return splitter
+
+    def formatter(self, formatter):
+        """Wraps a formatter so that formatting lines of output is timed."""
+        proxy = self.wrap(formatter, status=None)
+        proxy.stream = lambda *args, **kwds: self.function(
+            'format', formatter.stream(*args, **kwds),
+        )
+        return proxy
+
+    def report(self):
+        """Returns a summary of the time spent in each stage.
+
+        :return: A list of lines of text, one for each stage that ran.
+        """
+        return [
+            '%s: %.3f seconds in %d calls (%.1f us per call).' % (
+                stage, self.seconds[stage], self.calls[stage],
+                self.seconds[stage] / self.calls[stage] * 1e6,
+            )
+            for stage in STAGES if self.calls[stage]
+        ]
+
+
+class LagMonitor(object):
+    """Measures how late the event loop runs timers.
+
+    A timer is scheduled every ``interval`` seconds.  The lag is the
+    difference between the time it should have run and the time it actually
+    ran, which is how long the event loop was busy with something else.
+
+    :param interval: Time (in seconds) between measurements.
+    :param threshold: Lag (in seconds) above which ``warn`` is called.  Use
+       ``0`` to never call it.
+    :param warn: Function called with the lag when it is above the threshold.
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    """
+
+    def __init__(self, interval=0.1, threshold=0.0, warn=None, loop=None):
+        self._interval = interval
+        self._threshold = threshold
+        self._warn = warn
+        self._loop = loop or asyncio.get_event_loop()
+        self._handle = None
+        self._expected = 0.0
+        self.count = 0
+        """Number of measurements."""
+        self.total = 0.0
+        """Sum of all measurements, in seconds."""
+        self.max = 0.0
+        """Largest measurement, in seconds."""
+
+    def start(self):
+        """Start measuring."""
+        if self._handle is None:
+            self._schedule()
+
+    def stop(self):
+        """Stop measuring."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def report(self):
+        """Returns a summary of the measurements as a line of text."""
+        return 'event loop lag: %.3f seconds max, %.3f seconds mean.' % (
+            self.max, self.total / (self.count or 1),
+        )
+
+    def _schedule(self):
+        self._expected = self._loop.time() + self._interval
+        self._handle = self._loop.call_at(self._expected, self._tick)
+
+    def _tick(self):
+        lag = max(self._loop.time() - self._expected, 0.0)
+        self.count += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+        if self._threshold and lag > self._threshold and self._warn:
+            self._warn(lag)
+        self._schedule()
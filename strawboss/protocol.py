@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+"""Protocol-based child process transport.
+
+Child processes started with ``asyncio.create_subprocess_exec()`` have their
+output buffered in a ``StreamReader``: each chunk received from the pipe is
+copied into the reader's internal buffer and copied again when it is read out
+of it.  This module offers an alternative based on ``loop.subprocess_exec()``
+and a custom protocol, which splits lines straight from the chunks received
+from the pipe and hands them over to the output.
+"""
+
+import asyncio
+import collections
+
+from strawboss.output import LineSplitter
+
+
+STREAMS = {1: 'stdout', 2: 'stderr'}
+"""Names of the pipes (by file descriptor)."""
+
+TRANSPORTS = ('stream', 'protocol')
+"""Supported ways to read the output of child processes."""
+
+MAX_PENDING = 16
+"""Number of pending output blocks after which we stop reading from a child."""
+
+
+class OutputProtocol(asyncio.SubprocessProtocol):
+    """Forwards the output of a child process to the supervisor's output.
+
+    Output blocks are written in order by a background task.  When the output
+    can't keep up, the protocol stops reading from the child process' pipe
+    until the backlog is written.
+
+    No output is forwarded until :py:meth:`start` is called.  This allows the
+    caller to write messages about the process (e.g. with its PID) that are
+    guaranteed to come before any output from the process itself.
+
+    Standard output and error are forwarded separately, each to its own sink.
+    The EOF is reported to ``write`` once both pipes are closed.
+
+    :param name: Label for the child process, used as a prefix to all lines.
+    :param write: Coroutine function used to write blocks of output.
+    :param formatter: :py:class:`~strawboss.output.TextFormat` or
+       :py:class:`~strawboss.output.JSONFormat` used to format the output.
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    :param sinks: ``dict`` mapping file descriptors (1 or 2) to the coroutine
+       function used to write lines from that pipe, or to ``None`` to discard
+       them.  Pipes missing from the ``dict`` are written to ``write``.
+    :param limiter: :py:class:`~strawboss.limits.LineLimiter` that filters
+       lines from both pipes.  When ``None``, all lines are forwarded.
+    :param splitter: Function that returns the
+       :py:class:`~strawboss.output.LineSplitter` for each pipe.
+    :param metrics: :py:class:`~strawboss.metrics.Metrics` that counts the
+       lines and bytes of output.
+    """
+
+    def __init__(self, name, write, formatter, loop=None, sinks=None,
+                 limiter=None, splitter=LineSplitter, metrics=None):
+        self._name = name
+        self._write = write
+        self._formatter = formatter
+        self._loop = loop or asyncio.get_event_loop()
+        self._sinks = {1: write, 2: write}
+        self._sinks.update(sinks or {})
+        self._limiter = limiter
+        self._metrics = metrics
+        self._formats = {}
+        self._splitters = {1: splitter(), 2: splitter()}
+        self._open = {1, 2}
+        self._transport = None
+        self._started = False
+        self._held = []
+        self._paused = False
+        self._blocks = collections.deque()
+        self._writer = None
+        self._exited = asyncio.Future(loop=self._loop)
+        self.eof = asyncio.Future(loop=self._loop)
+        """Future that completes once both pipes are closed."""
+
+    def connection_made(self, transport):
+        self._transport = transport
+        pid = transport.get_pid()
+        self._formats = {
+            fd: self._formatter.stream(self._name, pid, stream)
+            for fd, stream in STREAMS.items()
+        }
+
+    def start(self):
+        """Start forwarding output (including output received until now)."""
+        self._started = True
+        held, self._held = self._held, []
+        for method, args in held:
+            method(*args)
+
+    def pipe_data_received(self, fd, data):
+        if not self._started:
+            self._held.append((self.pipe_data_received, (fd, data)))
+            return
+        write = self._sinks[fd]
+        if write is None:
+            return
+        lines = self._splitters[fd].feed(data)
+        if lines and self._limiter is not None:
+            lines = self._limiter.filter(lines)
+        if self._metrics is not None:
+            self._metrics.forwarded(self._name, STREAMS[fd], len(lines),
+                                    len(data))
+        if lines:
+            self._emit(write, self._formats[fd](lines), len(lines))
+
+    def pipe_connection_lost(self, fd, exc):
+        if fd not in self._open:
+            return
+        if not self._started:
+            self._held.append((self.pipe_connection_lost, (fd, exc)))
+            return
+        self._open.discard(fd)
+        write = self._sinks[fd]
+        lines = self._splitters[fd].flush()
+        if lines and self._limiter is not None:
+            lines = self._limiter.filter(lines)
+        if lines and self._metrics is not None:
+            self._metrics.forwarded(self._name, STREAMS[fd], len(lines), 0)
+        if write is not None and lines:
+            self._emit(write, self._formats[fd](lines), len(lines))
+        if not self._open:
+            pid = self._transport.get_pid()
+            self._emit(self._write, self._formatter.status(
+                'EOF from %s(%d).' % (self._name, pid), self._name, pid,
+            ), 1)
+            if not self.eof.done():
+                self.eof.set_result(None)
+
+    def process_exited(self):
+        if not self._exited.done():
+            self._exited.set_result(self._transport.get_returncode())
+
+    @asyncio.coroutine
+    def wait(self):
+        """Wait until the process completes.
+
+        .. note:: This function is a coroutine.
+
+        :return: The process' exit status.
+        """
+        return (yield from asyncio.shield(self._exited, loop=self._loop))
+
+    def _emit(self, write, text, count):
+        self._blocks.append((write, text, count))
+        if self._writer is None:
+            self._writer = self._loop.create_task(self._drain())
+        if len(self._blocks) >= MAX_PENDING and not self._paused:
+            self._pause_reading(True)
+
+    @asyncio.coroutine
+    def _drain(self):
+        try:
+            while self._blocks:
+                write, text, count = self._blocks.popleft()
+                yield from write(text, count)
+                if self._paused and len(self._blocks) < MAX_PENDING // 2:
+                    self._pause_reading(False)
+        finally:
+            self._writer = None
+
+    def _pause_reading(self, paused):
+        self._paused = paused
+        for fd in self._open:
+            pipe = self._transport.get_pipe_transport(fd)
+            if pipe is None:
+                continue
+            if paused:
+                pipe.pause_reading()
+            else:
+                pipe.resume_reading()
+
+    @asyncio.coroutine
+    def close(self):
+        """Write all pending output and release the transport.
+
+        .. note:: This function is a coroutine.
+        """
+        self._transport.close()
+        if self._writer is not None:
+            yield from asyncio.shield(self._writer, loop=self._loop)
+
+
+class ProtocolProcess(object):
+    """Child process started with :py:func:`create_protocol_subprocess`.
+
+    Offers the subset of the interface of asyncio's ``Process`` objects that
+    :py:func:`~strawboss.run_once` needs.
+    """
+
+    def __init__(self, transport, protocol):
+        self._transport = transport
+        self._protocol = protocol
+
+    @property
+    def pid(self):
+        """The process' ID."""
+        return self._transport.get_pid()
+
+    @property
+    def protocol(self):
+        """The :py:class:`OutputProtocol` forwarding the process' output."""
+        return self._protocol
+
+    def wait(self):
+        """Wait until the process completes (coroutine)."""
+        return self._protocol.wait()
+
+    def send_signal(self, signum):
+        """Send a signal to the process."""
+        self._transport.send_signal(signum)
+
+    def kill(self):
+        """Send SIGKILL to the process."""
+        self._transport.kill()
+
+
+@asyncio.coroutine
+def create_protocol_subprocess(name, write, formatter, *cmd, loop=None,
+                               sinks=None, limiter=None, splitter=LineSplitter,
+                               metrics=None, **kwds):
+    """Start a child process whose output is forwarded by a protocol.
+
+    .. note:: This function is a coroutine.
+
+    Output is not forwarded until the protocol's
+    :py:meth:`~OutputProtocol.start` method is called.
+
+    :param name: Label for the child process, used as a prefix to all lines.
+    :param write: Coroutine function used to write blocks of output.
+    :param formatter: :py:class:`~strawboss.output.TextFormat` or
+       :py:class:`~strawboss.output.JSONFormat` used to format the output.
+    :param cmd: Command-line used to start the child process.
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    :param sinks: Where to write lines from each pipe, see
+       :py:class:`OutputProtocol`.
+    :param limiter: :py:class:`~strawboss.limits.LineLimiter` that filters
+       lines from both pipes, see :py:class:`OutputProtocol`.
+    :param splitter: Function that returns the
+       :py:class:`~strawboss.output.LineSplitter` for each pipe.
+    :param metrics: :py:class:`~strawboss.metrics.Metrics` that counts the
+       lines and bytes of output.
+    :param kwds: Extra arguments for ``loop.subprocess_exec()`` (e.g.
+       ``env``).
+    :return: A :py:class:`ProtocolProcess` object.
+    """
+    loop = loop or asyncio.get_event_loop()
+    transport, protocol = yield from loop.subprocess_exec(
+        lambda: OutputProtocol(
+            name, write, formatter, loop=loop, sinks=sinks, limiter=limiter,
+            splitter=splitter, metrics=metrics,
+        ),
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        **kwds
+    )
+    return ProtocolProcess(transport, protocol)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+"""Readiness probes and dependencies between process types.
+
+A process type can have a readiness probe that tells when each of its
+instances is ready to do its job (e.g. accepts connections).  Process types
+can depend on other process types, in which case their instances are only
+started once all instances of their dependencies are ready, so that they
+don't fail (and get re-spawned) because the services they use are not
+available yet.  Process types that don't depend on each other are started in
+parallel.
+
+Probes are polled in the background after each instance is spawned, except
+for log probes, which watch the instance's output as it is forwarded.
+"""
+
+import asyncio
+import re
+
+
+class Probe(object):
+    """Base class for readiness probes.
+
+    Subclasses define a ``check(loop)`` coroutine that returns ``True`` once
+    the process is ready.
+
+    :param interval: Time (in seconds) between checks.  When ``None``,
+       :py:attr:`default_interval` is used.
+    """
+
+    default_interval = 0.1
+    """Time (in seconds) between checks, unless specified."""
+
+    def __init__(self, interval=None):
+        if interval is None:
+            interval = self.default_interval
+        self.interval = interval
+
+    def instance(self):
+        """Returns a probe for a single process.
+
+        Stateless probes are shared by all instances of a process type.
+        """
+        return self
+
+    def splitter(self, factory):
+        """Wraps a function that returns line splitters to watch output."""
+        return factory
+
+    @asyncio.coroutine
+    def wait(self, loop):
+        """Wait until the process is ready.
+
+        .. note:: This function is a coroutine.
+        """
+        while not (yield from self.check(loop)):
+            yield from asyncio.sleep(self.interval, loop=loop)
+
+
+class TCPProbe(Probe):
+    """Ready when a TCP port accepts connections.
+
+    :param port: TCP port number.
+    :param host: Host name or address.
+    :param timeout: Time (in seconds) allowed to connect.
+    """
+
+    def __init__(self, port, host='127.0.0.1', timeout=1.0, **kwds):
+        super().__init__(**kwds)
+        self.port = port
+        self.host = host
+        self.timeout = timeout
+
+    @asyncio.coroutine
+    def check(self, loop):
+        try:
+            _, writer = yield from asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, loop=loop),
+                timeout=self.timeout, loop=loop,
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+
+class HTTPProbe(Probe):
+    """Ready when an HTTP ``GET`` request gets a 200 response.
+
+    :param port: TCP port number.
+    :param host: Host name or address.
+    :param path: Path of the resource to request.
+    :param timeout: Time (in seconds) allowed to get the response's status.
+    """
+
+    def __init__(self, port, host='127.0.0.1', path='/', timeout=1.0,
+                 **kwds):
+        super().__init__(**kwds)
+        self.port = port
+        self.host = host
+        self.path = path
+        self.timeout = timeout
+
+    @asyncio.coroutine
+    def check(self, loop):
+        try:
+            status = yield from asyncio.wait_for(
+                self._request(loop), timeout=self.timeout, loop=loop,
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        return status == 200
+
+    @asyncio.coroutine
+    def _request(self, loop):
+        reader, writer = yield from asyncio.open_connection(
+            self.host, self.port, loop=loop,
+        )
+        try:
+            writer.write((
+                'GET %s HTTP/1.0\r\nHost: %s:%d\r\n\r\n' % (
+                    self.path, self.host, self.port,
+                )
+            ).encode('ascii'))
+            line = yield from reader.readline()
+        finally:
+            writer.close()
+        match = re.match(rb'^HTTP/\d\.\d (\d{3})', line)
+        return int(match.group(1)) if match else None
+
+
+class CommandProbe(Probe):
+    """Ready when a shell command completes with exit status 0.
+
+    Each check spawns a shell, so checks are less frequent than for other
+    probes by default.
+
+    :param command: Shell command.
+    :param timeout: Time (in seconds) after which the command is killed.
+    """
+
+    default_interval = 1.0
+
+    def __init__(self, command, timeout=10.0, **kwds):
+        super().__init__(**kwds)
+        self.command = command
+        self.timeout = timeout
+
+    @asyncio.coroutine
+    def check(self, loop):
+        try:
+            process = yield from asyncio.create_subprocess_shell(
+                self.command, loop=loop,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except OSError:
+            return False
+        try:
+            status = yield from asyncio.wait_for(
+                process.wait(), timeout=self.timeout, loop=loop,
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            yield from process.wait()
+            return False
+        return status == 0
+
+
+class LogProbe(Probe):
+    """Ready when a line of output matches a regular expression.
+
+    :param pattern: Regular expression, searched in each line of output (on
+       both streams, before lines are rate limited).
+    """
+
+    def __init__(self, pattern, **kwds):
+        super().__init__(**kwds)
+        self.pattern = re.compile(pattern)
+
+    def instance(self):
+        return _LogWatch(self.pattern, interval=self.interval)
+
+
+class _LogWatch(Probe):
+    """State of a :py:class:`LogProbe` for a single process."""
+
+    def __init__(self, pattern, **kwds):
+        super().__init__(**kwds)
+        self._pattern = pattern
+        self.matched = False
+
+    def splitter(self, factory):
+        def splitter():
+            return _WatchedSplitter(factory(), self)
+        return splitter
+
+    def scan(self, lines):
+        for line in lines:
+            if self._pattern.search(line):
+                self.matched = True
+                break
+
+    @asyncio.coroutine
+    def check(self, loop):
+        return self.matched
+
+
+class _WatchedSplitter(object):
+    """Line splitter that shows lines to a :py:class:`_LogWatch`."""
+
+    def __init__(self, splitter, watch):
+        self._splitter = splitter
+        self._watch = watch
+
+    def feed(self, data):
+        lines = self._splitter.feed(data)
+        if not self._watch.matched:
+            self._watch.scan(lines)
+        return lines
+
+    def flush(self):
+        lines = self._splitter.flush()
+        if not self._watch.matched:
+            self._watch.scan(lines)
+        return lines
+
+
+def parse_probe(x):
+    """Parses a readiness probe.
+
+    Probes are written as ``tcp:[host:]port``, ``http:[host:]port[/path]``,
+    ``log:regex`` or ``exec:command``.
+
+    :return: A :py:class:`Probe`.
+    :raise ValueError: the string ``x`` is not a valid probe.
+    """
+    kind, _, spec = x.partition(':')
+    if kind == 'tcp':
+        match = re.match(r'^(?:([^:/]+):)?(\d+)$', spec)
+        if match:
+            return TCPProbe(int(match.group(2)),
+                            host=match.group(1) or '127.0.0.1')
+    elif kind == 'http':
+        match = re.match(r'^(?:([^:/]+):)?(\d+)(/\S*)?$', spec)
+        if match:
+            return HTTPProbe(int(match.group(2)),
+                             host=match.group(1) or '127.0.0.1',
+                             path=match.group(3) or '/')
+    elif kind == 'log' and spec:
+        try:
+            return LogProbe(spec)
+        except re.error:
+            pass
+    elif kind == 'exec' and spec.strip():
+        return CommandProbe(spec)
+    raise ValueError('Invalid readiness probe "%s".' % x)
+
+
+def parse_dependencies(x):
+    """Splits a comma-separated list of process types.
+
+    :raise ValueError: the string ``x`` is not a valid list.
+    """
+    labels = [label.strip() for label in x.split(',')]
+    if not all(labels):
+        raise ValueError('Invalid list of process types "%s".' % x)
+    return labels
+
+
+def check_dependencies(dependencies):
+    """Makes sure the dependencies between process types can be satisfied.
+
+    :param dependencies: Mapping of all process types to the sequence of
+       process types they depend on.
+    :raise ValueError: A process type depends on an unknown process type or
+       dependencies are circular.
+    """
+    for label, requires in dependencies.items():
+        for other in requires:
+            if other not in dependencies:
+                raise ValueError('Process type "%s" depends on unknown '
+                                 'process type "%s".' % (label, other))
+    # Depth-first search, remembering the path to report cycles.
+    done = set()
+    def visit(label, path):
+        if label in path:
+            cycle = path[path.index(label):] + [label]
+            raise ValueError(
+                'Circular dependencies: %s.' % ' -> '.join(cycle)
+            )
+        if label in done:
+            return
+        for other in dependencies[label]:
+            visit(other, path + [label])
+        done.add(label)
+    for label in sorted(dependencies):
+        visit(label, [])
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""Reloading the Procfile and environment files while processes run.
+
+Files are watched with ``inotify`` on Linux (the directories that contain
+them are watched, so that editors that replace files by renaming a new copy
+over them are supported) and by polling their status at a fixed interval
+elsewhere.  Changes are debounced: the configuration is only reloaded once
+the files have not changed for a short while, so that a file that is written
+in several steps is read once, after the last step.
+
+Reloads are applied by difference: only process types whose command or
+environment changed are restarted (see
+:py:meth:`~strawboss.Supervisor.rolling_restart`), new process types are
+started, removed ones are scaled down to zero and all other instances keep
+running undisturbed.
+"""
+
+import asyncio
+import errno
+import os
+import struct
+
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+INOTIFY_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+    IN_DELETE
+)
+"""Events that may change the contents of a file in a watched directory.
+
+``IN_MODIFY`` is left out on purpose: files are only read once they have
+been closed.
+"""
+
+_EVENT = struct.Struct('iIII')
+
+
+def diff_process_types(old, new):
+    """Compares two configurations.
+
+    :param old: Mapping of process types to their definition (e.g. their
+       command and environment), as currently running.
+    :param new: Mapping of process types to their definition, as reloaded.
+    :return: A ``(added, removed, changed)`` triple of sorted lists of
+       process types.
+    """
+    added = sorted(set(new).difference(old))
+    removed = sorted(set(old).difference(new))
+    changed = sorted(
+        label for label in set(old).intersection(new)
+        if old[label] != new[label]
+    )
+    return added, removed, changed
+
+
+class Inotify(object):
+    """Events on files in a set of directories, from ``inotify(7)``.
+
+    :param directories: Directories to watch.
+    :raise OSError: ``inotify`` is not supported or the directories can't be
+       watched.
+    """
+
+    def __init__(self, directories):
+        # NOTE: only import this when needed to keep startup fast.
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self._directories = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), INOTIFY_MASK,
+            )
+            if wd < 0:
+                code = ctypes.get_errno()
+                self.close()
+                raise OSError(code, os.strerror(code), directory)
+            self._directories[wd] = directory
+
+    def read(self):
+        """Returns pending events.
+
+        :return: A list of paths of files that changed.  When events were
+           lost, ``None`` is included in the list.
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, size = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + size].rstrip(b'\0')
+            offset += size
+            if mask & IN_Q_OVERFLOW:
+                paths.append(None)
+            elif wd in self._directories and name:
+                paths.append(os.path.join(
+                    self._directories[wd], os.fsdecode(name),
+                ))
+        return paths
+
+    def close(self):
+        """Stop watching."""
+        os.close(self.fd)
+
+
+class FileWatcher(object):
+    """Calls a coroutine function when files change.
+
+    Changes are debounced and calls are never concurrent: changes that occur
+    while the function runs trigger another call once it completes.
+
+    :param paths: Paths of the files to watch.  Files don't need to exist.
+    :param callback: Coroutine function, called without arguments.
+    :param delay: Time (in seconds) during which files must not change
+       before ``callback`` is called.
+    :param interval: Time (in seconds) between polls of the files' status,
+       when ``inotify`` is not used.
+    :param use_inotify: When ``False``, always poll the files' status (e.g.
+       for network file systems, whose changes don't trigger ``inotify``
+       events).
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    """
+
+    def __init__(self, paths, callback, delay=1.0, interval=1.0,
+                 use_inotify=True, loop=None):
+        self._paths = {os.path.abspath(path) for path in paths}
+        self._callback = callback
+        self._delay = delay
+        self._interval = interval
+        self._use_inotify = use_inotify
+        self._loop = loop or asyncio.get_event_loop()
+        self._inotify = None
+        self._task = None
+        self._timer = None
+        self._running = None
+        self._again = False
+
+    @property
+    def method(self):
+        """``'inotify'`` or ``'polling'``, once started."""
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    def start(self):
+        """Start watching, using ``inotify`` if possible."""
+        if self._use_inotify:
+            try:
+                self._inotify = Inotify(sorted({
+                    os.path.dirname(path) for path in self._paths
+                }))
+            except OSError:
+                pass
+        if self._inotify is not None:
+            self._loop.add_reader(self._inotify.fd, self._read)
+        else:
+            self._task = self._loop.create_task(self._poll(self._stat()))
+
+    @asyncio.coroutine
+    def close(self):
+        """Stop watching and wait until ``callback`` completes.
+
+        .. note:: This function is a coroutine.
+        """
+        if self._inotify is not None:
+            self._loop.remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                yield from self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._again = False
+        if self._running is not None:
+            yield from asyncio.wait([self._running], loop=self._loop)
+
+    def _read(self):
+        paths = self._inotify.read()
+        if any(path is None or path in self._paths for path in paths):
+            self._changed()
+
+    def _stat(self):
+        status = {}
+        for path in self._paths:
+            try:
+                info = os.stat(path)
+            except OSError:
+                status[path] = None
+            else:
+                status[path] = (info.st_ino, info.st_size, info.st_mtime_ns)
+        return status
+
+    @asyncio.coroutine
+    def _poll(self, status):
+        while True:
+            yield from asyncio.sleep(self._interval, loop=self._loop)
+            current = yield from self._loop.run_in_executor(None, self._stat)
+            if current != status:
+                status = current
+                self._changed()
+
+    def _changed(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._loop.call_later(self._delay, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        if self._running is not None:
+            self._again = True
+            return
+        self._running = self._loop.create_task(self._callback())
+        self._running.add_done_callback(self._done)
+
+    def _done(self, _):
+        self._running = None
+        if self._again:
+            self._again = False
+            self._fire()
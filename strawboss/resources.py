@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""Resource limits, scheduling priorities and CPU affinity of children.
+
+All settings are applied in the child process itself, after it is forked and
+before the command is executed, so that they also apply to any process (or
+thread) the command starts in turn.  Applying them from the supervisor once
+the command runs would miss threads and processes started in the meantime
+(CPU affinity and priorities are per thread on Linux).
+
+The supervisor has threads when children are forked (e.g. to write output),
+which Python warns may deadlock ``preexec_fn`` if it takes a lock that another
+thread held at the time.  Everything is prepared beforehand so that the child
+only makes plain system calls, without importing modules or allocating
+anything that could need such locks.
+"""
+
+import functools
+import glob
+import os
+import re
+import resource
+
+
+RLIMITS = {
+    name[len('RLIMIT_'):].lower(): getattr(resource, name)
+    for name in dir(resource) if name.startswith('RLIMIT_')
+}
+"""Resource names (e.g. ``'nofile'``) and the matching ``RLIMIT_*``."""
+
+IONICE_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+"""I/O scheduling classes (see ``ionice(1)``)."""
+
+IOPRIO_SET = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+    's390x': 282,
+}
+"""Number of the ``ioprio_set`` system call, by machine."""
+
+
+def parse_rlimit(x):
+    """Splits a "%s=%s" (resource name and limit) string.
+
+    Limits can have a K, M or G suffix or be ``unlimited``.
+
+    :return: A ``(int, int)`` pair with the ``RLIMIT_*`` constant and the
+       limit.
+
+    :raise ValueError: the string ``x`` does not respect the input format.
+    """
+    match = re.match(
+        r'^([a-z]+)=(?:(\d+)([KMG]?)|unlimited)$', x.strip(), re.IGNORECASE,
+    )
+    if not match or match.group(1).lower() not in RLIMITS:
+        raise ValueError('Invalid resource limit "%s".' % x)
+    limit = resource.RLIM_INFINITY
+    if match.group(2) is not None:
+        limit = int(match.group(2)) * 1024 ** ' KMG'.index(
+            match.group(3).upper() or ' '
+        )
+    return RLIMITS[match.group(1).lower()], limit
+
+
+def parse_nice(x):
+    """Converts a niceness increment (between -20 and 19) to an int.
+
+    :raise ValueError: the string ``x`` is not a valid niceness.
+    """
+    if not re.match(r'^[+-]?\d+$', x) or not -20 <= int(x) <= 19:
+        raise ValueError('Invalid niceness "%s".' % x)
+    return int(x)
+
+
+def parse_ionice(x):
+    """Splits a "%s[:%d]" (I/O scheduling class and level) string.
+
+    :return: A ``(int, int)`` pair with the class and the level (between 0
+       and 7).
+
+    :raise ValueError: the string ``x`` does not respect the input format.
+    """
+    match = re.match(r'^([a-z-]+)(?::([0-7]))?$', x)
+    if not match or match.group(1) not in IONICE_CLASSES:
+        raise ValueError('Invalid I/O scheduling class "%s".' % x)
+    return IONICE_CLASSES[match.group(1)], int(match.group(2) or 4)
+
+
+def parse_cpus(x):
+    """Parses a list of CPUs (e.g. "0-3,8") or "auto".
+
+    :return: A sorted list of CPU numbers, or ``'auto'``.
+
+    :raise ValueError: the string ``x`` is not a valid list of CPUs.
+    """
+    if x == 'auto':
+        return x
+    cpus = set()
+    for part in x.split(','):
+        match = re.match(r'^(\d+)(?:-(\d+))?$', part.strip())
+        if not match:
+            raise ValueError('Invalid list of CPUs "%s".' % x)
+        first = int(match.group(1))
+        cpus.update(range(first, int(match.group(2) or first) + 1))
+    if not cpus:
+        raise ValueError('Invalid list of CPUs "%s".' % x)
+    return sorted(cpus)
+
+
+def spread_cpus(sysfs='/sys/devices/system/node'):
+    """Orders the CPUs available to this process to spread instances.
+
+    CPUs of different NUMA nodes are interleaved, so that consecutive
+    instances are assigned to different NUMA nodes before they are assigned
+    to different cores of the same node.
+
+    :param sysfs: Path to the NUMA nodes in the ``sys`` file system.
+    :return: A list of CPU numbers.
+    """
+    available = os.sched_getaffinity(0)
+    nodes = []
+    for path in sorted(glob.glob(os.path.join(sysfs, 'node[0-9]*'))):
+        try:
+            with open(os.path.join(path, 'cpulist'), 'r') as stream:
+                cpus = parse_cpus(stream.read().strip())
+        except (OSError, ValueError):
+            continue
+        cpus = [cpu for cpu in cpus if cpu in available]
+        if cpus:
+            nodes.append(cpus)
+    if not nodes:
+        return sorted(available)
+    order = []
+    for i in range(max(map(len, nodes))):
+        order.extend(cpus[i] for cpus in nodes if i < len(cpus))
+    # CPUs that don't belong to any known node go last.
+    order.extend(sorted(available.difference(order)))
+    return order
+
+
+class ResourceLimits(object):
+    """Resource limits, priorities and CPU affinity for one process.
+
+    :param rlimits: Sequence of ``(resource, limit)`` pairs, where
+       ``resource`` is one of the ``RLIMIT_*`` constants.  Both the soft and
+       the hard limits are set.
+    :param nice: Niceness increment.
+    :param ionice: ``(class, level)`` pair for the I/O scheduling priority.
+    :param cpus: Set of CPUs the process may run on.
+    :raise ValueError: One of the settings is not supported on this platform.
+    """
+
+    def __init__(self, rlimits=(), nice=None, ionice=None, cpus=None):
+        if ionice is not None and os.uname().machine not in IOPRIO_SET:
+            raise ValueError('I/O scheduling classes are not supported.')
+        if cpus is not None and not hasattr(os, 'sched_setaffinity'):
+            raise ValueError('CPU affinity is not supported.')
+        self.rlimits = list(rlimits)
+        self.nice = nice
+        self.ionice = ionice
+        self.cpus = cpus
+        # NOTE: don't import anything in the child, where we're only allowed
+        #       to do the bare minimum.
+        self._syscall = None
+        if ionice is not None:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            self._syscall = functools.partial(
+                libc.syscall, IOPRIO_SET[os.uname().machine],
+                # NOTE: who = 0 means the calling process (IOPRIO_WHO_PROCESS
+                #       = 1).
+                1, 0, ionice[0] << 13 | ionice[1],
+            )
+            self._get_errno = ctypes.get_errno
+
+    def apply(self):
+        """Apply all settings to the calling process.
+
+        This is meant to be used as the ``preexec_fn`` of a child process.
+        Each setting is a single system call.
+        """
+        for limit, value in self.rlimits:
+            resource.setrlimit(limit, (value, value))
+        if self.nice:
+            os.nice(self.nice)
+        if self._syscall is not None and self._syscall() != 0:
+            errno = self._get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if self.cpus is not None:
+            os.sched_setaffinity(0, self.cpus)
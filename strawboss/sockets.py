@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""Listening sockets bound by the supervisor and passed to children.
+
+Sockets are bound once by the supervisor and passed to children using the
+same convention as systemd's socket activation (see ``sd_listen_fds(3)``):
+the sockets are file descriptors 3, 4, etc. of the child, their count is in
+the ``LISTEN_FDS`` environment variable and the child's process ID is in
+``LISTEN_PID``.  Since the supervisor keeps the sockets open, connections are
+queued by the kernel while an instance is re-spawned instead of being
+refused.
+
+By default, all instances of a process type share the same sockets and the
+kernel hands each connection to one of the instances that are waiting in
+``accept()``.  With ``SO_REUSEPORT``, each instance gets its own sockets
+(bound to the same address) and the kernel spreads connections evenly over
+them.
+"""
+
+import fcntl
+import os
+import re
+import socket
+import stat
+
+from strawboss.environment import Environment
+
+
+LISTEN_FDS_START = 3
+"""First file descriptor passed to children (``SD_LISTEN_FDS_START``)."""
+
+LISTEN_COMMAND = ['/bin/sh', '-c', 'LISTEN_PID=$$; export LISTEN_PID; '
+                                   'exec "$@"', 'strawboss']
+"""Prefix of commands that receive sockets.
+
+``LISTEN_PID`` must hold the child's process ID, which is only known once it
+is forked, so commands are started by a shell that sets it before replacing
+itself with the command.
+"""
+
+
+def parse_address(x):
+    """Parses the address of a listening socket.
+
+    Addresses are written as ``[host:]port`` for TCP sockets or as a path
+    that contains a ``/`` for UNIX domain sockets.
+
+    :return: A ``(family, address)`` pair, as expected by ``socket.bind()``.
+    :raise ValueError: the string ``x`` is not a valid address.
+    """
+    if '/' in x:
+        return socket.AF_UNIX, x
+    match = re.match(r'^(?:(.*):)?(\d+)$', x)
+    if not match or int(match.group(2)) > 65535:
+        raise ValueError('Invalid address "%s".' % x)
+    host = (match.group(1) or '0.0.0.0').strip('[]')
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    return family, (host, int(match.group(2)))
+
+
+def bind(family, address, reuseport=False, backlog=128):
+    """Creates a listening socket.
+
+    Stale UNIX domain sockets (e.g. left behind by a supervisor that was
+    killed) are removed.
+
+    :param family: Address family, see :py:func:`parse_address`.
+    :param address: Address, see :py:func:`parse_address`.
+    :param reuseport: When ``True``, set ``SO_REUSEPORT`` so that several
+       sockets can be bound to the same address.
+    :param backlog: Maximum number of pending connections.
+    :return: A ``socket.socket`` object.
+    :raise OSError: The socket can't be bound.
+    """
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if family == socket.AF_UNIX:
+            try:
+                if stat.S_ISSOCK(os.stat(address).st_mode):
+                    os.unlink(address)
+            except FileNotFoundError:
+                pass
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuseport:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+        sock.listen(backlog)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def inherit_fds(fds, preexec_fn=None):
+    """Moves file descriptors to 3, 4, etc.
+
+    This is meant to be called in the child process, as ``preexec_fn``.  The
+    new file descriptors are inherited by the command, which requires the
+    process to be started without ``close_fds`` (it takes effect after
+    ``preexec_fn`` and would close them).
+
+    The supervisor runs threads (e.g. for output), so only plain system calls
+    (``fcntl()``, ``dup2()`` and ``close()``) are made here, which don't take
+    locks that another thread could hold when the child was forked.
+
+    :param fds: Sequence of file descriptors, in order.
+    :param preexec_fn: Function to call afterwards, if any.
+    """
+    # NOTE: copy everything out of the way first so that moving one file
+    #       descriptor never overwrites one that still has to be moved.
+    start = LISTEN_FDS_START + len(fds)
+    copies = [fcntl.fcntl(fd, fcntl.F_DUPFD, start) for fd in fds]
+    for index, fd in enumerate(copies):
+        os.dup2(fd, LISTEN_FDS_START + index)
+        os.close(fd)
+    if preexec_fn is not None:
+        preexec_fn()
+
+
+def listen_env(env, fds):
+    """Returns the environment for a child that receives sockets.
+
+    :param env: Environment variables of the child, or ``None`` to use the
+       supervisor's environment.  When ``env`` is an
+       :py:class:`~strawboss.environment.Environment`, the result is one of its
+       (cached) layers.
+    :param fds: File descriptors passed to the child.
+    """
+    if isinstance(env, Environment):
+        return env.layer(
+            {'LISTEN_FDS': str(len(fds))}, ('LISTEN_FDNAMES', 'LISTEN_PID'),
+        )
+    env = dict(os.environ if env is None else env)
+    env['LISTEN_FDS'] = str(len(fds))
+    # Don't leak settings meant for the supervisor itself.
+    env.pop('LISTEN_FDNAMES', None)
+    env.pop('LISTEN_PID', None)
+    return env
+
+
+class Listeners(object):
+    """Listening sockets for all instances of a process type.
+
+    :param addresses: Sequence of ``(family, address)`` pairs, see
+       :py:func:`parse_address`.
+    :param reuseport: When ``True``, each instance gets its own TCP sockets,
+       bound with ``SO_REUSEPORT``.  Otherwise, the sockets are shared by all
+       instances.  UNIX domain sockets are always shared.
+    :param backlog: Maximum number of pending connections on each socket.
+    :raise OSError: A socket can't be bound.
+    """
+
+    def __init__(self, addresses, reuseport=False, backlog=128):
+        self._addresses = list(addresses)
+        self._reuseport = reuseport
+        self._backlog = backlog
+        self._shared = {}
+        self._sockets = {}
+        # Bind shared sockets right away to report errors early.
+        try:
+            for position, (family, address) in enumerate(self._addresses):
+                if not self._per_instance(family):
+                    self._shared[position] = bind(family, address,
+                                                  backlog=backlog)
+        except Exception:
+            self.close()
+            raise
+
+    def fds(self, index):
+        """Returns the file descriptors passed to an instance.
+
+        :param index: Index of the instance.
+        :raise OSError: A socket can't be bound.
+        """
+        if index not in self._sockets:
+            sockets = self._sockets[index] = {}
+            try:
+                for position, (family, address) in enumerate(
+                        self._addresses):
+                    if self._per_instance(family):
+                        sockets[position] = bind(
+                            family, address, True, self._backlog,
+                        )
+            except Exception:
+                self.release(index)
+                raise
+        sockets = dict(self._shared)
+        sockets.update(self._sockets[index])
+        return [sockets[i].fileno() for i in range(len(self._addresses))]
+
+    def release(self, index):
+        """Close the sockets of an instance that was scaled down.
+
+        Shared sockets stay open.
+        """
+        for sock in self._sockets.pop(index, {}).values():
+            sock.close()
+
+    def close(self):
+        """Close all sockets and remove UNIX domain sockets."""
+        for index in list(self._sockets):
+            self.release(index)
+        for position, sock in self._shared.items():
+            sock.close()
+            family, address = self._addresses[position]
+            if family == socket.AF_UNIX:
+                try:
+                    os.unlink(address)
+                except FileNotFoundError:
+                    pass
+        self._shared.clear()
+
+    def _per_instance(self, family):
+        return self._reuseport and family != socket.AF_UNIX
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""Watchdog that acts on children that use too much memory or CPU.
+
+The resident memory and CPU time of children are sampled from ``/proc`` by a
+background task at a fixed interval (``/proc`` is read in the event loop's
+default executor, so sampling never blocks the event loop).  When an instance
+goes over one of the thresholds of its process type, the watchdog logs it and
+then either leaves it alone, runs an alert command or restarts the instance
+through the same path as a shutdown (stop signal, then grace period).
+
+Restarts of instances of the same process type are staggered: an instance is
+only restarted once the previously restarted instance of the same type is
+running again and has had some time to warm up, so a leak that affects all
+instances at once never takes them all down together.
+
+Resource usage is read from ``/proc`` and is only available on Linux.
+"""
+
+import asyncio
+import os
+import time
+
+
+ACTIONS = ('restart', 'log', 'alert')
+"""What the watchdog can do with an instance that goes over a threshold."""
+
+
+class WatchdogPolicy(object):
+    """Thresholds and action for all instances of a process type.
+
+    :param max_rss: Resident memory (in bytes) above which the action is
+       taken.  Use ``0`` for no limit.
+    :param max_cpu: CPU usage (in percent of one CPU, averaged between two
+       samples) above which the action is taken.  Use ``0`` for no limit.
+    :param action: One of :py:data:`ACTIONS`.
+    :raise ValueError: ``action`` is not supported.
+    """
+
+    def __init__(self, max_rss=0, max_cpu=0.0, action='restart'):
+        if action not in ACTIONS:
+            raise ValueError('Invalid watchdog action "%s".' % action)
+        self.max_rss = max_rss
+        self.max_cpu = max_cpu
+        self.action = action
+
+    def check(self, rss, cpu):
+        """Checks a sample against the thresholds.
+
+        :param rss: Resident memory, in bytes.
+        :param cpu: CPU usage, in percent, or ``None`` if it is not known yet.
+        :return: A description of the first threshold that is exceeded, or
+           ``None`` if the sample is within all thresholds.
+        """
+        if self.max_rss and rss > self.max_rss:
+            return 'resident memory %.1f MiB > %.1f MiB' % (
+                rss / 1024 ** 2, self.max_rss / 1024 ** 2,
+            )
+        if self.max_cpu and cpu is not None and cpu > self.max_cpu:
+            return 'CPU usage %.1f%% > %.1f%%' % (cpu, self.max_cpu)
+        return None
+
+
+class Watchdog(object):
+    """Samples the resource usage of children and acts on runaway ones.
+
+    Only instances of process types that have a policy (see
+    :py:meth:`add_process_type`) are sampled.
+
+    :param restart: Function called with the name of an instance to restart
+       it (e.g. :py:meth:`~strawboss.Supervisor.restart`), which returns
+       ``True`` if the instance is being restarted.
+    :param write: Coroutine function used to write status messages.
+    :param formatter: Formatter for status messages.
+    :param interval: Time (in seconds) between samples.
+    :param stagger: Time (in seconds) to wait after an instance is re-spawned
+       before restarting another instance of the same process type.
+    :param timeout: Time (in seconds) after which a restart that did not
+       re-spawn the instance (e.g. because the process type is crash-looping)
+       no longer holds back restarts of other instances.
+    :param alert: Shell command run by the ``alert`` action.  The instance's
+       name, process ID and the exceeded threshold are passed in the
+       ``STRAWBOSS_INSTANCE``, ``STRAWBOSS_PID`` and ``STRAWBOSS_REASON``
+       environment variables.
+    :param loop: Event loop to use.  When ``None``, the default event loop is
+       used.
+    :param proc: Mount point of the ``proc`` file system.
+    :param clock: Function that returns the current time, in seconds.
+    """
+
+    def __init__(self, restart, write, formatter, interval=10.0,
+                 stagger=30.0, timeout=60.0, alert=None, loop=None,
+                 proc='/proc', clock=time.monotonic):
+        self._restart = restart
+        self._write = write
+        self._formatter = formatter
+        self._interval = interval
+        self._stagger = stagger
+        self._timeout = timeout
+        self._alert = alert
+        self._loop = loop or asyncio.get_event_loop()
+        self._proc = proc
+        self._clock = clock
+        self._task = None
+        self._alerts = set()
+        self._policies = {}
+        self._children = {}
+        self._previous = {}
+        self._breaches = {}
+        self._restarted = set()
+        self._restarting = {}
+        self._cooldown = {}
+
+    def add_process_type(self, label, policy):
+        """Watch instances of a process type.
+
+        :param label: Name of the process type.
+        :param policy: :py:class:`WatchdogPolicy` for its instances.
+        """
+        self._policies[label] = policy
+
+    def spawned(self, name, pid):
+        """Start watching a process."""
+        label = name.rsplit('.', 1)[0]
+        if label not in self._policies:
+            return
+        self._children[pid] = name
+        # Let the next instance be restarted once this one had time to warm
+        # up.
+        if self._restarting.get(label, (None,))[0] == name:
+            del self._restarting[label]
+            self._cooldown[label] = self._clock() + self._stagger
+
+    def exited(self, name, pid, status):
+        """Stop watching a process."""
+        self._children.pop(pid, None)
+        self._previous.pop(pid, None)
+        self._breaches.pop(pid, None)
+        self._restarted.discard(pid)
+
+    def start(self):
+        """Start sampling in a background task."""
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    @asyncio.coroutine
+    def close(self):
+        """Stop sampling and wait for pending alert commands.
+
+        .. note:: This function is a coroutine.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                yield from self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._alerts:
+            yield from asyncio.wait(self._alerts, loop=self._loop)
+
+    @asyncio.coroutine
+    def sample(self):
+        """Sample the resource usage of children and act on runaway ones.
+
+        .. note:: This function is a coroutine.
+        """
+        children = dict(self._children)
+        usage = yield from self._loop.run_in_executor(
+            None, self._read_usage, children,
+        )
+        now = self._clock()
+        for pid, name in children.items():
+            # Skip processes that exited while we were sampling.
+            if pid not in self._children or not usage.get(pid):
+                continue
+            cpu_time, rss = usage[pid]
+            cpu = None
+            if pid in self._previous:
+                then, previous = self._previous[pid]
+                if now > then:
+                    cpu = (cpu_time - previous) / (now - then) * 100.0
+            self._previous[pid] = now, cpu_time
+            policy = self._policies[name.rsplit('.', 1)[0]]
+            reason = policy.check(rss, cpu)
+            if reason is None:
+                self._breaches.pop(pid, None)
+                continue
+            yield from self._breach(name, pid, policy, reason)
+
+    def _read_usage(self, children):
+        # NOTE: only import this when needed to keep startup fast.
+        from strawboss.metrics import read_usage
+        return {pid: read_usage(pid, self._proc) for pid in children}
+
+    @asyncio.coroutine
+    def _breach(self, name, pid, policy, reason):
+        # Report each breach once, but keep trying to restart the instance
+        # until it's its turn.
+        if pid not in self._breaches:
+            self._breaches[pid] = reason
+            yield from self._status(
+                '%s(%d) exceeds watchdog limit: %s.' % (name, pid, reason),
+                name, pid,
+            )
+            if policy.action == 'alert':
+                self._run_alert(name, pid, reason)
+        if policy.action == 'restart' and pid not in self._restarted:
+            if self._may_restart(name.rsplit('.', 1)[0]):
+                yield from self._restart_instance(name, pid)
+
+    def _may_restart(self, label):
+        now = self._clock()
+        restarting = self._restarting.get(label)
+        if restarting is not None and now < restarting[1]:
+            return False
+        return now >= self._cooldown.get(label, now)
+
+    @asyncio.coroutine
+    def _restart_instance(self, name, pid):
+        if not self._restart(name):
+            return
+        self._restarted.add(pid)
+        self._restarting[name.rsplit('.', 1)[0]] = (
+            name, self._clock() + self._timeout,
+        )
+        yield from self._status(
+            '%s(%d) restarted by watchdog.' % (name, pid), name, pid,
+        )
+
+    def _run_alert(self, name, pid, reason):
+        if not self._alert:
+            return
+        task = self._loop.create_task(self._alert_command(name, pid, reason))
+        self._alerts.add(task)
+        task.add_done_callback(self._alerts.discard)
+
+    @asyncio.coroutine
+    def _alert_command(self, name, pid, reason):
+        env = dict(
+            os.environ,
+            STRAWBOSS_INSTANCE=name,
+            STRAWBOSS_PID=str(pid),
+            STRAWBOSS_REASON=reason,
+        )
+        try:
+            process = yield from asyncio.create_subprocess_shell(
+                self._alert, env=env, loop=self._loop,
+                stdin=asyncio.subprocess.DEVNULL,
+            )
+            status = yield from process.wait()
+        except OSError as error:
+            yield from self._status(
+                'Watchdog alert for %s failed: %s.' % (name, error.strerror),
+                name, pid,
+            )
+            return
+        if status != 0:
+            yield from self._status(
+                'Watchdog alert for %s failed with exit status %d.' % (
+                    name, status,
+                ),
+                name, pid,
+            )
+
+    @asyncio.coroutine
+    def _status(self, text, name, pid):
+        yield from self._write(self._formatter.status(text, name, pid))
+
+    @asyncio.coroutine
+    def _run(self):
+        while True:
+            yield from asyncio.sleep(self._interval, loop=self._loop)
+            yield from self.sample()
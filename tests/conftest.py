@@ -70,8 +70,11 @@ def clock():
     """Fixture for freezing time during a test."""
     from datetime import datetime
     from freezegun import freeze_time
+    # NOTE: freezegun doesn't know about the monotonic clock used by the
+    #       timestamp cache, so we freeze it ourselves.
     with freeze_time(datetime.now()):
-        yield
+        with patch('strawboss.output.monotonic', return_value=0.0):
+            yield
 
 class MockSubprocess(object):
     """Mock implementation of asyncio ``Popen`` object."""
@@ -81,14 +84,21 @@ class MockSubprocess(object):
         #
         self.pid = randint(1, 9999)
         self.stdout = asyncio.StreamReader()
+        self.stderr = asyncio.StreamReader()
         #
         self._future = asyncio.Future()
         self._killed = False
+        #
+        self.signals = []
+        self.ignore_signals = False
 
     @property
     def env(self):
         """Retrieve the environment variables passed to the process."""
-        return {k: v for k, v in self._kwds['env'].items()}
+        return {
+            os.fsdecode(k): os.fsdecode(v)
+            for k, v in self._kwds['env'].items()
+        }
 
     def wait(self):
         """Wait until the process completes."""
@@ -105,6 +115,16 @@ class MockSubprocess(object):
         loop = asyncio.get_event_loop()
         loop.call_soon(self._future.set_result, -9)
 
+    def send_signal(self, signum):
+        if self._future.done():
+            raise ProcessLookupError
+        self.signals.append(signum)
+        # Defer completion (as IRL), unless the process ignores the signal.
+        if self.ignore_signals:
+            return
+        loop = asyncio.get_event_loop()
+        loop.call_soon(self.mock_complete, -signum)
+
 class MockSubprocessFactory(object):
     def __init__(self):
         self._instances = []
@@ -136,6 +156,9 @@ def subprocess_factory():
         factory._instances.append(p)
         return f
 
-    with patch('asyncio.create_subprocess_exec') as spawn:
+    # NOTE: mock processes don't close their output streams when they complete
+    #       unless the test does it explicitly, don't wait for it.
+    with patch('asyncio.create_subprocess_exec') as spawn, \
+            patch('strawboss.EOF_TIMEOUT', 0.0):
         spawn.side_effect = create_subprocess_exec
         yield factory
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import pytest
+import resource
+import signal
+import socket
 
 from strawboss import cli, version
 
@@ -47,3 +50,304 @@ def test_scale():
 
     arguments = cli.parse_args(['--scale', 'web:2', '--scale', 'worker:3'])
     assert arguments.scale == [('*', 1), ('web', 2), ('worker', 3)]
+
+def test_output_queue():
+    arguments = cli.parse_args([])
+    assert arguments.output_queue == 1024
+    assert arguments.output_policy == 'block'
+
+    arguments = cli.parse_args([
+        '--output-queue', '16',
+        '--output-policy', 'spill',
+    ])
+    assert arguments.output_queue == 16
+    assert arguments.output_policy == 'spill'
+
+def test_output_format():
+    arguments = cli.parse_args([])
+    assert arguments.output_format == 'text'
+
+    arguments = cli.parse_args(['--format', 'json'])
+    assert arguments.output_format == 'json'
+
+def test_loop():
+    arguments = cli.parse_args([])
+    assert arguments.loop == 'auto'
+
+    arguments = cli.parse_args(['--loop', 'uvloop'])
+    assert arguments.loop == 'uvloop'
+
+def test_transport():
+    arguments = cli.parse_args([])
+    assert arguments.transport == 'stream'
+
+    arguments = cli.parse_args(['--transport', 'protocol'])
+    assert arguments.transport == 'protocol'
+
+def test_timestamps():
+    arguments = cli.parse_args([])
+    assert arguments.timestamp_format == 'iso'
+    assert arguments.timestamp_precision == 'us'
+
+    arguments = cli.parse_args(['--timestamps', 'epoch-ms'])
+    assert arguments.timestamp_format == 'epoch-ms'
+
+    arguments = cli.parse_args(['--timestamp-precision', 'ms'])
+    assert arguments.timestamp_precision == 'ms'
+
+def test_respawn():
+    arguments = cli.parse_args([])
+    assert arguments.respawn_delay == 0.1
+    assert arguments.respawn_delay_max == 30.0
+    assert arguments.respawn_backoff == 2.0
+    assert arguments.respawn_jitter == 0.1
+    assert arguments.min_uptime == 1.0
+    assert arguments.crash_loop == (10, 60.0)
+
+    arguments = cli.parse_args([
+        '--respawn-delay', '1',
+        '--respawn-delay-max', '60',
+        '--respawn-backoff', '1.5',
+        '--respawn-jitter', '0',
+        '--min-uptime', '5',
+        '--crash-loop', '3:30',
+    ])
+    assert arguments.respawn_delay == 1.0
+    assert arguments.respawn_delay_max == 60.0
+    assert arguments.respawn_backoff == 1.5
+    assert arguments.respawn_jitter == 0.0
+    assert arguments.min_uptime == 5.0
+    assert arguments.crash_loop == (3, 30.0)
+
+def test_control_socket():
+    arguments = cli.parse_args([])
+    assert arguments.control_socket is None
+    assert arguments.command is None
+
+    arguments = cli.parse_args([
+        '--control-socket', 'strawboss.sock', 'scale', 'web=2', 'worker=0',
+    ])
+    assert arguments.control_socket == 'strawboss.sock'
+    assert arguments.command == 'scale'
+    assert arguments.requested_scale == ['web=2', 'worker=0']
+
+    arguments = cli.parse_args([
+        '--control-socket', 'strawboss.sock', 'restart', 'web',
+    ])
+    assert arguments.command == 'restart'
+    assert arguments.restart_types == ['web']
+
+def test_stop_signal():
+    arguments = cli.parse_args([])
+    assert arguments.stop_signal == [('*', signal.SIGTERM)]
+    assert arguments.grace_period == [('*', 10.0)]
+
+    arguments = cli.parse_args([
+        '--stop-signal', 'web:SIGINT',
+        '--grace-period', '*:30',
+        '--grace-period', 'web:0',
+    ])
+    assert arguments.stop_signal == [
+        ('*', signal.SIGTERM), ('web', signal.SIGINT),
+    ]
+    assert arguments.grace_period == [('*', 10.0), ('*', 30.0), ('web', 0.0)]
+
+def test_output_streams():
+    arguments = cli.parse_args([])
+    assert arguments.stdout == [('*', 'terminal')]
+    assert arguments.stderr == [('*', 'terminal')]
+
+    arguments = cli.parse_args([
+        '--stdout', 'web:discard',
+        '--stdout', 'worker:logs/worker.log',
+        '--stderr', '*:errors.log',
+    ])
+    assert arguments.stdout == [
+        ('*', 'terminal'), ('web', 'discard'), ('worker', 'logs/worker.log'),
+    ]
+    assert arguments.stderr == [('*', 'terminal'), ('*', 'errors.log')]
+
+def test_log_dir():
+    arguments = cli.parse_args([])
+    assert arguments.log_dir is None
+    assert arguments.log_max_size == 0
+    assert arguments.log_rotate_interval == 0.0
+    assert arguments.log_keep == 10
+    assert arguments.log_compress is False
+
+    arguments = cli.parse_args([
+        '--log-dir', 'logs',
+        '--log-max-size', '10M',
+        '--log-rotate-interval', '3600',
+        '--log-keep', '3',
+        '--log-compress',
+    ])
+    assert arguments.log_dir == 'logs'
+    assert arguments.log_max_size == 10 * 1024 ** 2
+    assert arguments.log_rotate_interval == 3600.0
+    assert arguments.log_keep == 3
+    assert arguments.log_compress is True
+
+def test_rate_limit():
+    arguments = cli.parse_args([])
+    assert arguments.rate_limit == []
+    assert arguments.type_rate_limit == []
+    assert arguments.sample == []
+    assert arguments.rate_limit_report == 10.0
+
+    arguments = cli.parse_args([
+        '--rate-limit', '*:100',
+        '--rate-limit', 'web:10:50',
+        '--type-rate-limit', 'web:1000',
+        '--sample', 'worker:10',
+        '--rate-limit-report', '60',
+    ])
+    assert arguments.rate_limit == [('*', (100.0, None)), ('web', (10.0, 50))]
+    assert arguments.type_rate_limit == [('web', (1000.0, None))]
+    assert arguments.sample == [('worker', 10)]
+    assert arguments.rate_limit_report == 60.0
+
+def test_long_lines():
+    arguments = cli.parse_args([])
+    assert arguments.max_line_length == 64 * 1024
+    assert arguments.decode_errors == 'replace'
+
+    arguments = cli.parse_args([
+        '--max-line-length', '1M',
+        '--decode-errors', 'backslashreplace',
+    ])
+    assert arguments.max_line_length == 1024 * 1024
+    assert arguments.decode_errors == 'backslashreplace'
+
+def test_metrics():
+    arguments = cli.parse_args([])
+    assert arguments.metrics_address is None
+    assert arguments.metrics_interval == 5.0
+
+    arguments = cli.parse_args([
+        '--metrics', '127.0.0.1:9100',
+        '--metrics-interval', '1.5',
+    ])
+    assert arguments.metrics_address == '127.0.0.1:9100'
+    assert arguments.metrics_interval == 1.5
+
+def test_profiling():
+    arguments = cli.parse_args([])
+    assert arguments.lag_warning == 0.0
+    assert arguments.stage_timers is False
+    assert arguments.profile is None
+
+    arguments = cli.parse_args([
+        '--lag-warning', '0.25',
+        '--stage-timers',
+        '--profile', 'strawboss.prof',
+    ])
+    assert arguments.lag_warning == 0.25
+    assert arguments.stage_timers is True
+    assert arguments.profile == 'strawboss.prof'
+
+def test_resources():
+    arguments = cli.parse_args([])
+    assert arguments.rlimit == []
+    assert arguments.nice == []
+    assert arguments.ionice == []
+    assert arguments.cpu_affinity == []
+
+    arguments = cli.parse_args([
+        '--rlimit', 'web:nofile=4096',
+        '--nice', 'worker:10',
+        '--ionice', 'worker:idle',
+        '--cpu-affinity', 'web:auto',
+        '--cpu-affinity', 'web.1:0-1',
+    ])
+    assert arguments.rlimit == [('web', (resource.RLIMIT_NOFILE, 4096))]
+    assert arguments.nice == [('worker', 10)]
+    assert arguments.ionice == [('worker', (3, 4))]
+    assert arguments.cpu_affinity == [('web', 'auto'), ('web.1', [0, 1])]
+
+def test_watchdog():
+    arguments = cli.parse_args([])
+    assert arguments.max_rss == []
+    assert arguments.max_cpu == []
+    assert arguments.watchdog_action == [('*', 'restart')]
+    assert arguments.watchdog_interval == 10.0
+    assert arguments.watchdog_stagger == 30.0
+    assert arguments.watchdog_alert is None
+
+    arguments = cli.parse_args([
+        '--max-rss', 'web:512M',
+        '--max-cpu', 'worker:90',
+        '--watchdog-action', 'worker:alert',
+        '--watchdog-interval', '2.5',
+        '--watchdog-stagger', '60',
+        '--watchdog-alert', 'notify-ops',
+    ])
+    assert arguments.max_rss == [('web', 512 * 1024 ** 2)]
+    assert arguments.max_cpu == [('worker', 90.0)]
+    assert arguments.watchdog_action == [
+        ('*', 'restart'), ('worker', 'alert'),
+    ]
+    assert arguments.watchdog_interval == 2.5
+    assert arguments.watchdog_stagger == 60.0
+    assert arguments.watchdog_alert == 'notify-ops'
+
+def test_readiness():
+    arguments = cli.parse_args([])
+    assert arguments.ready == []
+    assert arguments.depends_on == []
+    assert arguments.ready_timeout == 60.0
+
+    arguments = cli.parse_args([
+        '--ready', 'db:tcp:5432',
+        '--depends-on', 'web:db,cache',
+        '--ready-timeout', '0',
+    ])
+    [(label, probe)] = arguments.ready
+    assert label == 'db'
+    assert probe.port == 5432
+    assert arguments.depends_on == [('web', ['db', 'cache'])]
+    assert arguments.ready_timeout == 0.0
+
+def test_listen():
+    arguments = cli.parse_args([])
+    assert arguments.listen == []
+    assert arguments.reuseport is False
+
+    arguments = cli.parse_args([
+        '--listen', 'web:8000',
+        '--listen', 'web:/run/web.sock',
+        '--reuseport',
+    ])
+    assert arguments.listen == [
+        ('web', (socket.AF_INET, ('0.0.0.0', 8000))),
+        ('web', (socket.AF_UNIX, '/run/web.sock')),
+    ]
+    assert arguments.reuseport is True
+
+def test_rolling_restart():
+    arguments = cli.parse_args([])
+    assert arguments.rolling_surge == 1
+    assert arguments.rolling_max_unavailable == 0
+    assert arguments.rolling_delay == 1.0
+
+    arguments = cli.parse_args([
+        '--rolling-surge', '0',
+        '--rolling-max-unavailable', '2',
+        '--rolling-delay', '5',
+    ])
+    assert arguments.rolling_surge == 0
+    assert arguments.rolling_max_unavailable == 2
+    assert arguments.rolling_delay == 5.0
+
+def test_reload():
+    arguments = cli.parse_args([])
+    assert arguments.reload is False
+    assert arguments.reload_delay == 1.0
+    assert arguments.reload_poll is False
+
+    arguments = cli.parse_args([
+        '--reload', '--reload-delay', '0.5', '--reload-poll',
+    ])
+    assert arguments.reload is True
+    assert arguments.reload_delay == 0.5
+    assert arguments.reload_poll is True
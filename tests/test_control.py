@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import pytest
+import socket
+
+from strawboss.control import ControlError, ControlServer, send_command
+
+
+@asyncio.coroutine
+def echo_coroutine(*args):
+    return ' '.join(args)
+
+
+def fail(*args):
+    raise ControlError('Failed: %s.' % ' '.join(args))
+
+
+def number(x):
+    return str(int(x))
+
+
+COMMANDS = {
+    'echo': lambda *args: ' '.join(args),
+    'echo-coroutine': echo_coroutine,
+    'fail': fail,
+    'nop': lambda *args: None,
+    'number': number,
+}
+
+
+@pytest.mark.asyncio
+def test_control_dispatch(event_loop):
+    server = ControlServer('unused.sock', COMMANDS, loop=event_loop)
+    response = yield from server.dispatch('echo foo bar\n')
+    assert response == 'OK foo bar'
+    response = yield from server.dispatch('echo-coroutine "foo bar"\n')
+    assert response == 'OK foo bar'
+    response = yield from server.dispatch('nop\n')
+    assert response == 'OK'
+    response = yield from server.dispatch('fail foo\n')
+    assert response == 'ERROR Failed: foo.'
+    response = yield from server.dispatch('meh\n')
+    assert response == 'ERROR Unknown command "meh".'
+    response = yield from server.dispatch('\n')
+    assert response == 'ERROR Empty command.'
+    response = yield from server.dispatch('echo "foo\n')
+    assert response.startswith('ERROR ')
+    response = yield from server.dispatch('number meh\n')
+    assert response == (
+        "ERROR invalid literal for int() with base 10: 'meh'"
+    )
+
+
+@pytest.mark.asyncio
+def test_control_socket(event_loop, tmpdir):
+    path = str(tmpdir.join('strawboss.sock'))
+    server = ControlServer(path, COMMANDS, loop=event_loop)
+    yield from server.start()
+    assert os.path.exists(path)
+    try:
+        response = yield from event_loop.run_in_executor(
+            None, send_command, path, 'echo', 'foo bar', 'qux',
+        )
+        assert response == 'foo bar qux'
+        with pytest.raises(ControlError) as exc:
+            yield from event_loop.run_in_executor(
+                None, send_command, path, 'fail', 'foo',
+            )
+        assert str(exc.value) == 'Failed: foo.'
+    finally:
+        yield from server.close()
+    assert not os.path.exists(path)
+
+
+@pytest.mark.asyncio
+def test_control_socket_garbage(event_loop, tmpdir):
+    path = str(tmpdir.join('strawboss.sock'))
+    server = ControlServer(path, COMMANDS, loop=event_loop)
+    yield from server.start()
+    try:
+        reader, writer = yield from asyncio.open_unix_connection(
+            path, loop=event_loop,
+        )
+        writer.write(b'\xff\xfe garbage\n')
+        response = yield from reader.readline()
+        assert response == b'ERROR Request is not valid UTF-8.\n'
+        # The connection still works.
+        writer.write(b'echo foo\n')
+        response = yield from reader.readline()
+        assert response == b'OK foo\n'
+        writer.write(b'x' * 100000 + b'\n')
+        response = yield from reader.readline()
+        assert response == b'ERROR Request is too long.\n'
+        writer.close()
+    finally:
+        yield from server.close()
+
+
+def test_control_socket_not_listening(tmpdir):
+    path = str(tmpdir.join('strawboss.sock'))
+    with pytest.raises(OSError):
+        send_command(path, 'echo', 'foo')
+
+
+@pytest.mark.asyncio
+def test_control_socket_stale(event_loop, tmpdir):
+    path = str(tmpdir.join('strawboss.sock'))
+    # Left behind by a supervisor that was killed.
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+    server = ControlServer(path, COMMANDS, loop=event_loop)
+    yield from server.start()
+    yield from server.close()
+    assert not os.path.exists(path)
+
+
+@pytest.mark.asyncio
+def test_control_socket_not_a_socket(event_loop, tmpdir):
+    path = tmpdir.join('Procfile')
+    path.write('web: gunicorn app\n')
+    server = ControlServer(str(path), COMMANDS, loop=event_loop)
+    with pytest.raises(FileExistsError):
+        yield from server.start()
+    # Other files are never removed.
+    assert path.read() == 'web: gunicorn app\n'
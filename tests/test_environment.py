@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import subprocess
+import sys
+
+from strawboss.environment import Environment
+from strawboss.sockets import listen_env
+
+
+def test_environment():
+    env = Environment({'A': '1', 'B': '2'}, None, {'B': '3', 'C': '4'})
+    assert dict(env) == {'A': '1', 'B': '3', 'C': '4'}
+    assert env['B'] == '3'
+    assert len(env) == 3
+    assert env.envp == {b'A': b'1', b'B': b'3', b'C': b'4'}
+    with pytest.raises(TypeError):
+        env['D'] = '4'
+
+
+def test_environment_invalid():
+    for name in ('', 'A=B'):
+        with pytest.raises(ValueError) as exc:
+            print(Environment({name: '1'}))
+        assert str(exc.value) == (
+            'Invalid environment variable name "%s".' % name
+        )
+
+
+def test_environment_layer():
+    env = Environment({'A': '1', 'B': '2'})
+    layer = env.layer({'B': '3', 'C': '4'}, ['A'])
+    assert dict(layer) == {'B': '3', 'C': '4'}
+    assert layer.envp == {b'B': b'3', b'C': b'4'}
+    # The shared environment is left alone.
+    assert dict(env) == {'A': '1', 'B': '2'}
+    # Layers are computed once.
+    assert env.layer({'C': '4', 'B': '3'}, ['A']) is layer
+    assert env.layer({'C': '5'}) is not layer
+
+
+def test_environment_listen():
+    env = Environment({'PATH': '/bin', 'LISTEN_PID': '1'})
+    layer = listen_env(env, [7, 8])
+    assert dict(layer) == {'PATH': '/bin', 'LISTEN_FDS': '2'}
+    assert listen_env(env, [9, 10]) is layer
+
+
+def test_environment_spawn():
+    env = Environment({'STRAWBOSS_TEST': 'hello'})
+    output = subprocess.check_output([
+        sys.executable, '-c', 'import os; print(os.environ["STRAWBOSS_TEST"])',
+    ], env=env.envp)
+    assert output.decode('utf-8').strip() == 'hello'
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from strawboss.limits import LineLimiter, OutputLimits, TokenBucket
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(10, 5, clock=clock)
+    assert bucket.take(3) == 3
+    assert bucket.take(3) == 2
+    assert bucket.take(1) == 0
+    # The bucket is refilled over time, up to its capacity.
+    clock.now += 0.25
+    assert bucket.take(10) == 2
+    clock.now += 60.0
+    assert bucket.take(10) == 5
+
+
+def test_token_bucket_default_burst():
+    clock = Clock()
+    assert TokenBucket(100, clock=clock).take(1000) == 100
+    assert TokenBucket(0.5, clock=clock).take(1000) == 1
+
+
+def test_line_limiter():
+    clock = Clock()
+    limiter = LineLimiter([TokenBucket(2, 2, clock=clock)])
+    assert limiter.filter(['a', 'b', 'c']) == ['a', 'b']
+    assert limiter.filter(['d']) == []
+    assert limiter.report() == 2
+    assert limiter.report() == 0
+    clock.now += 1.0
+    assert limiter.filter(['e']) == ['e']
+
+
+def test_line_limiter_shared_bucket():
+    clock = Clock()
+    instance = TokenBucket(100, 100, clock=clock)
+    shared = TokenBucket(25, 25, clock=clock)
+    limiter = LineLimiter([instance, shared])
+    lines = [str(i) for i in range(50)]
+    assert len(limiter.filter(lines)) == 25
+    # Lines suppressed by the shared bucket don't count against the instance.
+    assert instance.take(1000) == 75
+
+
+def test_line_limiter_sample():
+    limiter = LineLimiter(sample=3)
+    lines = [str(i) for i in range(10)]
+    # Sampling carries over from one batch to the next.
+    assert limiter.filter(lines[:4]) + limiter.filter(lines[4:]) == [
+        '0', '3', '6', '9',
+    ]
+    # Lines that are sampled out are not reported as suppressed.
+    assert limiter.report() == 0
+
+
+def test_output_limits():
+    clock = Clock()
+    limits = OutputLimits(rate=3, type_rate=4, clock=clock)
+    a = limits.limiter()
+    b = limits.limiter()
+    # Each instance has its own bucket, but they share the process type's.
+    assert a.filter(['x'] * 5) == ['x'] * 3
+    assert b.filter(['x'] * 5) == ['x']
+    assert (a.report(), b.report()) == (2, 4)
+
+
+def test_output_limits_sample_only():
+    limiter = OutputLimits(sample=2).limiter()
+    assert limiter.filter(['a', 'b', 'c', 'd']) == ['a', 'c']
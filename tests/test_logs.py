@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import gzip
+import os
+import pytest
+import time
+
+from strawboss.logs import LogDirectory, RotatingFile, compress_segment
+from unittest import mock
+
+
+def read(path):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as stream:
+            return stream.read().decode('utf-8')
+    with open(path, 'r') as stream:
+        return stream.read()
+
+
+def test_rotating_file_append(tmpdir):
+    path = str(tmpdir.join('web.0.log'))
+    with open(path, 'w') as stream:
+        stream.write('old\n')
+    f = RotatingFile(path)
+    f.write('foo\n')
+    f.write('bar\n')
+    f.flush()
+    assert read(path) == 'old\nfoo\nbar\n'
+    f.close()
+    assert f.segments() == []
+
+def test_rotating_file_max_size(tmpdir):
+    path = str(tmpdir.join('web.0.log'))
+    f = RotatingFile(path, max_size=8)
+    for i in range(5):
+        f.write('line %d\n' % i)
+    f.close()
+    segments = f.segments()
+    assert [read(segment) for segment in segments] == [
+        'line 0\n', 'line 1\n', 'line 2\n', 'line 3\n',
+    ]
+    assert read(path) == 'line 4\n'
+
+def test_rotating_file_interval(tmpdir):
+    path = str(tmpdir.join('web.0.log'))
+    f = RotatingFile(path, interval=60.0)
+    with mock.patch('time.time', return_value=1000.0):
+        f.write('foo\n')
+    with mock.patch('time.time', return_value=1059.0):
+        f.write('bar\n')
+    assert f.segments() == []
+    with mock.patch('time.time', return_value=1060.0):
+        f.write('qux\n')
+    f.close()
+    assert [read(segment) for segment in f.segments()] == ['foo\nbar\n']
+    assert read(path) == 'qux\n'
+
+def test_rotating_file_keep(tmpdir):
+    path = str(tmpdir.join('web.0.log'))
+    f = RotatingFile(path, max_size=1, keep=2)
+    for i in range(5):
+        f.write('line %d\n' % i)
+    f.close()
+    assert [read(segment) for segment in f.segments()] == [
+        'line 2\n', 'line 3\n',
+    ]
+
+def test_rotating_file_compress(tmpdir):
+    path = str(tmpdir.join('web.0.log'))
+    f = RotatingFile(path, max_size=1, compress=True)
+    f.write('foo\n')
+    f.write('bar\n')
+    f.close()
+    segments = f.segments()
+    assert len(segments) == 1
+    assert segments[0].endswith('.gz')
+    assert read(segments[0]) == 'foo\n'
+
+def test_rotating_file_compress_executor(tmpdir):
+    path = str(tmpdir.join('web.0.log'))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    f = RotatingFile(path, max_size=1, keep=2, compress=True,
+                     executor=executor)
+    for i in range(4):
+        f.write('line %d\n' % i)
+    f.close()
+    executor.shutdown()
+    segments = f.segments()
+    assert all(segment.endswith('.gz') for segment in segments)
+    assert [read(segment) for segment in segments] == [
+        'line 1\n', 'line 2\n',
+    ]
+
+def test_rotating_file_compress_keep_one(tmpdir):
+    path = str(tmpdir.join('web.0.log'))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    f = RotatingFile(path, max_size=1, keep=1, compress=True,
+                     executor=executor)
+    active = []
+    overlaps = []
+    def compress_slowly(path):
+        active.append(path)
+        overlaps.append(len(active) > 1)
+        time.sleep(0.01)
+        try:
+            return compress_segment(path)
+        finally:
+            active.remove(path)
+    with mock.patch('strawboss.logs.compress_segment', compress_slowly):
+        for i in range(20):
+            f.write('line %d\n' % i)
+        f.close()
+        executor.shutdown()
+    # Segments are compressed and pruned one at a time, so they're never
+    # pruned while they're being compressed.
+    assert not any(overlaps)
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'web.0.log', os.path.basename(f.segments()[0]),
+    ]
+    assert f.segments()[0].endswith('.gz')
+    assert read(f.segments()[0]) == 'line 18\n'
+
+def test_compress_segment(tmpdir):
+    path = str(tmpdir.join('web.0.log.20160229T235958-000'))
+    with open(path, 'w') as stream:
+        stream.write('foo\n')
+    assert compress_segment(path) == path + '.gz'
+    assert not os.path.exists(path)
+    assert read(path + '.gz') == 'foo\n'
+
+@pytest.mark.asyncio
+def test_log_directory(event_loop, tmpdir):
+    path = str(tmpdir.join('logs'))
+    logs = LogDirectory(path, loop=event_loop)
+    assert os.path.isdir(path)
+    writer = logs.writer('web.0')
+    assert logs.writer('web.0') is writer
+    assert logs.writer('web.1') is not writer
+    yield from writer.write('foo\n')
+    yield from logs.writer('web.1').write('bar\n')
+    yield from logs.close()
+    assert read(os.path.join(path, 'web.0.log')) == 'foo\n'
+    assert read(os.path.join(path, 'web.1.log')) == 'bar\n'
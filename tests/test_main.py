@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import json
 import os
+import pstats
 import re
 import signal
 import pytest
@@ -35,6 +37,24 @@ def test_main_procfile_empty(load_procfile, load_dotenvfile,
     _, stderr = capfd.readouterr()
     assert stderr.strip() == 'Nothing to run.'
 
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_uvloop_not_installed(load_procfile, load_dotenvfile,
+                                   subprocess_factory, capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    # Run the main function.
+    with mock.patch.dict('sys.modules', {'uvloop': None}):
+        with pytest.raises(SystemExit) as exc:
+            main(['--no-env', '--loop', 'uvloop'])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == 'uvloop is not installed.'
+
 @mock.patch('dotenvfile.loadfile')
 @mock.patch('procfile.loadfile')
 def test_main(load_procfile, load_dotenvfile, subprocess_factory, capfd, event_loop):
@@ -60,12 +80,44 @@ def test_main(load_procfile, load_dotenvfile, subprocess_factory, capfd, event_l
     for p in subprocess_factory.instances:
         expected_lines.extend([
             '[strawboss] foo.0(%d) spawned.' % p.pid,
-            '[strawboss] foo.0(%d) killed.' % p.pid,
-            '[strawboss] foo.0(%d) completed with exit status -9.' % p.pid,
+            '[strawboss] foo.0(%d) sent SIGTERM.' % p.pid,
+            '[strawboss] foo.0(%d) completed with exit status -15.' % p.pid,
         ])
     assert len(subprocess_factory.instances) > 0
     assert set(lines) == set(expected_lines)
 
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_json(load_procfile, load_dotenvfile,
+                   subprocess_factory, capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    # Automatically trigger CTRL-C a short while from now.
+    event_loop.call_later(1.0, os.kill, os.getpid(), signal.SIGINT)
+    # Run the main function!
+    main(['--no-env', '--format', 'json'])
+    stdout, stderr = capfd.readouterr()
+    assert stderr.strip() == ''
+    lines = [json.loads(line) for line in stdout.strip().split('\n')]
+    for line in lines:
+        del line['ts']
+    p = subprocess_factory.last_instance
+    assert lines == [{
+        'type': 'foo',
+        'index': 0,
+        'pid': p.pid,
+        'stream': 'strawboss',
+        'message': message % p.pid,
+    } for message in (
+        'foo.0(%d) spawned.',
+        'foo.0(%d) sent SIGTERM.',
+        'foo.0(%d) completed with exit status -15.',
+    )]
+
 @mock.patch('dotenvfile.loadfile')
 @mock.patch('procfile.loadfile')
 def test_main_idempotent_ctrl_c(load_procfile, load_dotenvfile,
@@ -96,8 +148,8 @@ def test_main_idempotent_ctrl_c(load_procfile, load_dotenvfile,
     for p in subprocess_factory.instances:
         expected_lines.extend([
             '[strawboss] foo.0(%d) spawned.' % p.pid,
-            '[strawboss] foo.0(%d) killed.' % p.pid,
-            '[strawboss] foo.0(%d) completed with exit status -9.' % p.pid,
+            '[strawboss] foo.0(%d) sent SIGTERM.' % p.pid,
+            '[strawboss] foo.0(%d) completed with exit status -15.' % p.pid,
         ])
     assert len(subprocess_factory.instances) > 0
     assert set(lines) == set(expected_lines)
@@ -130,8 +182,8 @@ def test_main_cli(load_procfile, load_dotenvfile,
     for i in range(2):
         expected_lines.extend([
             '[strawboss] foo.%d(?) spawned.' % i,
-            '[strawboss] foo.%d(?) killed.' % i,
-            '[strawboss] foo.%d(?) completed with exit status -9.' % i,
+            '[strawboss] foo.%d(?) sent SIGTERM.' % i,
+            '[strawboss] foo.%d(?) completed with exit status -15.' % i,
         ])
     print(lines)
     assert len(subprocess_factory.instances) > 0
@@ -175,8 +227,8 @@ def test_main_envfile(load_procfile, load_dotenvfile,
         }
         expected_lines.extend([
             '[strawboss] foo.0(%d) spawned.' % p.pid,
-            '[strawboss] foo.0(%d) killed.' % p.pid,
-            '[strawboss] foo.0(%d) completed with exit status -9.' % p.pid,
+            '[strawboss] foo.0(%d) sent SIGTERM.' % p.pid,
+            '[strawboss] foo.0(%d) completed with exit status -15.' % p.pid,
         ])
     print(lines)
     assert len(subprocess_factory.instances) > 0
@@ -215,8 +267,8 @@ def test_main_envfile_missing(load_procfile, load_dotenvfile,
         }
         expected_lines.extend([
             '[strawboss] foo.0(%d) spawned.' % p.pid,
-            '[strawboss] foo.0(%d) killed.' % p.pid,
-            '[strawboss] foo.0(%d) completed with exit status -9.' % p.pid,
+            '[strawboss] foo.0(%d) sent SIGTERM.' % p.pid,
+            '[strawboss] foo.0(%d) completed with exit status -15.' % p.pid,
         ])
     print(lines)
     assert len(subprocess_factory.instances) > 0
@@ -263,9 +315,394 @@ def test_main_envfile_missing_partial(load_procfile, load_dotenvfile,
         }
         expected_lines.extend([
             '[strawboss] foo.0(%d) spawned.' % p.pid,
-            '[strawboss] foo.0(%d) killed.' % p.pid,
-            '[strawboss] foo.0(%d) completed with exit status -9.' % p.pid,
+            '[strawboss] foo.0(%d) sent SIGTERM.' % p.pid,
+            '[strawboss] foo.0(%d) completed with exit status -15.' % p.pid,
         ])
     print(lines)
     assert len(subprocess_factory.instances) > 0
     assert set(lines) == set(expected_lines)
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_control_scale(load_procfile, load_dotenvfile,
+                            subprocess_factory, capfd, event_loop, tmpdir):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+        'bar': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    path = str(tmpdir.join('strawboss.sock'))
+    # Scale up from another process a short while from now.
+    errors = []
+    def scale(*args):
+        try:
+            main(['--control-socket', path, 'scale'] + list(args))
+        except SystemExit as error:
+            errors.append(error.code)
+    event_loop.call_later(0.5, event_loop.run_in_executor,
+                          None, scale, 'foo=2', 'bar=1')
+    event_loop.call_later(0.5, event_loop.run_in_executor,
+                          None, scale, 'meh=1')
+    # Automatically trigger CTRL-C a short while from now.
+    event_loop.call_later(1.0, os.kill, os.getpid(), signal.SIGINT)
+    # Run the main function!
+    main(['--no-env', '--control-socket', path, '--scale', 'bar:0'])
+    stdout, stderr = capfd.readouterr()
+    assert stderr.strip() == 'Unknown process type "meh".'
+    assert errors == [1]
+    assert not os.path.exists(path)
+    # Output log should contain start & stop info for each subprocess.
+    lines = stdout.strip().split('\n')
+    lines = [re.sub(r'\(\d+\)', r'(?)', line.split(' ', 1)[1]) for line in lines]
+    expected_lines = []
+    for name in ('foo.0', 'foo.1', 'bar.0'):
+        expected_lines.extend([
+            '[strawboss] %s(?) spawned.' % name,
+            '[strawboss] %s(?) sent SIGTERM.' % name,
+            '[strawboss] %s(?) completed with exit status -15.' % name,
+        ])
+    assert len(subprocess_factory.instances) == 3
+    assert set(lines) == set(expected_lines)
+
+def test_main_scale_no_control_socket(capfd):
+    with pytest.raises(SystemExit) as exc:
+        main(['scale', 'foo=2'])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == 'No control socket, use "--control-socket".'
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_control_socket_error(load_procfile, load_dotenvfile,
+                                   subprocess_factory, capfd, event_loop,
+                                   tmpdir):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    path = tmpdir.join('Procfile')
+    path.write('foo: false\n')
+    with pytest.raises(SystemExit) as exc:
+        main(['--no-env', '--control-socket', str(path)])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == 'Could not listen on "%s": File exists.' % path
+    assert path.read() == 'foo: false\n'
+
+def test_main_rolling_restart_no_progress(capfd):
+    with pytest.raises(SystemExit) as exc:
+        main(['--rolling-surge', '0', '--rolling-max-unavailable', '0'])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == (
+        'Rolling restarts need a surge or unavailable instances.'
+    )
+
+def test_main_reload(subprocess_factory, capfd, event_loop, tmpdir):
+    path = tmpdir.join('Procfile')
+    path.write('foo: false\nbar: false\n')
+    # Edit the Procfile a short while from now.
+    event_loop.call_later(0.2, path.write, 'foo: true\nbaz: false\n')
+    # Automatically trigger CTRL-C a short while from now.
+    event_loop.call_later(1.5, os.kill, os.getpid(), signal.SIGINT)
+    # Run the main function!
+    main(['--no-env', '--procfile', str(path), '--reload',
+          '--reload-delay', '0.1', '--rolling-delay', '0'])
+    stdout, stderr = capfd.readouterr()
+    assert stderr.strip() == ''
+    lines = stdout.strip().split('\n')
+    lines = [re.sub(r'\(\d+\)', r'(?)', line.split(' ', 1)[1])
+             for line in lines]
+    print(lines)
+    # Only changed process types are restarted.
+    assert len(subprocess_factory.instances) == 4
+    assert lines.count('[strawboss] foo.0(?) spawned.') == 2
+    assert lines.count('[strawboss] bar.0(?) spawned.') == 1
+    assert lines.count('[strawboss] baz.0(?) spawned.') == 1
+    assert ('[strawboss] Reloaded "%s": added baz; removed bar; '
+            'changed foo.' % path) in lines
+    assert '[strawboss] Rolling restart of foo completed.' in lines
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_stop_signal(load_procfile, load_dotenvfile,
+                          subprocess_factory, capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+        'bar': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    # Automatically trigger CTRL-C a short while from now.
+    event_loop.call_later(1.0, os.kill, os.getpid(), signal.SIGINT)
+    # Run the main function!
+    main(['--no-env', '--stop-signal', 'foo:INT'])
+    stdout, stderr = capfd.readouterr()
+    assert stderr.strip() == ''
+    # Each process type is stopped using its own signal.
+    lines = stdout.strip().split('\n')
+    lines = [re.sub(r'\(\d+\)', r'(?)', line.split(' ', 1)[1]) for line in lines]
+    assert set(lines) == {
+        '[strawboss] foo.0(?) spawned.',
+        '[strawboss] foo.0(?) sent SIGINT.',
+        '[strawboss] foo.0(?) completed with exit status -2.',
+        '[strawboss] bar.0(?) spawned.',
+        '[strawboss] bar.0(?) sent SIGTERM.',
+        '[strawboss] bar.0(?) completed with exit status -15.',
+    }
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_output_streams(load_procfile, load_dotenvfile, tmpdir,
+                             subprocess_factory, capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+        'bar': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    def feed():
+        for p in subprocess_factory.instances:
+            p.stdout.feed_data(b'hello\n')
+            p.stderr.feed_data(b'oops\n')
+    event_loop.call_later(0.5, feed)
+    # Automatically trigger CTRL-C a short while from now.
+    event_loop.call_later(1.0, os.kill, os.getpid(), signal.SIGINT)
+    # Run the main function!
+    path = str(tmpdir.join('foo.log'))
+    main([
+        '--no-env',
+        '--stdout', 'foo:' + path,
+        '--stderr', 'foo:discard',
+        '--stdout', 'bar:discard',
+    ])
+    stdout, stderr = capfd.readouterr()
+    assert stderr.strip() == ''
+    lines = stdout.strip().split('\n')
+    lines = [line.split(' ', 1)[1] for line in lines]
+    assert '[bar.0:stderr] oops' in lines
+    assert not [line for line in lines if 'hello' in line]
+    assert not [line for line in lines if 'foo.0:stderr' in line]
+    with open(path, 'r') as stream:
+        lines = stream.read().strip().split('\n')
+    lines = [line.split(' ', 1)[1] for line in lines]
+    assert lines == ['[foo.0] hello']
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_output_streams_invalid_file(load_procfile, load_dotenvfile,
+                                          tmpdir, subprocess_factory, capfd,
+                                          event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    path = str(tmpdir.join('missing', 'foo.log'))
+    with pytest.raises(SystemExit) as exc:
+        main(['--no-env', '--stdout', 'foo:' + path])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == (
+        'Could not open "%s": No such file or directory.' % path
+    )
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_log_dir(load_procfile, load_dotenvfile, tmpdir,
+                      subprocess_factory, capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    def feed():
+        for p in subprocess_factory.instances:
+            p.stdout.feed_data(b'hello\n')
+            p.stderr.feed_data(b'oops\n')
+    event_loop.call_later(0.5, feed)
+    # Automatically trigger CTRL-C a short while from now.
+    event_loop.call_later(1.0, os.kill, os.getpid(), signal.SIGINT)
+    # Run the main function!
+    path = str(tmpdir.join('logs'))
+    main(['--no-env', '--log-dir', path])
+    stdout, stderr = capfd.readouterr()
+    assert stderr.strip() == ''
+    assert 'hello' not in stdout
+    assert 'oops' not in stdout
+    with open(os.path.join(path, 'foo.0.log'), 'r') as stream:
+        lines = stream.read().strip().split('\n')
+    lines = [line.split(' ', 1)[1] for line in lines]
+    assert '[foo.0] hello' in lines
+    assert '[foo.0:stderr] oops' in lines
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_rate_limit_invalid_env(load_procfile, load_dotenvfile,
+                                     subprocess_factory, capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {'STRAWBOSS_RATE_LIMIT': 'fast'},
+        },
+    }
+    with pytest.raises(SystemExit) as exc:
+        main(['--no-env'])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == 'Invalid rate limit "fast".'
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_rate_limit(load_procfile, load_dotenvfile, subprocess_factory,
+                         capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {'STRAWBOSS_RATE_LIMIT': '1000'},
+        },
+        'bar': {
+            'cmd': 'false',
+            'env': {'STRAWBOSS_RATE_LIMIT': '1000'},
+        },
+    }
+    def feed():
+        for p in subprocess_factory.instances:
+            p.stdout.feed_data(b'hello\n' * 5)
+    event_loop.call_later(0.5, feed)
+    # Automatically trigger CTRL-C a short while from now.
+    event_loop.call_later(1.0, os.kill, os.getpid(), signal.SIGINT)
+    # The command-line takes precedence over the environment.
+    main(['--no-env', '--rate-limit', 'foo:0.001:2'])
+    stdout, stderr = capfd.readouterr()
+    assert stderr.strip() == ''
+    lines = stdout.strip().split('\n')
+    lines = [line.split(' ', 1)[1] for line in lines]
+    assert lines.count('[foo.0] hello') == 2
+    assert lines.count('[bar.0] hello') == 5
+    assert '[strawboss] foo.0: 3 lines suppressed.' in lines
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_metrics_invalid_address(load_procfile, load_dotenvfile,
+                                      subprocess_factory, capfd,
+                                      event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    with pytest.raises(SystemExit) as exc:
+        main(['--no-env', '--metrics', 'localhost:http'])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == (
+        'Could not listen on "localhost:http": Invalid port "http".'
+    )
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_profile(load_procfile, load_dotenvfile, tmpdir,
+                      subprocess_factory, capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    def feed():
+        for p in subprocess_factory.instances:
+            p.stdout.feed_data(b'hello\n')
+    event_loop.call_later(0.5, feed)
+    # Automatically trigger CTRL-C a short while from now.
+    event_loop.call_later(1.0, os.kill, os.getpid(), signal.SIGINT)
+    # Run the main function!
+    path = str(tmpdir.join('strawboss.prof'))
+    main(['--no-env', '--stage-timers', '--profile', path])
+    stdout, stderr = capfd.readouterr()
+    assert stderr.strip() == ''
+    lines = stdout.strip().split('\n')
+    lines = [line.split(' ', 1)[1] for line in lines]
+    assert '[foo.0] hello' in lines
+    assert [line for line in lines if line.startswith('[strawboss] split: ')]
+    assert lines[-1].startswith('[strawboss] event loop lag: ')
+    pstats.Stats(path)
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_watchdog_alert_missing(load_procfile, load_dotenvfile,
+                                     subprocess_factory, capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    with pytest.raises(SystemExit) as exc:
+        main(['--no-env', '--max-rss', 'foo:1G',
+              '--watchdog-action', 'foo:alert'])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == (
+        'The alert action requires the --watchdog-alert option.'
+    )
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_circular_dependencies(load_procfile, load_dotenvfile,
+                                    subprocess_factory, capfd, event_loop):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+        'bar': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    with pytest.raises(SystemExit) as exc:
+        main(['--no-env', '--depends-on', 'foo:bar',
+              '--depends-on', 'bar:foo'])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == 'Circular dependencies: bar -> foo -> bar.'
+
+@mock.patch('dotenvfile.loadfile')
+@mock.patch('procfile.loadfile')
+def test_main_probe_on_listening_socket(load_procfile, load_dotenvfile,
+                                        subprocess_factory, capfd,
+                                        event_loop, unused_tcp_port):
+    load_procfile.return_value = {
+        'foo': {
+            'cmd': 'false',
+            'env': {},
+        },
+    }
+    with pytest.raises(SystemExit) as exc:
+        main(['--no-env', '--listen', 'foo:127.0.0.1:%d' % unused_tcp_port,
+              '--ready', 'foo:http:%d/health' % unused_tcp_port])
+    assert int(str(exc.value)) == 2
+    _, stderr = capfd.readouterr()
+    assert stderr.strip() == (
+        'Readiness probe of "foo" connects to its listening socket, use a '
+        'log: or exec: probe instead.'
+    )
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import pytest
+import sys
+
+from strawboss import run_once
+from strawboss.metrics import (
+    Histogram,
+    Metrics,
+    MetricsServer,
+    read_usage,
+)
+from strawboss.output import OutputWriter, Timestamps
+
+
+class Output(object):
+
+    @asyncio.coroutine
+    def write(self, text, count=1):
+        pass
+
+
+def test_histogram():
+    h = Histogram([1.0, 5.0])
+    for value in (0.5, 1.0, 3.0, 10.0, 20.0):
+        h.observe(value)
+    assert h.counts == [2, 1, 2]
+    assert h.sum == 34.5
+    assert h.count == 5
+
+
+def test_read_usage(tmpdir):
+    proc = tmpdir.mkdir('123')
+    proc.join('stat').write(
+        b'123 (my (odd) cmd) S 1 123 123 0 -1 4194560 100 0 0 0 '
+        b'250 150 0 0 20 0 1 0 1000 2000000 300 0 0 0',
+        mode='wb',
+    )
+    proc.join('statm').write(b'500 300 100 1 0 200 0\n', mode='wb')
+    cpu, rss = read_usage(123, proc=str(tmpdir))
+    assert cpu == 400 / os.sysconf('SC_CLK_TCK')
+    assert rss == 300 * os.sysconf('SC_PAGE_SIZE')
+    assert read_usage(456, proc=str(tmpdir)) is None
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'),
+                    reason="Requires /proc.")
+def test_read_usage_self():
+    cpu, rss = read_usage()
+    assert cpu > 0.0
+    assert rss > 0
+
+
+def test_metrics_render(event_loop):
+    metrics = Metrics(loop=event_loop)
+    metrics.add_writer('terminal', OutputWriter(loop=event_loop))
+    metrics.spawned('web.0', 123)
+    metrics.forwarded('web.0', 'stdout', 2, 100)
+    metrics.forwarded('web.0', 'stdout', 1, 50)
+    metrics.suppressed['web.0'] += 7
+    metrics.exited('web.0', 123, 1)
+    metrics.respawn_delay('web.0', 0.2)
+    metrics.spawned('web.0', 124)
+    text = metrics.render()
+    lines = text.splitlines()
+    assert 'strawboss_spawns_total{process="web.0",type="web"} 2' in lines
+    assert (
+        'strawboss_exits_total{process="web.0",status="1",type="web"} 1'
+    ) in lines
+    assert (
+        'strawboss_lines_total{process="web.0",stream="stdout",type="web"} 3'
+    ) in lines
+    assert (
+        'strawboss_bytes_total{process="web.0",stream="stdout",type="web"} '
+        '150'
+    ) in lines
+    assert (
+        'strawboss_suppressed_lines_total{process="web.0",type="web"} 7'
+    ) in lines
+    assert 'strawboss_dropped_lines_total{sink="terminal"} 0' in lines
+    assert 'strawboss_output_queue_depth{sink="terminal"} 0' in lines
+    assert (
+        'strawboss_respawn_delay_seconds_bucket{le="0.1",type="web"} 0'
+    ) in lines
+    assert (
+        'strawboss_respawn_delay_seconds_bucket{le="0.5",type="web"} 1'
+    ) in lines
+    assert (
+        'strawboss_respawn_delay_seconds_bucket{le="+Inf",type="web"} 1'
+    ) in lines
+    assert 'strawboss_respawn_delay_seconds_count{type="web"} 1' in lines
+    assert '# TYPE strawboss_event_loop_lag_seconds histogram' in lines
+    assert text.endswith('\n')
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'),
+                    reason="Requires /proc.")
+@pytest.mark.asyncio
+def test_metrics_sample(event_loop):
+    metrics = Metrics(interval=0.01, loop=event_loop)
+    metrics.spawned('me.0', os.getpid())
+    metrics.spawned('gone.0', 999999999)
+    metrics.start()
+    while not metrics.loop_lag.count:
+        yield from asyncio.sleep(0.01, loop=event_loop)
+    yield from metrics.close()
+    assert set(metrics.usage) == {'me.0'}
+    assert metrics.supervisor_usage is not None
+    lines = metrics.render().splitlines()
+    assert [
+        line for line in lines
+        if line.startswith('strawboss_child_resident_memory_bytes{')
+    ]
+    assert [
+        line for line in lines
+        if line.startswith('strawboss_resident_memory_bytes ')
+    ]
+
+
+@asyncio.coroutine
+def http_get(event_loop, path, request):
+    reader, writer = yield from asyncio.open_unix_connection(
+        path, loop=event_loop,
+    )
+    writer.write(request)
+    response = yield from reader.read()
+    writer.close()
+    head, body = response.split(b'\r\n\r\n', 1)
+    return head.decode('latin-1').split('\r\n'), body.decode('utf-8')
+
+
+@pytest.mark.asyncio
+def test_metrics_server(event_loop, tmpdir):
+    path = str(tmpdir.join('metrics.sock'))
+    metrics = Metrics(loop=event_loop)
+    metrics.spawned('web.0', 123)
+    server = MetricsServer(path, metrics, loop=event_loop)
+    yield from server.start()
+    try:
+        head, body = yield from http_get(
+            event_loop, path,
+            b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n',
+        )
+        assert head[0] == 'HTTP/1.0 200 OK'
+        assert 'Content-Length: %d' % len(body.encode('utf-8')) in head
+        assert body == metrics.render()
+        head, body = yield from http_get(
+            event_loop, path, b'GET / HTTP/1.1\r\n\r\n',
+        )
+        assert head[0] == 'HTTP/1.0 404 Not Found'
+        head, body = yield from http_get(
+            event_loop, path, b'POST /metrics HTTP/1.1\r\n\r\n',
+        )
+        assert head[0] == 'HTTP/1.0 405 Method Not Allowed'
+    finally:
+        yield from server.close()
+    assert not os.path.exists(path)
+
+
+@pytest.mark.asyncio
+def test_metrics_server_invalid_port(event_loop):
+    server = MetricsServer('localhost:http', Metrics(loop=event_loop),
+                           loop=event_loop)
+    with pytest.raises(OSError):
+        yield from server.start()
+
+
+def test_metrics_server_address(event_loop):
+    for address, is_unix in [
+        ('9100', False),
+        (':9100', False),
+        ('127.0.0.1:9100', False),
+        ('metrics.sock', True),
+        ('/run/metrics.sock', True),
+    ]:
+        server = MetricsServer(address, Metrics(loop=event_loop),
+                               loop=event_loop)
+        assert server.is_unix == is_unix
+
+
+@pytest.mark.asyncio
+def test_metrics_server_port(event_loop, unused_tcp_port, tmpdir,
+                             monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    server = MetricsServer(str(unused_tcp_port), Metrics(loop=event_loop),
+                           loop=event_loop)
+    yield from server.start()
+    try:
+        # A bare number is a port, not a path.
+        assert tmpdir.listdir() == []
+        _, writer = yield from asyncio.open_connection(
+            '127.0.0.1', unused_tcp_port, loop=event_loop,
+        )
+        writer.close()
+    finally:
+        yield from server.close()
+
+
+@pytest.mark.asyncio
+def test_metrics_server_not_a_socket(event_loop, tmpdir):
+    path = tmpdir.join('Procfile')
+    path.write('web: gunicorn app\n')
+    server = MetricsServer(str(path), Metrics(loop=event_loop),
+                           loop=event_loop)
+    with pytest.raises(FileExistsError):
+        yield from server.start()
+    # Other files are never removed.
+    assert path.read() == 'web: gunicorn app\n'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', ['stream', 'protocol'])
+def test_run_once_metrics(event_loop, transport):
+    metrics = Metrics(loop=event_loop)
+    script = 'import sys; print("foo"); print("bar"); sys.exit(3)'
+    status = yield from run_once(
+        'worker.0', [sys.executable, '-c', script], None,
+        asyncio.Future(loop=event_loop), loop=event_loop,
+        output=Output(), transport=transport,
+        timestamps=Timestamps(format='none'), metrics=metrics,
+    )
+    assert status == 3
+    assert metrics.spawns == {'worker.0': 1}
+    assert metrics.exits == {('worker.0', 3): 1}
+    assert metrics.lines['worker.0', 'stdout'] == 2
+    assert metrics.bytes['worker.0', 'stdout'] == 8
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import datetime
+import errno
+import io
+import json
+import pytest
+import time
+
+from freezegun import freeze_time
+from strawboss.output import (
+    JSONFormat,
+    LineSplitter,
+    OutputWriter,
+    TextFormat,
+    Timestamps,
+    format_lines,
+    now,
+)
+from unittest import mock
+
+def test_splitter_single_line():
+    splitter = LineSplitter()
+    assert splitter.feed(b'foo\n') == ['foo']
+    assert splitter.flush() == []
+
+def test_splitter_multiple_lines():
+    splitter = LineSplitter()
+    assert splitter.feed(b'foo\nbar\n\nqux\n') == ['foo', 'bar', '', 'qux']
+
+def test_splitter_partial_lines():
+    splitter = LineSplitter()
+    assert splitter.feed(b'fo') == []
+    assert splitter.feed(b'o\nba') == ['foo']
+    assert splitter.feed(b'r') == []
+    assert splitter.feed(b'\nqux') == ['bar']
+    assert splitter.flush() == ['qux']
+    assert splitter.flush() == []
+
+def test_splitter_strip():
+    splitter = LineSplitter()
+    assert splitter.feed(b'  foo \r\nbar\t\n') == ['foo', 'bar']
+
+def test_splitter_multibyte_boundary():
+    splitter = LineSplitter()
+    data = 'café\n'.encode('utf-8')
+    assert splitter.feed(data[:4]) == []
+    assert splitter.feed(data[4:]) == ['café']
+
+def test_splitter_decode_errors():
+    splitter = LineSplitter()
+    assert splitter.feed(b'caf\xe9\n') == ['caf\ufffd']
+    assert splitter.feed(b'\xff') == []
+    assert splitter.flush() == ['\ufffd']
+    splitter = LineSplitter(errors='backslashreplace')
+    assert splitter.feed(b'caf\xe9\n') == ['caf\\xe9']
+
+def test_splitter_long_lines():
+    splitter = LineSplitter(max_length=4)
+    assert splitter.feed(b'abcdefghij\nfoo\n\n') == [
+        'abcd', 'efgh', 'ij', 'foo', '',
+    ]
+
+def test_splitter_long_partial_line():
+    splitter = LineSplitter(max_length=4)
+    # Partial lines are not buffered beyond the maximum length.
+    assert splitter.feed(b'abc') == []
+    assert splitter.feed(b'defghi') == ['abcd', 'efgh']
+    assert splitter.feed(b'j\nabcdefghij') == ['ij', 'abcd', 'efgh']
+    assert splitter.flush() == ['ij']
+
+def test_splitter_long_partial_line_multibyte():
+    splitter = LineSplitter(max_length=4)
+    # Fragments are never cut in the middle of a character.
+    assert splitter.feed('abcé'.encode('utf-8') + b'x') == ['abc']
+    assert splitter.feed(b'\n') == ['éx']
+
+def test_splitter_max_length_too_small():
+    for max_length in (0, 1, 3):
+        with pytest.raises(ValueError) as exc:
+            print(LineSplitter(max_length=max_length))
+        assert str(exc.value) == (
+            'Invalid maximum line length %d.' % max_length
+        )
+
+def test_splitter_fragments_progress():
+    splitter = LineSplitter(max_length=4)
+    # Backtracking over UTF-8 sequences never gets stuck, even with less
+    # room than a character needs (which the constructor doesn't allow).
+    splitter._max_length = 1
+    assert splitter.feed(b'\xc3\xa9\xc3\xa9') == [
+        '\ufffd', '\ufffd', '\ufffd',
+    ]
+
+def test_format_lines():
+    assert format_lines('> ', []) == ''
+    assert format_lines('> ', ['foo']) == '> foo\n'
+    assert format_lines('> ', ['foo', 'bar']) == '> foo\n> bar\n'
+
+@pytest.mark.asyncio
+def test_writer_block(event_loop):
+    stream = io.StringIO()
+    writer = OutputWriter(stream, maxsize=1, policy='block', loop=event_loop)
+    yield from writer.write('foo\n')
+    # The queue is full, so this blocks until the writer catches up.
+    yield from writer.write('bar\n')
+    yield from writer.write('qux\n')
+    yield from writer.close()
+    assert stream.getvalue() == 'foo\nbar\nqux\n'
+    assert writer.dropped == 0
+
+@pytest.mark.asyncio
+def test_writer_drop(event_loop):
+    stream = io.StringIO()
+    writer = OutputWriter(stream, maxsize=1, policy='drop', loop=event_loop)
+    yield from writer.write('foo\n')
+    yield from writer.write('bar\nqux\n', 2)
+    assert writer.dropped == 2
+    yield from writer.close()
+    lines = stream.getvalue().split('\n')
+    assert lines[0] == 'foo'
+    assert lines[1].endswith(' [strawboss] 2 lines dropped.')
+    assert lines[2:] == ['']
+    # Output after closing the writer is dropped.
+    yield from writer.write('meh\n')
+    assert writer.dropped == 3
+
+@pytest.mark.asyncio
+def test_writer_spill(event_loop):
+    stream = io.StringIO()
+    writer = OutputWriter(stream, maxsize=1, policy='spill', loop=event_loop)
+    for i in range(10):
+        yield from writer.write('line %d\n' % i)
+    assert writer.pending == 1
+    yield from writer.close()
+    assert stream.getvalue() == ''.join('line %d\n' % i for i in range(10))
+    assert writer.dropped == 0
+
+@pytest.mark.asyncio
+def test_writer_coalesce(event_loop):
+    stream = mock.MagicMock()
+    stream.encoding = 'utf-8'
+    writer = OutputWriter(stream, maxsize=10, loop=event_loop)
+    for i in range(5):
+        yield from writer.write('line %d\n' % i)
+    yield from writer.close()
+    stream.write.assert_called_once_with(
+        ''.join('line %d\n' % i for i in range(5))
+    )
+
+@pytest.mark.asyncio
+def test_writer_error(event_loop, capsys):
+    stream = mock.MagicMock()
+    stream.encoding = 'utf-8'
+    stream.write.side_effect = OSError(errno.ENOSPC, 'No space left on device')
+    writer = OutputWriter(stream, maxsize=1, policy='block', loop=event_loop)
+    # Writes never block, even though nothing can be written.
+    for i in range(5):
+        yield from asyncio.wait_for(
+            writer.write('line %d\n' % i), timeout=1.0, loop=event_loop,
+        )
+    yield from writer.close()
+    assert writer.dropped == 5
+    # The error is reported once.
+    _, stderr = capsys.readouterr()
+    assert stderr == 'Could not write output: No space left on device.\n'
+
+@pytest.mark.asyncio
+def test_writer_ascii_stream(event_loop):
+    buffer = io.BytesIO()
+    stream = io.TextIOWrapper(buffer, encoding='ascii')
+    writer = OutputWriter(stream, loop=event_loop)
+    yield from writer.write('caf\xe9\n')
+    yield from writer.write('bar\n')
+    yield from writer.close()
+    # Characters the stream can't encode are escaped, output goes on.
+    assert buffer.getvalue() == b'caf\\xe9\nbar\n'
+    assert writer.dropped == 0
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('errors', ['replace', 'backslashreplace', 'ignore'])
+def test_undecodable_output_ascii_stream(event_loop, errors):
+    buffer = io.BytesIO()
+    stream = io.TextIOWrapper(buffer, encoding='ascii')
+    writer = OutputWriter(stream, loop=event_loop)
+    splitter = LineSplitter(errors=errors)
+    format = TextFormat(Timestamps(format='none')).stream('web.0', 123)
+    yield from writer.write(format(splitter.feed(b'\xff\n')))
+    yield from writer.write(format(splitter.feed(b'ok\n')))
+    yield from writer.close()
+    expected = {
+        'replace': b'\\ufffd',
+        'backslashreplace': b'\\xff',
+        'ignore': b'',
+    }[errors]
+    assert buffer.getvalue() == (
+        b'[web.0] ' + expected + b'\n[web.0] ok\n'
+    )
+
+@pytest.mark.asyncio
+def test_writer_value_error(event_loop, capsys):
+    stream = mock.MagicMock()
+    stream.encoding = None
+    stream.write.side_effect = ValueError('I/O operation on closed file.')
+    writer = OutputWriter(stream, loop=event_loop)
+    yield from writer.write('foo\nbar\n', count=2)
+    yield from writer.close()
+    assert writer.dropped == 2
+    _, stderr = capsys.readouterr()
+    assert stderr == 'Could not write output: I/O operation on closed file.\n'
+
+def test_writer_invalid_policy(event_loop):
+    with pytest.raises(ValueError) as exc:
+        OutputWriter(policy='meh', loop=event_loop)
+    assert str(exc.value) == 'Invalid output policy "meh".'
+
+def test_timestamps_iso(clock):
+    timestamps = Timestamps()
+    assert timestamps.prefix() == now().isoformat() + ' '
+    timestamps = Timestamps(utc=True)
+    assert timestamps.prefix() == now(utc=True).isoformat() + ' '
+
+@pytest.mark.parametrize('utc', [False, True])
+@pytest.mark.parametrize('microsecond', [0, 1, 999, 123456, 999999])
+def test_timestamps_iso_precision(utc, microsecond):
+    t = datetime.datetime(2016, 2, 29, 23, 59, 58, microsecond)
+    with freeze_time(t):
+        with mock.patch('strawboss.output.monotonic', return_value=0.0):
+            expected = now(utc).isoformat()
+            head = expected[:19]
+            tail = '+00:00 ' if utc else ' '
+            assert Timestamps(utc=utc).prefix() == expected + ' '
+            assert Timestamps(utc=utc, precision='s').prefix() == head + tail
+            assert Timestamps(utc=utc, precision='ms').prefix() == (
+                '%s.%03d%s' % (head, microsecond // 1000, tail)
+            )
+
+def test_timestamps_epoch_ms(clock):
+    timestamps = Timestamps(format='epoch-ms')
+    assert timestamps.prefix() == '%d ' % round(time.time() * 1000)
+
+def test_timestamps_none(clock):
+    assert Timestamps(format='none').prefix() == ''
+
+def test_timestamps_cache():
+    timestamps = Timestamps()
+    with mock.patch('strawboss.output.monotonic') as monotonic:
+        monotonic.return_value = 100.0
+        with mock.patch('time.time', return_value=1456790398.5):
+            a = timestamps.prefix()
+        # The wall clock is only looked up again after one second.
+        monotonic.return_value = 100.25
+        with mock.patch('time.time', return_value=0.0):
+            b = timestamps.prefix()
+        monotonic.return_value = 101.5
+        with mock.patch('time.time', return_value=1456790400.0):
+            c = timestamps.prefix()
+    assert a[:19] == b[:19]
+    assert a.endswith('.500000 ')
+    assert b.endswith('.750000 ')
+    assert c[:19] != b[:19]
+    assert c.endswith(':00 ')
+
+def test_timestamps_invalid():
+    with pytest.raises(ValueError) as exc:
+        Timestamps(format='meh')
+    assert str(exc.value) == 'Invalid timestamp format "meh".'
+    with pytest.raises(ValueError) as exc:
+        Timestamps(precision='ns')
+    assert str(exc.value) == 'Invalid timestamp precision "ns".'
+
+def test_text_format(clock):
+    formatter = TextFormat(Timestamps())
+    format = formatter.stream('web.0', 123)
+    assert format([]) == ''
+    assert format(['foo', 'bar']) == (
+        '%s [web.0] foo\n%s [web.0] bar\n' % (
+            now().isoformat(), now().isoformat(),
+        )
+    )
+    assert formatter.status('web.0(123) spawned.', 'web.0', 123) == (
+        '%s [strawboss] web.0(123) spawned.\n' % now().isoformat()
+    )
+
+def test_json_format(clock):
+    formatter = JSONFormat(Timestamps())
+    format = formatter.stream('web.0', 123)
+    assert format([]) == ''
+    lines = format(['foo', 'b"a\\r \u00e9']).split('\n')
+    assert lines[2:] == ['']
+    assert [json.loads(line) for line in lines[:2]] == [{
+        'ts': now().isoformat(),
+        'type': 'web',
+        'index': 0,
+        'pid': 123,
+        'stream': 'stdout',
+        'message': message,
+    } for message in ('foo', 'b"a\\r \u00e9')]
+    assert json.loads(formatter.status('Hi.', 'web.0', 123)) == {
+        'ts': now().isoformat(),
+        'type': 'web',
+        'index': 0,
+        'pid': 123,
+        'stream': 'strawboss',
+        'message': 'Hi.',
+    }
+    assert json.loads(formatter.status('Hi.')) == {
+        'ts': now().isoformat(),
+        'stream': 'strawboss',
+        'message': 'Hi.',
+    }
+
+@pytest.mark.parametrize('lines', [
+    ['foo', 'b"a\tr'],
+    ['foo', 'b"a\\nr', 'qux\\'],
+])
+def test_json_format_batch(lines):
+    format = JSONFormat(Timestamps(format='none')).stream('web.1', 123)
+    text = format(lines)
+    assert text.endswith('\n')
+    assert [json.loads(line)['message'] for line in text.splitlines()] == lines
+
+def test_json_format_timestamps(clock):
+    format = JSONFormat(Timestamps(format='epoch-ms')).stream('worker', 1)
+    assert json.loads(format(['foo'])) == {
+        'ts': round(time.time() * 1000),
+        'type': 'worker',
+        'pid': 1,
+        'stream': 'stdout',
+        'message': 'foo',
+    }
+    format = JSONFormat(Timestamps(format='none')).stream('worker', 1)
+    assert 'ts' not in json.loads(format(['foo']))
+
+@pytest.mark.asyncio
+def test_writer_drop_json(event_loop, clock):
+    stream = io.StringIO()
+    writer = OutputWriter(stream, maxsize=1, policy='drop', loop=event_loop,
+                          formatter=JSONFormat())
+    yield from writer.write('foo\n')
+    yield from writer.write('bar\n')
+    yield from writer.close()
+    lines = stream.getvalue().split('\n')
+    assert json.loads(lines[1])['message'] == '1 lines dropped.'
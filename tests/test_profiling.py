@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+import sys
+import time
+
+from strawboss import run_once
+from strawboss.limits import OutputLimits
+from strawboss.output import LineSplitter, TextFormat, Timestamps
+from strawboss.profiling import LagMonitor, StageTimers
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 0.5
+        return self.now
+
+
+class Output(object):
+
+    @asyncio.coroutine
+    def write(self, text, count=1):
+        pass
+
+
+def test_stage_timers_wrap():
+    timers = StageTimers(clock=Clock())
+    splitter = timers.splitter(LineSplitter)()
+    assert splitter.feed(b'foo\nbar') == ['foo']
+    assert splitter.flush() == ['bar']
+    assert timers.calls['split'] == 2
+    assert timers.seconds['split'] == 1.0
+    assert timers.report() == [
+        'split: 1.000 seconds in 2 calls (500000.0 us per call).',
+    ]
+
+
+def test_stage_timers_formatter():
+    timers = StageTimers(clock=Clock())
+    formatter = timers.formatter(TextFormat(Timestamps(format='none')))
+    assert formatter.stream('web.0', 123)(['foo']) == '[web.0] foo\n'
+    assert formatter.status('hello') == '[strawboss] hello\n'
+    assert timers.calls['format'] == 1
+
+
+@pytest.mark.asyncio
+def test_stage_timers_coroutine(event_loop):
+    timers = StageTimers(clock=Clock())
+    write = timers.coroutine('write', Output().write)
+    yield from write('foo\n', 1)
+    assert timers.calls['write'] == 1
+    assert timers.seconds['write'] == 0.5
+
+
+@pytest.mark.asyncio
+def test_lag_monitor(event_loop):
+    warnings = []
+    monitor = LagMonitor(interval=0.01, threshold=0.05,
+                         warn=warnings.append, loop=event_loop)
+    monitor.start()
+    yield from asyncio.sleep(0.02, loop=event_loop)
+    # Block the event loop.
+    time.sleep(0.1)
+    yield from asyncio.sleep(0.02, loop=event_loop)
+    monitor.stop()
+    assert monitor.count >= 2
+    assert monitor.max >= 0.05
+    assert len(warnings) == 1
+    assert monitor.report().startswith('event loop lag: ')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', ['stream', 'protocol'])
+def test_run_once_stage_timers(event_loop, transport):
+    timers = StageTimers()
+    status = yield from run_once(
+        'worker.0', [sys.executable, '-c', 'print("foo")'], None,
+        asyncio.Future(loop=event_loop), loop=event_loop,
+        output=Output(), transport=transport,
+        timestamps=Timestamps(format='none'), timers=timers,
+        limits=OutputLimits(sample=1, rate=1000),
+    )
+    assert status == 0
+    for stage in ('split', 'filter', 'format', 'write'):
+        assert timers.calls[stage] > 0
+    assert bool(timers.calls['read']) == (transport == 'stream')
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+import sys
+
+from strawboss import run_once
+from strawboss.output import TextFormat, Timestamps
+from strawboss.protocol import MAX_PENDING, OutputProtocol
+
+
+class MockPipeTransport(object):
+
+    def __init__(self):
+        self.paused = False
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+
+class MockSubprocessTransport(object):
+
+    def __init__(self, pid=123):
+        self.pid = pid
+        self.returncode = None
+        self.pipe = MockPipeTransport()
+        self.closed = False
+
+    def get_pid(self):
+        return self.pid
+
+    def get_returncode(self):
+        return self.returncode
+
+    def get_pipe_transport(self, fd):
+        return self.pipe if fd == 1 else None
+
+    def close(self):
+        self.closed = True
+
+
+class Output(object):
+
+    def __init__(self, loop):
+        self.blocks = []
+        self.gate = asyncio.Event(loop=loop)
+        self.gate.set()
+
+    @asyncio.coroutine
+    def write(self, text, count=1):
+        yield from self.gate.wait()
+        self.blocks.append((text, count))
+
+
+def make_protocol(loop):
+    output = Output(loop)
+    protocol = OutputProtocol(
+        'worker.0', output.write, TextFormat(Timestamps(format='none')),
+        loop=loop,
+    )
+    transport = MockSubprocessTransport()
+    protocol.connection_made(transport)
+    return protocol, transport, output
+
+
+@pytest.mark.asyncio
+def test_protocol_output(event_loop):
+    protocol, transport, output = make_protocol(event_loop)
+    # Nothing is forwarded until the protocol is started.
+    protocol.pipe_data_received(1, b'foo\nba')
+    yield from asyncio.sleep(0.0, loop=event_loop)
+    assert output.blocks == []
+    protocol.start()
+    protocol.pipe_data_received(1, b'r\nqux')
+    protocol.pipe_data_received(2, b'oops\n')
+    protocol.pipe_connection_lost(1, None)
+    protocol.pipe_connection_lost(2, None)
+    transport.returncode = 2
+    protocol.process_exited()
+    assert (yield from protocol.wait()) == 2
+    yield from protocol.close()
+    assert transport.closed
+    assert output.blocks == [
+        ('[worker.0] foo\n', 1),
+        ('[worker.0] bar\n', 1),
+        ('[worker.0:stderr] oops\n', 1),
+        ('[worker.0] qux\n', 1),
+        ('[strawboss] EOF from worker.0(123).\n', 1),
+    ]
+
+
+@pytest.mark.asyncio
+def test_protocol_sinks(event_loop):
+    output = Output(event_loop)
+    errors = Output(event_loop)
+    protocol = OutputProtocol(
+        'worker.0', output.write, TextFormat(Timestamps(format='none')),
+        loop=event_loop, sinks={1: None, 2: errors.write},
+    )
+    transport = MockSubprocessTransport()
+    protocol.connection_made(transport)
+    protocol.start()
+    protocol.pipe_data_received(1, b'noise\n')
+    protocol.pipe_data_received(2, b'oops\n')
+    protocol.pipe_connection_lost(2, None)
+    protocol.pipe_connection_lost(1, None)
+    yield from protocol.close()
+    assert output.blocks == [
+        ('[strawboss] EOF from worker.0(123).\n', 1),
+    ]
+    assert errors.blocks == [
+        ('[worker.0:stderr] oops\n', 1),
+    ]
+
+
+@pytest.mark.asyncio
+def test_protocol_backpressure(event_loop):
+    protocol, transport, output = make_protocol(event_loop)
+    protocol.start()
+    output.gate.clear()
+    for i in range(MAX_PENDING):
+        protocol.pipe_data_received(1, b'line\n')
+    assert transport.pipe.paused
+    # Reading resumes once the backlog is mostly written.
+    output.gate.set()
+    while transport.pipe.paused:
+        yield from asyncio.sleep(0.0, loop=event_loop)
+    assert len(output.blocks) > MAX_PENDING // 2
+    yield from protocol.close()
+    assert len(output.blocks) == MAX_PENDING
+
+
+@pytest.mark.asyncio
+def test_run_once_protocol(event_loop):
+    output = Output(event_loop)
+    shutdown = asyncio.Future(loop=event_loop)
+    status = yield from run_once(
+        'worker.0', [sys.executable, '-c', 'print("hello")'],
+        None, shutdown, loop=event_loop, output=output,
+        timestamps=Timestamps(format='none'), transport='protocol',
+    )
+    assert status == 0
+    text = ''.join(block for block, _ in output.blocks).splitlines()
+    assert text[0].endswith(' spawned.')
+    assert text[1] == '[worker.0] hello'
+    assert text[2].startswith('[strawboss] EOF from worker.0(')
+    assert text[3].endswith(' completed with exit status 0.')
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+
+from strawboss.output import LineSplitter
+from strawboss.readiness import (
+    CommandProbe,
+    HTTPProbe,
+    LogProbe,
+    TCPProbe,
+    check_dependencies,
+    parse_dependencies,
+    parse_probe,
+)
+
+
+def test_parse_probe():
+    probe = parse_probe('tcp:5432')
+    assert isinstance(probe, TCPProbe)
+    assert (probe.host, probe.port) == ('127.0.0.1', 5432)
+    probe = parse_probe('tcp:db.local:5432')
+    assert (probe.host, probe.port) == ('db.local', 5432)
+    probe = parse_probe('http:8000/health')
+    assert isinstance(probe, HTTPProbe)
+    assert (probe.host, probe.port, probe.path) == (
+        '127.0.0.1', 8000, '/health',
+    )
+    probe = parse_probe('http:localhost:8000')
+    assert (probe.host, probe.port, probe.path) == ('localhost', 8000, '/')
+    probe = parse_probe('log:^Listening on (\\d+)')
+    assert isinstance(probe, LogProbe)
+    probe = parse_probe('exec:pg_isready -q')
+    assert isinstance(probe, CommandProbe)
+    assert probe.command == 'pg_isready -q'
+    for value in ('tcp:', 'tcp:http', 'http:db:web', 'log:(', 'exec: ',
+                  'ping:8000'):
+        with pytest.raises(ValueError) as exc:
+            print(parse_probe(value))
+        assert str(exc.value) == 'Invalid readiness probe "%s".' % value
+
+
+def test_parse_dependencies():
+    assert parse_dependencies('db') == ['db']
+    assert parse_dependencies('db, cache') == ['db', 'cache']
+    with pytest.raises(ValueError):
+        print(parse_dependencies('db,'))
+
+
+def test_check_dependencies():
+    check_dependencies({'web': ['db', 'cache'], 'db': [], 'cache': ['db']})
+    with pytest.raises(ValueError) as exc:
+        check_dependencies({'web': ['db']})
+    assert str(exc.value) == (
+        'Process type "web" depends on unknown process type "db".'
+    )
+    with pytest.raises(ValueError) as exc:
+        check_dependencies({'a': ['b'], 'b': ['c'], 'c': ['b'], 'd': []})
+    assert str(exc.value) == 'Circular dependencies: b -> c -> b.'
+
+
+def test_probe_interval():
+    assert parse_probe('tcp:5432').interval == 0.1
+    assert parse_probe('log:^Ready').instance().interval == 0.1
+    # Commands spawn a shell for each check.
+    assert parse_probe('exec:pg_isready').interval == 1.0
+    assert CommandProbe('true', interval=0.5).interval == 0.5
+    assert LogProbe('^Ready', interval=0.5).instance().interval == 0.5
+
+
+@pytest.mark.asyncio
+def test_tcp_probe(event_loop, unused_tcp_port):
+    probe = TCPProbe(unused_tcp_port)
+    assert not (yield from probe.check(event_loop))
+    server = yield from asyncio.start_server(
+        lambda reader, writer: writer.close(),
+        '127.0.0.1', unused_tcp_port, loop=event_loop,
+    )
+    try:
+        assert (yield from probe.check(event_loop))
+    finally:
+        server.close()
+        yield from server.wait_closed()
+
+
+@pytest.mark.asyncio
+def test_http_probe(event_loop, unused_tcp_port):
+    status = [b'503 Service Unavailable']
+    requests = []
+    @asyncio.coroutine
+    def serve(reader, writer):
+        requests.append((yield from reader.readline()))
+        writer.write(b'HTTP/1.0 ' + status[0] + b'\r\n\r\n')
+        writer.close()
+    server = yield from asyncio.start_server(
+        serve, '127.0.0.1', unused_tcp_port, loop=event_loop,
+    )
+    try:
+        probe = HTTPProbe(unused_tcp_port, path='/health')
+        assert not (yield from probe.check(event_loop))
+        status[0] = b'200 OK'
+        assert (yield from probe.check(event_loop))
+    finally:
+        server.close()
+        yield from server.wait_closed()
+    assert requests[0] == b'GET /health HTTP/1.0\r\n'
+
+
+@pytest.mark.asyncio
+def test_command_probe(event_loop):
+    assert (yield from CommandProbe('true').check(event_loop))
+    assert not (yield from CommandProbe('false').check(event_loop))
+    probe = CommandProbe('sleep 5', timeout=0.01)
+    assert not (yield from probe.check(event_loop))
+
+
+@pytest.mark.asyncio
+def test_log_probe(event_loop):
+    probe = LogProbe('^Listening on \\d+')
+    p0, p1 = probe.instance(), probe.instance()
+    splitter = p0.splitter(LineSplitter)()
+    assert splitter.feed(b'Starting\nListening on ') == ['Starting']
+    assert not (yield from p0.check(event_loop))
+    assert splitter.feed(b'80') == []
+    assert splitter.flush() == ['Listening on 80']
+    assert (yield from p0.check(event_loop))
+    # Each instance has its own state.
+    assert not (yield from p1.check(event_loop))
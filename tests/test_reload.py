@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import pytest
+import sys
+
+from strawboss.reload import FileWatcher, diff_process_types
+
+
+def test_diff_process_types():
+    old = {
+        'web': ('gunicorn app', {'DEBUG': '0'}),
+        'worker': ('celery worker', {'DEBUG': '0'}),
+        'clock': ('celery beat', {}),
+    }
+    new = {
+        'web': ('gunicorn app', {'DEBUG': '1'}),
+        'worker': ('celery worker', {'DEBUG': '0'}),
+        'cron': ('crond', {}),
+    }
+    assert diff_process_types(old, new) == (['cron'], ['clock'], ['web'])
+    assert diff_process_types(old, old) == ([], [], [])
+
+
+def watcher_factory(tmpdir, event_loop, duration=0.2, **kwds):
+    path = tmpdir.join('Procfile')
+    path.write('web: gunicorn app\n')
+    calls = []
+    @asyncio.coroutine
+    def callback():
+        calls.append(path.read())
+        yield from asyncio.sleep(duration, loop=event_loop)
+    watcher = FileWatcher(
+        [str(path)], callback, delay=0.1, interval=0.05, loop=event_loop,
+        **kwds
+    )
+    return path, calls, watcher
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_file_watcher(tmpdir, event_loop, use_inotify):
+    path, calls, watcher = watcher_factory(
+        tmpdir, event_loop, use_inotify=use_inotify,
+    )
+    watcher.start()
+    try:
+        if use_inotify and sys.platform.startswith('linux'):
+            assert watcher.method == 'inotify'
+        if not use_inotify:
+            assert watcher.method == 'polling'
+        # Unrelated files are ignored.
+        tmpdir.join('Procfile.swp').write('...')
+        yield from asyncio.sleep(0.3, loop=event_loop)
+        assert calls == []
+        # Changes in quick succession are debounced.
+        path.write('web: gunicorn app\nworker: celery\n')
+        yield from asyncio.sleep(0.02, loop=event_loop)
+        path.write('web: gunicorn app -w 4\n')
+        yield from asyncio.sleep(0.3, loop=event_loop)
+        assert calls == ['web: gunicorn app -w 4\n']
+        # Files replaced by a rename are seen as well.
+        tmpdir.join('Procfile.new').write('web: uwsgi\n')
+        os.rename(str(tmpdir.join('Procfile.new')), str(path))
+        yield from asyncio.sleep(0.5, loop=event_loop)
+        assert calls == ['web: gunicorn app -w 4\n', 'web: uwsgi\n']
+    finally:
+        yield from watcher.close()
+
+
+@pytest.mark.asyncio
+def test_file_watcher_serialized(tmpdir, event_loop):
+    path, calls, watcher = watcher_factory(tmpdir, event_loop, duration=0.4)
+    watcher.start()
+    try:
+        path.write('web: uwsgi\n')
+        yield from asyncio.sleep(0.15, loop=event_loop)
+        assert calls == ['web: uwsgi\n']
+        # Changes while the callback runs trigger another call afterwards.
+        path.write('web: uwsgi -p 4\n')
+        yield from asyncio.sleep(0.15, loop=event_loop)
+        assert len(calls) == 1
+        yield from asyncio.sleep(0.4, loop=event_loop)
+        assert calls == ['web: uwsgi\n', 'web: uwsgi -p 4\n']
+    finally:
+        yield from watcher.close()
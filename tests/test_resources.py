@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+import resource
+import shutil
+import subprocess
+
+from strawboss import _resource_limits, cli
+from strawboss.resources import (
+    IOPRIO_SET,
+    ResourceLimits,
+    parse_cpus,
+    parse_ionice,
+    parse_nice,
+    parse_rlimit,
+    spread_cpus,
+)
+from unittest import mock
+
+
+def test_rlimit():
+    assert parse_rlimit('nofile=4096') == (resource.RLIMIT_NOFILE, 4096)
+    assert parse_rlimit('AS=512M') == (resource.RLIMIT_AS, 512 * 1024 ** 2)
+    assert parse_rlimit('core=unlimited') == (
+        resource.RLIMIT_CORE, resource.RLIM_INFINITY,
+    )
+    with pytest.raises(ValueError) as exc:
+        print(parse_rlimit('files=10'))
+    assert str(exc.value) == 'Invalid resource limit "files=10".'
+
+
+def test_nice():
+    assert parse_nice('10') == 10
+    assert parse_nice('-5') == -5
+    with pytest.raises(ValueError) as exc:
+        print(parse_nice('20'))
+    assert str(exc.value) == 'Invalid niceness "20".'
+
+
+def test_ionice():
+    assert parse_ionice('idle') == (3, 4)
+    assert parse_ionice('best-effort:7') == (2, 7)
+    with pytest.raises(ValueError) as exc:
+        print(parse_ionice('best-effort:8'))
+    assert str(exc.value) == 'Invalid I/O scheduling class "best-effort:8".'
+
+
+def test_cpus():
+    assert parse_cpus('auto') == 'auto'
+    assert parse_cpus('3') == [3]
+    assert parse_cpus('0-3,8,2') == [0, 1, 2, 3, 8]
+    with pytest.raises(ValueError) as exc:
+        print(parse_cpus('0-'))
+    assert str(exc.value) == 'Invalid list of CPUs "0-".'
+
+
+@mock.patch('os.sched_getaffinity', create=True)
+def test_spread_cpus(sched_getaffinity, tmpdir):
+    sched_getaffinity.return_value = {0, 1, 2, 3, 4, 5, 8}
+    tmpdir.mkdir('node0').join('cpulist').write('0-2,6\n')
+    tmpdir.mkdir('node1').join('cpulist').write('3-5,7\n')
+    # Instances alternate between NUMA nodes.
+    assert spread_cpus(str(tmpdir)) == [0, 3, 1, 4, 2, 5, 8]
+    # Without NUMA information, use available CPUs in order.
+    assert spread_cpus(str(tmpdir.join('missing'))) == [0, 1, 2, 3, 4, 5, 8]
+
+
+@mock.patch('os.uname')
+def test_resource_limits_unsupported(uname):
+    uname.return_value = mock.Mock(machine='pdp11')
+    with pytest.raises(ValueError) as exc:
+        print(ResourceLimits(ionice=(3, 0)))
+    assert str(exc.value) == 'I/O scheduling classes are not supported.'
+
+
+def test_resource_limits_apply():
+    limits = ResourceLimits(
+        rlimits=[parse_rlimit('nofile=100')], nice=3,
+    )
+    output = subprocess.check_output(
+        ['sh', '-c', 'ulimit -n; nice'], preexec_fn=limits.apply,
+    )
+    assert output.decode('utf-8').split() == [
+        '100', str(os.nice(0) + 3),
+    ]
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'),
+                    reason="Requires CPU affinity.")
+def test_resource_limits_apply_affinity():
+    cpu = min(os.sched_getaffinity(0))
+    limits = ResourceLimits(cpus={cpu})
+    output = subprocess.check_output(
+        ['python3', '-c', 'import os; print(os.sched_getaffinity(0))'],
+        preexec_fn=limits.apply,
+    )
+    assert output.decode('utf-8').strip() == str({cpu})
+
+
+
+@pytest.mark.skipif(
+    os.uname().machine not in IOPRIO_SET or not shutil.which('ionice'),
+    reason="Requires I/O scheduling classes.",
+)
+def test_resource_limits_apply_ionice():
+    limits = ResourceLimits(ionice=parse_ionice('idle'))
+    output = subprocess.check_output(
+        ['sh', '-c', 'ionice -p $$'], preexec_fn=limits.apply,
+    )
+    assert output.decode('utf-8').strip() == 'idle'
+
+
+@mock.patch('strawboss.resources.spread_cpus')
+def test_resource_limits_by_instance(spread_cpus):
+    spread_cpus.return_value = [0, 4, 1, 5]
+    arguments = cli.parse_args([
+        '--rlimit', '*:nofile=1024',
+        '--rlimit', 'web:nofile=4096',
+        '--rlimit', 'web:nproc=100',
+        '--rlimit', 'web.1:nproc=50',
+        '--nice', 'worker:10',
+        '--cpu-affinity', 'web:auto',
+        '--cpu-affinity', 'web.2:6-7',
+        '--cpu-affinity', 'worker:2-3',
+    ])
+    def limits(label, index):
+        limits = _resource_limits(arguments, label, index)
+        return limits.rlimits, limits.nice, limits.cpus
+    assert limits('web', 0) == (sorted([
+        (resource.RLIMIT_NOFILE, 4096), (resource.RLIMIT_NPROC, 100),
+    ]), None, {0})
+    assert limits('web', 1) == (sorted([
+        (resource.RLIMIT_NOFILE, 4096), (resource.RLIMIT_NPROC, 50),
+    ]), None, {4})
+    assert limits('web', 2)[2] == {6, 7}
+    assert limits('web', 5)[2] == {4}
+    assert limits('worker', 0) == ([
+        (resource.RLIMIT_NOFILE, 1024),
+    ], 10, {2})
+    assert limits('worker', 1)[2] == {3}
+    arguments = cli.parse_args([])
+    assert _resource_limits(arguments, 'web', 0) is None
@@ -2,13 +2,20 @@
 
 import asyncio
 import datetime
+import os
 import pytest
+import re
+import signal
+import socket
 import sys
 
 from collections import deque
 from contextlib import contextmanager
 from random import randint
-from strawboss import run_once, run_and_respawn, now
+from strawboss import RespawnPolicy, run_once, run_and_respawn
+from strawboss.limits import OutputLimits
+from strawboss.output import Timestamps, now
+from strawboss.sockets import Listeners, parse_address
 from unittest.mock import patch
 
 from .conftest import capture_stdout
@@ -41,6 +48,7 @@ def test_run_once(event_loop, clock, subprocess_factory):
         )
         # Trigger EOF from the process.
         p.stdout.feed_eof()
+        p.stderr.feed_eof()
         sys.stderr.write('blocking on 3rd line.\n')
         line = yield from capture.readline()
         line = line.decode('utf-8').rstrip()
@@ -75,6 +83,73 @@ def test_run_once_shutdown(event_loop, clock, subprocess_factory):
         assert line == '%s [strawboss] worker.0(%d) spawned.' % (
             now().isoformat(), p.pid,
         )
+        # Stop the process early.
+        s.set_result(None)
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == '%s [strawboss] worker.0(%d) sent SIGTERM.' % (
+            now().isoformat(), p.pid,
+        )
+        assert p.signals == [signal.SIGTERM]
+        # Wait for the process to complete.
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == '%s [strawboss] worker.0(%d) completed with exit status %d.' % (
+            now().isoformat(), p.pid, -15,
+        )
+        # Check that we got the exit status.
+        status = yield from t
+        assert status == -15
+
+
+@pytest.mark.asyncio
+def test_run_once_shutdown_grace_period(event_loop, clock, subprocess_factory):
+    with capture_stdout() as capture:
+        # Start the process.
+        s = asyncio.Future()
+        t = event_loop.create_task(run_once(
+            'worker.0', 'work', None,
+            shutdown=s, loop=event_loop,
+            stop_signal=signal.SIGINT, grace_period=0.1,
+        ))
+        line = yield from capture.readline()
+        p = subprocess_factory.last_instance
+        # Stop the process early, but it refuses to complete.
+        p.ignore_signals = True
+        s.set_result(None)
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == '%s [strawboss] worker.0(%d) sent SIGINT.' % (
+            now().isoformat(), p.pid,
+        )
+        # It gets killed after the grace period.
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == '%s [strawboss] worker.0(%d) killed.' % (
+            now().isoformat(), p.pid,
+        )
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == '%s [strawboss] worker.0(%d) completed with exit status %d.' % (
+            now().isoformat(), p.pid, -9,
+        )
+        status = yield from t
+        assert status == -9
+        assert p.signals == [signal.SIGINT]
+
+
+@pytest.mark.asyncio
+def test_run_once_shutdown_no_grace_period(event_loop, clock,
+                                           subprocess_factory):
+    with capture_stdout() as capture:
+        # Start the process.
+        s = asyncio.Future()
+        t = event_loop.create_task(run_once(
+            'worker.0', 'work', None,
+            shutdown=s, loop=event_loop, grace_period=0,
+        ))
+        line = yield from capture.readline()
+        p = subprocess_factory.last_instance
         # Kill the process early.
         s.set_result(None)
         line = yield from capture.readline()
@@ -82,15 +157,14 @@ def test_run_once_shutdown(event_loop, clock, subprocess_factory):
         assert line == '%s [strawboss] worker.0(%d) killed.' % (
             now().isoformat(), p.pid,
         )
-        # Wait for the process to complete.
         line = yield from capture.readline()
         line = line.decode('utf-8').rstrip()
         assert line == '%s [strawboss] worker.0(%d) completed with exit status %d.' % (
             now().isoformat(), p.pid, -9,
         )
-        # Check that we got the exit status.
         status = yield from t
         assert status == -9
+        assert p.signals == []
 
 
 @pytest.mark.asyncio
@@ -151,6 +225,14 @@ def test_run_and_respawn(event_loop, clock, subprocess_factory):
         assert line == '%s [strawboss] worker.0(%d) completed with exit status %d.' % (
             now().isoformat(), p1.pid, 0,
         )
+        # Since the process exited right away, respawn is delayed.
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert re.match(
+            r'^%s \[strawboss\] worker\.0 exited after [\d.]+ seconds, '
+            r're-spawning in [\d.]+ seconds\.$' % (now().isoformat(),),
+            line,
+        )
         sys.stderr.write('blocking on 1st line.\n')
         line = yield from capture.readline()
         line = line.decode('utf-8').rstrip()
@@ -162,13 +244,355 @@ def test_run_and_respawn(event_loop, clock, subprocess_factory):
         s.set_result(None)
         line = yield from capture.readline()
         line = line.decode('utf-8').rstrip()
-        assert line == '%s [strawboss] worker.0(%d) killed.' % (
+        assert line == '%s [strawboss] worker.0(%d) sent SIGTERM.' % (
             now().isoformat(), p2.pid,
         )
         # Wait for the process to complete.
-        p2.mock_complete(-9)
+        p2.mock_complete(-15)
         line = yield from capture.readline()
         line = line.decode('utf-8').rstrip()
         assert line == '%s [strawboss] worker.0(%d) completed with exit status %d.' % (
-            now().isoformat(), p2.pid, -9,
+            now().isoformat(), p2.pid, -15,
+        )
+
+
+@pytest.mark.asyncio
+def test_run_once_batch(event_loop, clock, subprocess_factory):
+    with capture_stdout() as capture:
+        # Start the process.
+        s = asyncio.Future()
+        t = event_loop.create_task(run_once(
+            'worker.0', 'work', None,
+            shutdown=s, loop=event_loop,
+        ))
+        line = yield from capture.readline()
+        p = subprocess_factory.last_instance
+        # Send several lines at once, the last of which is incomplete.
+        p.stdout.feed_data(b'foo.\nbar.\nqu')
+        for expected in ('foo.', 'bar.'):
+            line = yield from capture.readline()
+            line = line.decode('utf-8').rstrip()
+            assert line == '%s [worker.0] %s' % (now().isoformat(), expected)
+        # Complete the partial line.
+        p.stdout.feed_data(b'x.\n')
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == '%s [worker.0] qux.' % (now().isoformat(),)
+        # Trailing data without a newline is flushed at EOF.
+        p.stdout.feed_data(b'meh.')
+        p.stdout.feed_eof()
+        p.stderr.feed_eof()
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == '%s [worker.0] meh.' % (now().isoformat(),)
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == '%s [strawboss] EOF from worker.0(%d).' % (
+            now().isoformat(), p.pid,
+        )
+        # Wait until the process completes.
+        p.mock_complete(0)
+        status = yield from t
+        assert status == 0
+
+
+def test_respawn_policy_backoff():
+    policy = RespawnPolicy(delay=0.5, max_delay=3.0, factor=2.0, jitter=0.0)
+    assert [policy.backoff(i) for i in range(6)] == [
+        0.0, 0.5, 1.0, 2.0, 3.0, 3.0,
+    ]
+    # Jitter is proportional to the delay.
+    policy = RespawnPolicy(delay=1.0, factor=2.0, jitter=0.25)
+    for _ in range(100):
+        assert 3.0 <= policy.backoff(3) <= 5.0
+
+
+def test_respawn_policy_crash_loop():
+    policy = RespawnPolicy(crash_limit=3, crash_period=10.0)
+    assert not policy.record_exit(0.0)
+    assert not policy.record_exit(5.0)
+    # Exits older than the crash period are forgotten.
+    assert not policy.record_exit(12.0)
+    assert not policy.failed
+    assert policy.record_exit(13.0)
+    assert policy.failed
+    # Only report the crash loop once.
+    assert not policy.record_exit(14.0)
+    # Policies can be reset.
+    policy.reset()
+    assert not policy.failed
+    assert not policy.record_exit(15.0)
+    # Crash loop detection can be disabled.
+    policy = RespawnPolicy(crash_limit=0)
+    for i in range(100):
+        assert not policy.record_exit(float(i))
+    assert not policy.failed
+
+
+@pytest.mark.asyncio
+def test_run_and_respawn_crash_loop(event_loop, clock, subprocess_factory):
+    with capture_stdout() as capture:
+        # Start the process.
+        s = asyncio.Future()
+        policy = RespawnPolicy(delay=0.01, jitter=0.0, crash_limit=3)
+        t = event_loop.create_task(run_and_respawn(
+            name='worker.0',
+            cmd='work',
+            env=None,
+            shutdown=s,
+            loop=event_loop,
+            respawn=policy,
+        ))
+        # Let the process crash right away, a few times in a row.
+        for i in range(3):
+            line = yield from capture.readline()
+            line = line.decode('utf-8').rstrip()
+            p = subprocess_factory.last_instance
+            assert line == '%s [strawboss] worker.0(%d) spawned.' % (
+                now().isoformat(), p.pid,
+            )
+            p.mock_complete(1)
+            line = yield from capture.readline()
+            line = line.decode('utf-8').rstrip()
+            assert line.endswith('completed with exit status 1.')
+            if i < 2:
+                line = yield from capture.readline()
+                line = line.decode('utf-8').rstrip()
+                assert 're-spawning in %.3f seconds' % (0.01 * 2 ** i) in line
+        # Process stops re-spawning without waiting for shutdown.
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == (
+            '%s [strawboss] worker.0 is crash-looping '
+            '(3 exits in 60 seconds), not re-spawning.' % (now().isoformat(),)
+        )
+        yield from t
+        assert policy.failed
+        assert len(subprocess_factory.instances) == 3
+
+
+@pytest.mark.asyncio
+def test_run_and_respawn_healthy_exits(event_loop, subprocess_factory):
+    # Exits after the minimum uptime never count as crashes.
+    s = asyncio.Future()
+    policy = RespawnPolicy(min_uptime=0.0, crash_limit=2)
+    t = event_loop.create_task(run_and_respawn(
+        name='worker.0',
+        cmd='work',
+        env=None,
+        shutdown=s,
+        loop=event_loop,
+        respawn=policy,
+        output=CollectingOutput(),
+    ))
+    for i in range(5):
+        yield from asyncio.sleep(0.01)
+        subprocess_factory.last_instance.mock_complete(0)
+    yield from asyncio.sleep(0.01)
+    assert not policy.failed
+    assert len(subprocess_factory.instances) == 6
+    s.set_result(None)
+    yield from asyncio.sleep(0.01)
+    subprocess_factory.last_instance.mock_complete(-15)
+    yield from t
+
+
+@pytest.mark.asyncio
+def test_run_and_respawn_spawn_error(event_loop):
+    output = CollectingOutput()
+    s = asyncio.Future()
+    policy = RespawnPolicy(delay=0.01, jitter=0.0, crash_limit=2)
+    yield from run_and_respawn(
+        name='worker.0',
+        cmd='/nonexistent/binary',
+        env=None,
+        shutdown=s,
+        loop=event_loop,
+        respawn=policy,
+        output=output,
+    )
+    # Spawn failures are reported and count as premature exits.
+    lines = [
+        line.split(' ', 1)[1] for line in output.text.strip().split('\n')
+    ]
+    assert lines[0].startswith(
+        '[strawboss] worker.0 could not be spawned: No such file or directory'
+    )
+    assert lines[1].startswith('[strawboss] worker.0 exited after ')
+    assert lines[3] == (
+        '[strawboss] worker.0 is crash-looping (2 exits in 60 seconds), '
+        'not re-spawning.'
+    )
+    assert policy.failed
+
+
+class CollectingOutput(object):
+
+    def __init__(self):
+        self.text = ''
+
+    @asyncio.coroutine
+    def write(self, text, count=1):
+        self.text += text
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', ['stream', 'protocol'])
+def test_run_once_separate_streams(event_loop, transport):
+    output = CollectingOutput()
+    errors = CollectingOutput()
+    # Fill the stderr pipe before writing to stdout: we must keep draining
+    # stderr while waiting for stdout.
+    script = '; '.join([
+        'import sys',
+        'sys.stderr.write("oops\\n" * 100000)',
+        'sys.stderr.flush()',
+        'print("done")',
+    ])
+    status = yield from run_once(
+        'worker.0', [sys.executable, '-c', script], None,
+        asyncio.Future(loop=event_loop), loop=event_loop,
+        output=output, stderr=errors, transport=transport,
+        timestamps=Timestamps(format='none'),
+    )
+    assert status == 0
+    lines = output.text.splitlines()
+    assert lines[1] == '[worker.0] done'
+    assert lines[2].startswith('[strawboss] EOF from worker.0(')
+    assert errors.text == '[worker.0:stderr] oops\n' * 100000
+
+
+class SlowOutput(CollectingOutput):
+
+    def __init__(self, loop, delay):
+        super().__init__()
+        self._loop = loop
+        self._delay = delay
+
+    @asyncio.coroutine
+    def write(self, text, count=1):
+        yield from asyncio.sleep(self._delay, loop=self._loop)
+        self.text += text
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', ['stream', 'protocol'])
+def test_run_once_slow_output(event_loop, transport):
+    output = SlowOutput(event_loop, 0.2)
+    script = '; '.join([
+        'import sys, time',
+        'print("foo")',
+        'sys.stdout.flush()',
+        'time.sleep(0.1)',
+        'print("bar")',
+    ])
+    # Output is still being written long after the process completes.
+    with patch('strawboss.EOF_TIMEOUT', 0.1):
+        status = yield from run_once(
+            'worker.0', [sys.executable, '-c', script], None,
+            asyncio.Future(loop=event_loop), loop=event_loop,
+            output=output, transport=transport,
+            timestamps=Timestamps(format='none'),
+        )
+    assert status == 0
+    lines = output.text.splitlines()
+    assert '[worker.0] foo' in lines
+    assert '[worker.0] bar' in lines
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', ['stream', 'protocol'])
+def test_run_once_discard(event_loop, transport):
+    output = CollectingOutput()
+    script = 'import sys; print("noise"); sys.stderr.write("oops\\n")'
+    status = yield from run_once(
+        'worker.0', [sys.executable, '-c', script], None,
+        asyncio.Future(loop=event_loop), loop=event_loop,
+        output=output, stdout=False, transport=transport,
+        timestamps=Timestamps(format='none'),
+    )
+    assert status == 0
+    assert 'noise' not in output.text
+    assert '[worker.0:stderr] oops\n' in output.text
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', ['stream', 'protocol'])
+def test_run_once_rate_limit(event_loop, transport):
+    output = CollectingOutput()
+    script = 'for i in range(100): print("line %d" % i)'
+    status = yield from run_once(
+        'worker.0', [sys.executable, '-c', script], None,
+        asyncio.Future(loop=event_loop), loop=event_loop,
+        output=output, transport=transport,
+        timestamps=Timestamps(format='none'),
+        limits=OutputLimits(rate=0.001, burst=10, report_interval=60.0),
+    )
+    assert status == 0
+    lines = output.text.splitlines()
+    assert [line for line in lines if ' line ' in line] == [
+        '[worker.0] line %d' % i for i in range(10)
+    ]
+    assert lines[-2] == '[strawboss] worker.0: 90 lines suppressed.'
+    assert lines[-1].endswith(' completed with exit status 0.')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', ['stream', 'protocol'])
+def test_run_once_long_lines(event_loop, transport):
+    output = CollectingOutput()
+    script = (
+        'import sys; '
+        'sys.stdout.buffer.write(b"x" * 10000 + b"\\xff\\n")'
+    )
+    status = yield from run_once(
+        'worker.0', [sys.executable, '-c', script], None,
+        asyncio.Future(loop=event_loop), loop=event_loop,
+        output=output, transport=transport,
+        timestamps=Timestamps(format='none'),
+        decode_errors='backslashreplace', max_line_length=4096,
+    )
+    assert status == 0
+    lines = output.text.splitlines()
+    assert lines[1:4] == [
+        '[worker.0] ' + 'x' * 4096,
+        '[worker.0] ' + 'x' * 4096,
+        '[worker.0] ' + 'x' * 1808 + '\\xff',
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', ['stream', 'protocol'])
+def test_run_once_listen_fds(event_loop, transport):
+    output = CollectingOutput()
+    listeners = Listeners([
+        parse_address('127.0.0.1:0'),
+        parse_address('127.0.0.1:0'),
+    ])
+    fds = listeners.fds(0)
+    ports = []
+    for fd in fds:
+        with socket.socket(fileno=os.dup(fd)) as sock:
+            ports.append(sock.getsockname()[1])
+    script = '; '.join([
+        'import os, socket',
+        'print(os.environ["LISTEN_FDS"])',
+        'print(os.environ["LISTEN_PID"] == str(os.getpid()))',
+        'print(socket.socket(fileno=3).getsockname()[1])',
+        'print(socket.socket(fileno=4).getsockname()[1])',
+    ])
+    try:
+        status = yield from run_once(
+            'web.0', [sys.executable, '-c', script], None,
+            asyncio.Future(loop=event_loop), loop=event_loop,
+            output=output, transport=transport,
+            timestamps=Timestamps(format='none'),
+            listen_fds=fds,
         )
+    finally:
+        listeners.close()
+    assert status == 0
+    lines = output.text.splitlines()
+    assert lines[1:5] == [
+        '[web.0] 2', '[web.0] True',
+        '[web.0] %d' % ports[0], '[web.0] %d' % ports[1],
+    ]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+import socket
+
+from strawboss.sockets import Listeners, listen_env, parse_address
+
+
+def test_parse_address():
+    assert parse_address('8000') == (socket.AF_INET, ('0.0.0.0', 8000))
+    assert parse_address('127.0.0.1:8000') == (
+        socket.AF_INET, ('127.0.0.1', 8000),
+    )
+    assert parse_address('[::1]:8000') == (socket.AF_INET6, ('::1', 8000))
+    assert parse_address('./web.sock') == (socket.AF_UNIX, './web.sock')
+    for value in ('web', '127.0.0.1:', '70000'):
+        with pytest.raises(ValueError) as exc:
+            print(parse_address(value))
+        assert str(exc.value) == 'Invalid address "%s".' % value
+
+
+def test_listen_env():
+    env = listen_env({'PATH': '/bin', 'LISTEN_PID': '1'}, [7, 8])
+    assert env == {'PATH': '/bin', 'LISTEN_FDS': '2'}
+
+
+def test_listeners_shared(unused_tcp_port):
+    listeners = Listeners([
+        parse_address('127.0.0.1:%d' % unused_tcp_port),
+    ])
+    try:
+        fds = listeners.fds(0)
+        assert listeners.fds(1) == fds
+        # Shared sockets survive instances.
+        listeners.release(0)
+        sock = socket.create_connection(('127.0.0.1', unused_tcp_port))
+        sock.close()
+    finally:
+        listeners.close()
+
+
+@pytest.mark.skipif(not hasattr(socket, 'SO_REUSEPORT'),
+                    reason="Requires SO_REUSEPORT.")
+def test_listeners_reuseport(unused_tcp_port, tmpdir):
+    path = str(tmpdir.join('web.sock'))
+    listeners = Listeners([
+        parse_address('127.0.0.1:%d' % unused_tcp_port),
+        parse_address(path),
+    ], reuseport=True)
+    try:
+        tcp0, unix0 = listeners.fds(0)
+        tcp1, unix1 = listeners.fds(1)
+        # Each instance has its own TCP socket, on the same port.
+        assert tcp0 != tcp1
+        assert unix0 == unix1
+        for fd in (tcp0, tcp1):
+            sock = socket.socket(fileno=os.dup(fd))
+            assert sock.getsockname()[1] == unused_tcp_port
+            sock.close()
+        listeners.release(1)
+        with pytest.raises(OSError):
+            os.fstat(tcp1)
+    finally:
+        listeners.close()
+    assert not os.path.exists(path)
+
+
+def test_listeners_address_in_use(unused_tcp_port):
+    listeners = Listeners([parse_address('127.0.0.1:%d' % unused_tcp_port)])
+    try:
+        with pytest.raises(OSError):
+            Listeners([parse_address('127.0.0.1:%d' % unused_tcp_port)])
+    finally:
+        listeners.close()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+import subprocess
+import sys
+
+import strawboss
+
+
+IMPORT_BUDGET = 0.5
+"""Maximum time (in seconds) to import ``strawboss`` in a new interpreter."""
+
+LAZY_MODULES = [
+    'dateutil', 'dotenvfile', 'pkg_resources', 'procfile',
+    'strawboss.control', 'strawboss.environment', 'strawboss.limits',
+    'strawboss.logs', 'strawboss.metrics', 'strawboss.profiling',
+    'strawboss.readiness', 'strawboss.reload', 'strawboss.resources',
+    'strawboss.sockets', 'strawboss.watchdog',
+]
+"""Modules that must not be imported until they are needed."""
+
+
+def import_strawboss():
+    """Imports ``strawboss`` in a new interpreter.
+
+    :return: The time it took to import (in seconds) and the list of imported
+       modules.
+    """
+    script = '; '.join([
+        'import json, sys, time',
+        't = time.perf_counter()',
+        'import strawboss',
+        't = time.perf_counter() - t',
+        'print(json.dumps([t, sorted(sys.modules)]))',
+    ])
+    command = [sys.executable, '-c', script]
+    if sys.version_info >= (3, 7):
+        command[1:1] = ['-X', 'importtime']
+    process = subprocess.run(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+    )
+    elapsed, modules = json.loads(process.stdout.decode('utf-8'))
+    # Prefer the cumulative time reported by ``-X importtime``, which excludes
+    # the time spent measuring.
+    match = re.search(
+        r'^import time:\s+\d+ \|\s+(\d+) \| strawboss$',
+        process.stderr.decode('utf-8'), re.MULTILINE,
+    )
+    if match:
+        elapsed = int(match.group(1)) / 1e6
+    return elapsed, modules
+
+
+def test_import_is_lazy():
+    _, modules = import_strawboss()
+    for name in LAZY_MODULES:
+        assert name not in modules
+
+
+def test_import_time():
+    elapsed = min(import_strawboss()[0] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET
+
+
+def test_version():
+    path = os.path.join(os.path.dirname(strawboss.__file__), 'version.txt')
+    with open(path, 'r') as stream:
+        assert strawboss.version == stream.read().strip()
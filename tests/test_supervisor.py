@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+import signal
+
+from strawboss import RespawnPolicy, Supervisor
+from strawboss.logs import LogDirectory
+from strawboss.output import now
+from strawboss.readiness import LogProbe
+from strawboss.resources import ResourceLimits
+
+from .conftest import capture_stdout
+
+
+@pytest.mark.asyncio
+def test_supervisor_scale(event_loop, clock, subprocess_factory):
+    with capture_stdout() as capture:
+        supervisor = Supervisor(loop=event_loop)
+        supervisor.add_process_type('web', 'work', None)
+        assert supervisor.process_types == {'web'}
+        assert supervisor.count('web') == 0
+        # Scale up.
+        supervisor.scale('web', 2)
+        assert supervisor.count('web') == 2
+        lines = set()
+        for _ in range(2):
+            line = yield from capture.readline()
+            lines.add(line.decode('utf-8').rstrip())
+        p0, p1 = subprocess_factory.instances
+        assert lines == {
+            '%s [strawboss] web.0(%d) spawned.' % (now().isoformat(), p0.pid),
+            '%s [strawboss] web.1(%d) spawned.' % (now().isoformat(), p1.pid),
+        }
+        # Scale down, only the last instance is stopped.
+        supervisor.scale('web', 1)
+        assert supervisor.count('web') == 1
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == '%s [strawboss] web.1(%d) sent SIGTERM.' % (
+            now().isoformat(), p1.pid,
+        )
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        assert line == (
+            '%s [strawboss] web.1(%d) completed with exit status -15.' % (
+                now().isoformat(), p1.pid,
+            )
+        )
+        assert not p0._future.done()
+        # Scale up again, the first instance is still not affected.
+        supervisor.scale('web', 2)
+        line = yield from capture.readline()
+        line = line.decode('utf-8').rstrip()
+        p2 = subprocess_factory.last_instance
+        assert line == '%s [strawboss] web.1(%d) spawned.' % (
+            now().isoformat(), p2.pid,
+        )
+        assert not p0._future.done()
+        # Stop everything.
+        supervisor.stop()
+        yield from supervisor.wait()
+        assert p0._future.done()
+        assert p2._future.done()
+        # Can't scale after stopping.
+        supervisor.scale('web', 3)
+        assert supervisor.count('web') == 2
+
+
+@pytest.mark.asyncio
+def test_supervisor_scale_crash_loop(event_loop, subprocess_factory):
+    with capture_stdout():
+        supervisor = Supervisor(loop=event_loop)
+        policy = RespawnPolicy(crash_limit=1)
+        supervisor.add_process_type('web', 'work', None, respawn=policy)
+        supervisor.add_process_type('worker', 'work', None)
+        supervisor.scale('web', 2)
+        supervisor.scale('worker', 1)
+        yield from asyncio.sleep(0.01)
+        p0, p1, _ = subprocess_factory.instances
+        # The process type stops re-spawning.
+        p0.mock_complete(1)
+        yield from asyncio.sleep(0.01)
+        assert policy.failed
+        p1.mock_complete(1)
+        yield from asyncio.sleep(0.01)
+        assert len(subprocess_factory.instances) == 3
+        # Scaling gives it a new chance.
+        supervisor.scale('web', 2)
+        yield from asyncio.sleep(0.01)
+        assert not policy.failed
+        assert len(subprocess_factory.instances) == 5
+        supervisor.stop()
+        yield from supervisor.wait()
+
+
+@pytest.mark.asyncio
+def test_supervisor_scale_to_zero(event_loop, subprocess_factory):
+    with capture_stdout():
+        supervisor = Supervisor(loop=event_loop)
+        supervisor.add_process_type('web', 'work', None)
+        supervisor.scale('web', 1)
+        yield from asyncio.sleep(0.0)
+        supervisor.scale('web', 0)
+        # Nothing left to run.
+        yield from supervisor.wait()
+        assert len(subprocess_factory.instances) == 1
+
+
+def test_supervisor_unknown_process_type(event_loop):
+    supervisor = Supervisor(loop=event_loop)
+    with pytest.raises(KeyError):
+        supervisor.scale('web', 1)
+
+@pytest.mark.asyncio
+def test_supervisor_logs(event_loop, clock, subprocess_factory, tmpdir):
+    with capture_stdout() as capture:
+        logs = LogDirectory(str(tmpdir), loop=event_loop)
+        supervisor = Supervisor(loop=event_loop, logs=logs)
+        supervisor.add_process_type('web', 'work', None)
+        supervisor.add_process_type('worker', 'work', None, stderr=False)
+        supervisor.scale('web', 2)
+        supervisor.scale('worker', 1)
+        for _ in range(3):
+            yield from capture.readline()
+        p0, p1, p2 = subprocess_factory.instances
+        for p in subprocess_factory.instances:
+            p.stdout.feed_data(b'out\n')
+            p.stderr.feed_data(b'err\n')
+        yield from asyncio.sleep(0.1, loop=event_loop)
+        supervisor.stop()
+        yield from supervisor.wait()
+        yield from logs.close()
+    def read(name):
+        with open(str(tmpdir.join(name)), 'r') as stream:
+            return set(stream.read().strip().split('\n'))
+    assert read('web.0.log') == {
+        '%s [web.0] out' % now().isoformat(),
+        '%s [web.0:stderr] err' % now().isoformat(),
+    }
+    assert read('web.1.log') == {
+        '%s [web.1] out' % now().isoformat(),
+        '%s [web.1:stderr] err' % now().isoformat(),
+    }
+    assert read('worker.0.log') == {
+        '%s [worker.0] out' % now().isoformat(),
+    }
+
+
+@pytest.mark.asyncio
+def test_supervisor_resources(event_loop, subprocess_factory):
+    limits = {0: ResourceLimits(nice=1), 1: None}
+    supervisor = Supervisor(loop=event_loop)
+    supervisor.add_process_type('web', 'work', None, resources=limits.get)
+    supervisor.scale('web', 2)
+    while len(subprocess_factory.instances) < 2:
+        yield from asyncio.sleep(0.01, loop=event_loop)
+    p0, p1 = subprocess_factory.instances
+    assert p0._kwds['preexec_fn'] == limits[0].apply
+    assert p1._kwds['preexec_fn'] is None
+    supervisor.stop()
+    yield from supervisor.wait()
+
+
+@pytest.mark.asyncio
+def test_supervisor_restart(event_loop, subprocess_factory):
+    with capture_stdout():
+        supervisor = Supervisor(loop=event_loop)
+        supervisor.add_process_type('web', 'work', None)
+        supervisor.scale('web', 2)
+        while len(subprocess_factory.instances) < 2:
+            yield from asyncio.sleep(0.01, loop=event_loop)
+        p0, p1 = subprocess_factory.instances
+        # Only the restarted instance is stopped and it is re-spawned right
+        # away, even though it didn't run for long.
+        assert supervisor.restart('web.1')
+        while len(subprocess_factory.instances) < 3:
+            yield from asyncio.sleep(0.01, loop=event_loop)
+        assert p1._future.done()
+        assert not p0._future.done()
+        assert supervisor.count('web') == 2
+        # Unknown instances can't be restarted.
+        assert not supervisor.restart('web.2')
+        assert not supervisor.restart('worker.0')
+        assert not supervisor.restart('web')
+        supervisor.stop()
+        assert not supervisor.restart('web.0')
+        yield from supervisor.wait()
+        assert len(subprocess_factory.instances) == 3
+
+
+@pytest.mark.asyncio
+def test_supervisor_dependencies(event_loop, subprocess_factory):
+    with capture_stdout() as capture:
+        supervisor = Supervisor(loop=event_loop)
+        supervisor.add_process_type('web', 'serve', None, depends_on=['db'])
+        supervisor.add_process_type('db', 'db', None,
+                                    probe=LogProbe('^listening'))
+        supervisor.add_process_type('worker', 'work', None)
+        supervisor.scale('web', 1)
+        supervisor.scale('db', 1)
+        supervisor.scale('worker', 1)
+        # Process types that don't depend on others start right away.
+        while len(subprocess_factory.instances) < 2:
+            yield from asyncio.sleep(0.01, loop=event_loop)
+        db, _ = subprocess_factory.instances
+        assert supervisor.count('web') == 0
+        # Scaling a waiting process type only changes what will be started.
+        supervisor.scale('web', 2)
+        db.stdout.feed_data(b'listening on port 5432\n')
+        yield from supervisor.ready('db')
+        while len(subprocess_factory.instances) < 4:
+            yield from asyncio.sleep(0.01, loop=event_loop)
+        assert supervisor.count('web') == 2
+        supervisor.stop()
+        yield from supervisor.wait()
+        capture.feed_eof()
+        lines = set()
+        while True:
+            line = yield from capture.readline()
+            line = line.decode('utf-8').rstrip()
+            if not line:
+                break
+            lines.add(line.split(' ', 1)[1])
+        assert '[strawboss] web waiting for db to be ready.' in lines
+        assert '[strawboss] db.0(%d) is ready.' % db.pid in lines
+
+
+@pytest.mark.asyncio
+def test_supervisor_dependencies_timeout(event_loop, subprocess_factory):
+    with capture_stdout():
+        supervisor = Supervisor(loop=event_loop, ready_timeout=0.05)
+        supervisor.add_process_type('web', 'serve', None, depends_on=['db'])
+        supervisor.add_process_type('db', 'db', None,
+                                    probe=LogProbe('^listening'))
+        supervisor.scale('web', 1)
+        supervisor.scale('db', 1)
+        # Start anyways when dependencies don't get ready in time.
+        while len(subprocess_factory.instances) < 2:
+            yield from asyncio.sleep(0.01, loop=event_loop)
+        assert supervisor.count('web') == 1
+        supervisor.stop()
+        yield from supervisor.wait()
+
+
+@pytest.mark.asyncio
+def test_supervisor_dependencies_stop(event_loop, subprocess_factory):
+    supervisor = Supervisor(loop=event_loop)
+    supervisor.add_process_type('web', 'serve', None, depends_on=['db'])
+    supervisor.add_process_type('db', 'db', None)
+    supervisor.scale('web', 1)
+    # Process types that are waiting are never started.
+    supervisor.stop()
+    yield from supervisor.wait()
+    assert supervisor.count('web') == 0
+
+
+class Listeners(object):
+
+    def __init__(self):
+        self.released = []
+
+    def fds(self, index):
+        return [100 + index]
+
+    def release(self, index):
+        self.released.append(index)
+
+
+@pytest.mark.asyncio
+def test_supervisor_listeners(event_loop, subprocess_factory):
+    listeners = Listeners()
+    with capture_stdout():
+        supervisor = Supervisor(loop=event_loop)
+        supervisor.add_process_type('web', 'serve', None,
+                                    listeners=listeners)
+        supervisor.scale('web', 2)
+        while len(subprocess_factory.instances) < 2:
+            yield from asyncio.sleep(0.01, loop=event_loop)
+        p0, p1 = subprocess_factory.instances
+        assert p0._kwds['env']['LISTEN_FDS'] == '1'
+        assert p0._kwds['close_fds'] is False
+        # Sockets are released when instances are scaled down.
+        supervisor.scale('web', 1)
+        assert listeners.released == [1]
+        supervisor.stop()
+        yield from supervisor.wait()
+
+
+@asyncio.coroutine
+def wait_for_instances(factory, count, loop):
+    while len(factory.instances) < count:
+        yield from asyncio.sleep(0.01, loop=loop)
+    return factory.instances
+
+
+@pytest.mark.asyncio
+def test_supervisor_rolling_restart(event_loop, subprocess_factory):
+    with capture_stdout():
+        supervisor = Supervisor(loop=event_loop)
+        supervisor.add_process_type('web', 'serve', None,
+                                    probe=LogProbe('^ready'))
+        supervisor.scale('web', 2)
+        p0, p1 = yield from wait_for_instances(
+            subprocess_factory, 2, event_loop,
+        )
+        # The replacement is started before the old instance is stopped.
+        task = supervisor.rolling_restart('web', surge=1)
+        assert supervisor.rolling_restart('web') is None
+        p0, p1, p2 = yield from wait_for_instances(
+            subprocess_factory, 3, event_loop,
+        )
+        yield from asyncio.sleep(0.05, loop=event_loop)
+        assert not p0._future.done()
+        p2.stdout.feed_data(b'ready\n')
+        p0, p1, p2, p3 = yield from wait_for_instances(
+            subprocess_factory, 4, event_loop,
+        )
+        assert p0.signals == [signal.SIGTERM]
+        assert not p1._future.done()
+        p3.stdout.feed_data(b'ready\n')
+        yield from task
+        yield from asyncio.sleep(0.01, loop=event_loop)
+        assert p1.signals == [signal.SIGTERM]
+        assert supervisor.count('web') == 2
+        # New instances replaced the old ones.
+        assert supervisor.restart('web.0')
+        yield from wait_for_instances(subprocess_factory, 5, event_loop)
+        assert p2._future.done()
+        supervisor.stop()
+        yield from supervisor.wait()
+        assert p3._future.done()
+
+
+@pytest.mark.asyncio
+def test_supervisor_rolling_restart_unavailable(event_loop,
+                                                subprocess_factory):
+    with capture_stdout():
+        supervisor = Supervisor(loop=event_loop)
+        supervisor.add_process_type('web', 'serve', None)
+        supervisor.scale('web', 2)
+        yield from wait_for_instances(subprocess_factory, 2, event_loop)
+        # Both instances are replaced at once, one of them is stopped right
+        # away.
+        task = supervisor.rolling_restart('web', surge=1, max_unavailable=1,
+                                          delay=0.1)
+        p0, p1, _, _ = yield from wait_for_instances(
+            subprocess_factory, 4, event_loop,
+        )
+        yield from asyncio.sleep(0.01, loop=event_loop)
+        assert p0._future.done()
+        assert not p1._future.done()
+        yield from task
+        yield from asyncio.sleep(0.01, loop=event_loop)
+        assert p1._future.done()
+        supervisor.stop()
+        yield from supervisor.wait()
+
+
+@pytest.mark.asyncio
+def test_supervisor_rolling_restart_aborted(event_loop, subprocess_factory):
+    with capture_stdout():
+        supervisor = Supervisor(loop=event_loop, ready_timeout=0.05)
+        supervisor.add_process_type('web', 'serve', None,
+                                    probe=LogProbe('^ready'))
+        supervisor.scale('web', 2)
+        yield from wait_for_instances(subprocess_factory, 2, event_loop)
+        yield from supervisor.rolling_restart('web')
+        yield from asyncio.sleep(0.01, loop=event_loop)
+        # The replacement never got ready, keep the old instance.
+        p0, p1, p2 = subprocess_factory.instances
+        assert p2.signals == [signal.SIGTERM]
+        assert not p0._future.done()
+        assert not p1._future.done()
+        assert supervisor.restart('web.0')
+        yield from wait_for_instances(subprocess_factory, 4, event_loop)
+        assert p0._future.done()
+        supervisor.stop()
+        yield from supervisor.wait()
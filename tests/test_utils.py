@@ -1,8 +1,31 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import pytest
+import signal
 
-from strawboss import parse_scale, merge_envs, now
+from strawboss import (
+    lookup_instance,
+    lookup_process_type,
+    make_event_loop,
+    merge_envs,
+    parse_crash_loop,
+    parse_grace_period,
+    parse_interval,
+    parse_line_length,
+    parse_percent,
+    parse_rate_limit,
+    parse_sample,
+    parse_scale,
+    parse_signal,
+    parse_size,
+    parse_sink,
+    parse_watchdog_action,
+    per_process_type,
+    signal_name,
+)
+from strawboss.output import now
+from unittest import mock
 
 def test_scale():
     assert parse_scale('foo:2') == ('foo', 2)
@@ -12,6 +35,110 @@ def test_scale_invlid():
         print(parse_scale('foo:bar'))
     assert str(exc.value) == 'Invalid scale "foo:bar".'
 
+def test_crash_loop():
+    assert parse_crash_loop('5:30') == (5, 30.0)
+    assert parse_crash_loop('5:0.5') == (5, 0.5)
+
+def test_crash_loop_invalid():
+    with pytest.raises(ValueError) as exc:
+        print(parse_crash_loop('5'))
+    assert str(exc.value) == 'Invalid crash loop threshold "5".'
+
+def test_signal():
+    assert parse_signal('SIGTERM') == signal.SIGTERM
+    assert parse_signal('int') == signal.SIGINT
+    assert parse_signal('9') == signal.SIGKILL
+
+def test_signal_invalid():
+    for x in ('SIGMEH', '999'):
+        with pytest.raises(ValueError) as exc:
+            print(parse_signal(x))
+        assert str(exc.value) == 'Invalid signal "%s".' % x
+
+def test_signal_name():
+    assert signal_name(signal.SIGTERM) == 'SIGTERM'
+    assert signal_name(999) == 'signal 999'
+
+def test_grace_period():
+    assert parse_grace_period('0') == 0.0
+    assert parse_grace_period('2.5') == 2.5
+    with pytest.raises(ValueError) as exc:
+        print(parse_grace_period('-1'))
+    assert str(exc.value) == 'Invalid grace period "-1".'
+
+def test_interval():
+    assert parse_interval('2.5') == 2.5
+    for value in ('0', '-1'):
+        with pytest.raises(ValueError) as exc:
+            print(parse_interval(value))
+        assert str(exc.value) == 'Invalid interval "%s".' % value
+
+def test_size():
+    assert parse_size('0') == 0
+    assert parse_size('512') == 512
+    assert parse_size('10K') == 10 * 1024
+    assert parse_size('10m') == 10 * 1024 ** 2
+    assert parse_size('1G') == 1024 ** 3
+    with pytest.raises(ValueError) as exc:
+        print(parse_size('-1M'))
+    assert str(exc.value) == 'Invalid size "-1M".'
+
+def test_line_length():
+    assert parse_line_length('4') == 4
+    assert parse_line_length('64K') == 64 * 1024
+    for value in ('0', '3', 'x'):
+        with pytest.raises(ValueError):
+            print(parse_line_length(value))
+
+def test_rate_limit():
+    assert parse_rate_limit('100') == (100.0, None)
+    assert parse_rate_limit('0.5:10') == (0.5, 10)
+    with pytest.raises(ValueError) as exc:
+        print(parse_rate_limit('fast'))
+    assert str(exc.value) == 'Invalid rate limit "fast".'
+
+def test_sample():
+    assert parse_sample('1') == 1
+    assert parse_sample('100') == 100
+    with pytest.raises(ValueError) as exc:
+        print(parse_sample('0'))
+    assert str(exc.value) == 'Invalid sampling rate "0".'
+
+def test_percent():
+    assert parse_percent('50') == 50.0
+    assert parse_percent('150.5') == 150.5
+    for value in ('0', '-5', 'lots'):
+        with pytest.raises(ValueError):
+            print(parse_percent(value))
+
+def test_watchdog_action():
+    assert parse_watchdog_action('restart') == 'restart'
+    assert parse_watchdog_action('alert') == 'alert'
+    with pytest.raises(ValueError):
+        print(parse_watchdog_action('reboot'))
+
+def test_sink():
+    assert parse_sink('terminal') == 'terminal'
+    assert parse_sink('logs/web.log') == 'logs/web.log'
+    with pytest.raises(ValueError) as exc:
+        print(parse_sink(' '))
+    assert str(exc.value) == 'Invalid output destination " ".'
+
+def test_per_process_type():
+    parse = per_process_type(parse_signal)
+    assert parse('web:SIGINT') == ('web', signal.SIGINT)
+    assert parse('*:TERM') == ('*', signal.SIGTERM)
+    with pytest.raises(ValueError) as exc:
+        print(parse('web'))
+    assert str(exc.value) == 'Invalid value "web".'
+    with pytest.raises(ValueError):
+        print(parse('web:MEH'))
+
+def test_lookup_process_type():
+    values = [('*', 1), ('web', 2)]
+    assert lookup_process_type(values, 'web') == 2
+    assert lookup_process_type(values, 'worker') == 1
+
 def test_merge_envs_0_dicts():
     assert merge_envs() == {}
 
@@ -26,3 +153,30 @@ def test_merge_envs_1_dict():
 def test_now():
     assert now().tzinfo is None
     assert now(utc=True).tzinfo is not None
+
+def test_make_event_loop_asyncio(event_loop):
+    assert make_event_loop('asyncio') is asyncio.get_event_loop()
+
+def test_make_event_loop_auto_without_uvloop(event_loop):
+    with mock.patch.dict('sys.modules', {'uvloop': None}):
+        assert make_event_loop('auto') is asyncio.get_event_loop()
+
+def test_make_event_loop_uvloop_not_installed(event_loop):
+    with mock.patch.dict('sys.modules', {'uvloop': None}):
+        with pytest.raises(ImportError):
+            make_event_loop('uvloop')
+
+def test_make_event_loop_uvloop(event_loop):
+    uvloop = mock.MagicMock()
+    with mock.patch.dict('sys.modules', {'uvloop': uvloop}):
+        with mock.patch('asyncio.set_event_loop') as set_event_loop:
+            loop = make_event_loop('auto')
+    assert loop is uvloop.new_event_loop.return_value
+    set_event_loop.assert_called_once_with(loop)
+
+def test_lookup_instance():
+    values = [('*', 1), ('web', 2), ('web.1', 3)]
+    assert lookup_instance(values, 'web.0') == ('web', 2)
+    assert lookup_instance(values, 'web.1') == ('web.1', 3)
+    assert lookup_instance(values, 'worker.0') == ('*', 1)
+    assert lookup_instance([], 'worker.0') == (None, None)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import pytest
+
+from strawboss.output import TextFormat, Timestamps
+from strawboss.watchdog import Watchdog, WatchdogPolicy
+
+
+def write_usage(tmpdir, pid, cpu_ticks, rss_pages):
+    proc = tmpdir.join(str(pid))
+    proc.ensure(dir=True)
+    proc.join('stat').write(
+        ('%d (work) S 1 1 1 0 -1 0 0 0 0 0 %d 0 0 0 20 0 1 0 1 1 1' % (
+            pid, cpu_ticks,
+        )).encode('ascii'),
+        mode='wb',
+    )
+    proc.join('statm').write(
+        ('1000 %d 0 0 0 0 0\n' % rss_pages).encode('ascii'), mode='wb',
+    )
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Harness(object):
+
+    def __init__(self, loop, tmpdir, **kwds):
+        self.lines = []
+        self.restarts = []
+        self.clock = Clock()
+        self.watchdog = Watchdog(
+            restart=self.restart,
+            write=self.write,
+            formatter=TextFormat(Timestamps(format='none')),
+            loop=loop,
+            proc=str(tmpdir),
+            clock=self.clock,
+            **kwds
+        )
+
+    def restart(self, name):
+        self.restarts.append(name)
+        return True
+
+    @asyncio.coroutine
+    def write(self, text, count=1):
+        self.lines.append(text.rstrip())
+
+
+def test_watchdog_policy():
+    policy = WatchdogPolicy(max_rss=1024 ** 2, max_cpu=50.0)
+    assert policy.check(1024 ** 2, 50.0) is None
+    assert policy.check(2 * 1024 ** 2, None) == (
+        'resident memory 2.0 MiB > 1.0 MiB'
+    )
+    assert policy.check(0, 75.0) == 'CPU usage 75.0% > 50.0%'
+    assert policy.check(0, None) is None
+    with pytest.raises(ValueError):
+        WatchdogPolicy(action='explode')
+
+
+@pytest.mark.asyncio
+def test_watchdog_restart_staggered(event_loop, tmpdir):
+    page = os.sysconf('SC_PAGE_SIZE')
+    h = Harness(event_loop, tmpdir, stagger=5.0)
+    h.watchdog.add_process_type('web', WatchdogPolicy(max_rss=100 * page))
+    for pid in (10, 11):
+        write_usage(tmpdir, pid, 0, 200)
+    h.watchdog.spawned('web.0', 10)
+    h.watchdog.spawned('web.1', 11)
+    # Processes of other types are not watched.
+    h.watchdog.spawned('worker.0', 12)
+    write_usage(tmpdir, 12, 0, 200)
+    # Both instances are over the limit, but only one is restarted.
+    yield from h.watchdog.sample()
+    assert len(h.restarts) == 1
+    first = h.restarts[0]
+    second, pid = ('web.1', 11) if first == 'web.0' else ('web.0', 10)
+    assert len(h.lines) == 3
+    yield from h.watchdog.sample()
+    assert h.restarts == [first]
+    assert len(h.lines) == 3
+    # Wait until the restarted instance is running again and warmed up.
+    h.watchdog.exited(first, 21 - pid, -15)
+    h.watchdog.spawned(first, 20)
+    write_usage(tmpdir, 20, 0, 10)
+    yield from h.watchdog.sample()
+    assert h.restarts == [first]
+    h.clock.now = 5.0
+    yield from h.watchdog.sample()
+    assert h.restarts == [first, second]
+    assert h.lines[-1] == '[strawboss] %s(%d) restarted by watchdog.' % (
+        second, pid,
+    )
+
+
+@pytest.mark.asyncio
+def test_watchdog_cpu(event_loop, tmpdir):
+    ticks = os.sysconf('SC_CLK_TCK')
+    h = Harness(event_loop, tmpdir)
+    h.watchdog.add_process_type(
+        'web', WatchdogPolicy(max_cpu=50.0, action='log'),
+    )
+    h.watchdog.spawned('web.0', 10)
+    write_usage(tmpdir, 10, 0, 1)
+    # The first sample only sets the baseline.
+    yield from h.watchdog.sample()
+    assert h.lines == []
+    h.clock.now = 10.0
+    write_usage(tmpdir, 10, 8 * ticks, 1)
+    yield from h.watchdog.sample()
+    assert h.lines == [
+        '[strawboss] web.0(10) exceeds watchdog limit: '
+        'CPU usage 80.0% > 50.0%.',
+    ]
+    # Breaches are reported once and the process is left alone.
+    h.clock.now = 20.0
+    write_usage(tmpdir, 10, 16 * ticks, 1)
+    yield from h.watchdog.sample()
+    assert len(h.lines) == 1
+    assert h.restarts == []
+
+
+@pytest.mark.asyncio
+def test_watchdog_alert(event_loop, tmpdir):
+    page = os.sysconf('SC_PAGE_SIZE')
+    path = tmpdir.join('alert.txt')
+    h = Harness(
+        event_loop, tmpdir.mkdir('proc'),
+        alert='echo "$STRAWBOSS_INSTANCE $STRAWBOSS_PID" > %s' % path,
+    )
+    h.watchdog.add_process_type(
+        'web', WatchdogPolicy(max_rss=page, action='alert'),
+    )
+    h.watchdog.spawned('web.0', 10)
+    write_usage(tmpdir.join('proc'), 10, 0, 2)
+    yield from h.watchdog.sample()
+    yield from h.watchdog.close()
+    assert path.read() == 'web.0 10\n'
+    assert h.restarts == []